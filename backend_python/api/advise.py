@@ -1,9 +1,19 @@
-from fastapi import APIRouter, HTTPException
-from models.schemas import AdviseRequest, AdviseResponse, Restaurant
-from services.openai_service import generate_azure_openai_recommendation
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from models.schemas import AdviseBatchResponse, AdviseRequest, AdviseResponse, Restaurant
+from services.openai_service import (
+    generate_azure_openai_recommendation,
+    generate_azure_openai_recommendations,
+    get_sample_restaurant,
+    stream_azure_openai_recommendation,
+)
 # from services.bing_service import search_bing_for_restaurant, BING_API_KEY
-from services.restaurant_data import RESTAURANT_DATA
-from utils.imageUtils import ImageUtils
+from services.restaurant_catalog import restaurant_catalog
+from services.session_store import session_store
+from services.warm_pool import warm_pool
+from utils.restaurant_parser import RestaurantStreamParser
+from utils.image_probe import image_prober
+import json
 import random
 import logging
 
@@ -37,165 +47,324 @@ def get_website_url(restaurant_data):
     clean_name = name.lower().replace(' ', '').replace("'", '')
     return f"https://www.{clean_name}.com"
 
+description_templates = [
+    "Looking for a {vibe} spot with {cuisine} cuisine in {location}? I have just the place for you: {name}! {description}",
+    "Based on your vibe for {vibe} and love for {cuisine}, you should definitely check out {name} in {location}! {description}",
+    "For your perfect {vibe} experience, {name} in {location} serves amazing {cuisine} dishes. {description}",
+    "Feeling like {vibe}? {name} in {location} is a fantastic {cuisine} restaurant that fits your style! {description}",
+    "{name} is a {cuisine} gem in {location} that matches your {vibe} vibe perfectly. {description}",
+]
+
+def build_recommendation_text(restaurant_data: dict, vibe: str, cuisine: str, location: str) -> str:
+    return random.choice(description_templates).format(
+        vibe=vibe.lower(),
+        cuisine=cuisine.lower(),
+        location=location,
+        name=restaurant_data.get('name', 'this spot'),
+        description=restaurant_data.get('description', '')
+    )
+
+GENERIC_IMAGE_URL = "https://source.unsplash.com/featured/?restaurant"
+
+def cuisine_image_url(cuisine: str) -> str:
+    cuisine_keyword = cuisine.replace(' ', '+')
+    return f"https://source.unsplash.com/featured/?{cuisine_keyword},restaurant"
+
+def choose_image_url(image_url: str, cuisine: str) -> str:
+    """
+    Pick the image URL for a response from cached probe verdicts only.
+
+    Never waits on an image host: an unknown URL is probed in the background
+    for next time and the cuisine fallback is used meanwhile.
+    """
+    fallback_url = cuisine_image_url(cuisine)
+    if image_url and image_url != fallback_url:
+        verdict = image_prober.cached_verdict(image_url)
+        if verdict:
+            return image_url
+        if verdict is None:
+            image_prober.probe_in_background(image_url)
+        else:
+            logger.warning(f"Image URL {image_url} is not accessible, using fallback")
+
+    if image_prober.cached_verdict(fallback_url) is False:
+        logger.warning(f"Fallback image URL {fallback_url} is not accessible, using generic fallback")
+        return GENERIC_IMAGE_URL
+    return fallback_url
+
+def build_ai_response(restaurant_data: dict, vibe: str, cuisine: str, location: str, budget: str) -> AdviseResponse:
+    """Turn an LLM restaurant dict into the AdviseResponse returned to the app."""
+    # Process menu items if available
+    menu_items = []
+    if "menuItems" in restaurant_data:
+        menu_items = restaurant_data["menuItems"]
+    else:
+        # Generate some basic menu items based on cuisine
+        menu_items = [
+            {
+                "name": f"{cuisine.capitalize()} Special",
+                "description": f"Chef's special {cuisine} dish",
+                "price": "$" + str(random.randint(15, 30)),
+                "category": "Main"
+            },
+            {
+                "name": f"Traditional {cuisine.capitalize()} Appetizer",
+                "description": f"Classic {cuisine} starter",
+                "price": "$" + str(random.randint(8, 15)),
+                "category": "Appetizer"
+            }
+        ]
+
+    recommendation_text = build_recommendation_text(restaurant_data, vibe, cuisine, location)
+
+    image_url = choose_image_url(restaurant_data.get('imageUrl', ''), cuisine)
+
+    restaurant = Restaurant(
+        id=f"ai-{random.randint(1000, 9999)}",
+        name=restaurant_data.get('name', 'Sample Restaurant'),
+        cuisineType=restaurant_data.get('cuisine', cuisine.capitalize()),
+        priceRange=restaurant_data.get('priceRange', budget),
+        location=restaurant_data.get('location', location),
+        rating=restaurant_data.get('rating', 4.5),
+        description=restaurant_data.get('description', 'A delightful spot for your meal.'),
+        address=restaurant_data.get('fullAddress', f"{random.randint(1,999)} Main St, {location}"),
+        phone=restaurant_data.get('phone', f"[Sample] ({random.randint(200,999)}) {random.randint(100,999)}-{random.randint(1000,9999)}"),
+        clean_name=restaurant_data.get('name', 'samplerestaurant').lower().replace(' ', '').replace("'", ''),
+        website=get_website_url(restaurant_data),
+        imageUrl=image_url,
+        openingHours=restaurant_data.get('openingHours', ["11:00 AM - 10:00 PM"] * 7),
+        highlights=restaurant_data.get('highlights', [cuisine.capitalize(), vibe.capitalize(), location]),
+        reasonsToRecommend=[
+            f"Perfect for a {vibe} experience",
+            f"Authentic {cuisine} cuisine",
+            f"Matches your {budget} budget"
+        ],
+        menuItems=menu_items
+    )
+
+    return AdviseResponse(response=recommendation_text, restaurant=restaurant)
+
+def restaurant_from_catalog(record: dict, vibe: str, cuisine: str, location: str) -> Restaurant:
+    """Turn a catalog record into the Restaurant returned to the app, filling what the catalog lacks."""
+    return Restaurant(
+        id=f"static-{random.randint(1000, 9999)}",
+        name=record["name"],
+        cuisineType=record.get("cuisine") or cuisine.capitalize(),
+        priceRange=record.get("priceRange") or "$$",
+        location=location,
+        rating=record.get("rating", 4.5),
+        description=record["description"],
+        address=record.get("fullAddress") or f"{random.randint(1,999)} Park Ave, {location}",
+        phone=f"[Sample] ({random.randint(200,999)}) {random.randint(100,999)}-{random.randint(1000,9999)}",
+        website=get_website_url(record),
+        imageUrl=choose_image_url("", cuisine),
+        openingHours=["11:00 AM - 10:00 PM"] * 7,
+        highlights=["Locally loved", "Charming setting", "Great food"],
+        reasonsToRecommend=[
+            f"Perfect for a {vibe} experience",
+            f"Classic {cuisine} dishes",
+            f"Great ambiance and value"
+        ],
+        menuItems=[]
+    )
+
+def build_fallback_response(preferences: dict) -> AdviseResponse:
+    """Build a response from the restaurant catalog when the LLM gave nothing."""
+    vibe, location = preferences["vibe"], preferences["location"]
+    cuisine = primary_cuisine(preferences["cuisines"])
+    # Free-text vibe/ambience ranks the matches; vary between the best few, anything at all if none match
+    text = " ".join(filter(None, [vibe, preferences.get("ambience")]))
+    candidates = restaurant_catalog.query(preferences, limit=5, text=text) or restaurant_catalog.query({}, limit=5)
+    fallback_data = random.choice(candidates)
+    logger.warning("Using fallback data.")
+
+    restaurant = restaurant_from_catalog(fallback_data, vibe, cuisine, location)
+
+    response_text = f"Based on your vibe for {vibe}, you might enjoy {restaurant.name} in {location}."
+    return AdviseResponse(response=response_text, restaurant=restaurant)
+
+def open_session(preferences: dict, restaurants) -> str:
+    """Keep the shown restaurants server-side; /restaurant/refine then needs only the returned id."""
+    return session_store.create(preferences, [restaurant.dict() for restaurant in restaurants]).id
+
+def with_session(response: AdviseResponse, preferences: dict) -> AdviseResponse:
+    response.sessionId = open_session(preferences, [response.restaurant])
+    return response
+
+def primary_cuisine(cuisines) -> str:
+    return cuisines[0].lower() if cuisines and len(cuisines) > 0 else "italian"
+
+def parse_preferences(request: AdviseRequest) -> dict:
+    """Apply defaults to an AdviseRequest and log it; returns the dict the services take."""
+    vibe = request.vibe or "romantic"
+    ambience = request.ambience
+    location = request.location or "NYC"
+    cuisine = primary_cuisine(request.cuisines)
+    budget = request.budget or "$$"
+    dietary_restrictions = request.dietaryRestrictions or []
+    absolute_nogos = request.absoluteNogos or []
+    
+    logger.info(f"Received recommendation request: vibe={vibe}, ambience={ambience}, cuisine={cuisine}, location={location}, budget={budget}")
+    # Check the fallback image while the recommendation is being generated
+    image_prober.probe_in_background(cuisine_image_url(cuisine))
+    if dietary_restrictions:
+        logger.info(f"Dietary restrictions: {', '.join(dietary_restrictions)}")
+    if absolute_nogos:
+        logger.info(f"Absolute no-gos: {', '.join(absolute_nogos)}")
+
+    return {
+        "vibe": vibe,
+        "ambience": ambience,
+        "location": location,
+        "cuisines": request.cuisines,
+        "budget": budget,
+        "partySize": request.partySize,
+        "dietaryRestrictions": dietary_restrictions,
+        "absoluteNogos": absolute_nogos
+    }
+
 router = APIRouter()
 
 @router.post("/advise", response_model=AdviseResponse)
 async def get_recommendation(request: AdviseRequest):
     try:
-        vibe = request.vibe or "romantic"
-        ambience = request.ambience
-        location = request.location or "NYC"
-        cuisine = request.cuisines[0].lower() if request.cuisines and len(request.cuisines) > 0 else "italian"
-        budget = request.budget or "$$"
-        dietary_restrictions = request.dietaryRestrictions or []
-        absolute_nogos = request.absoluteNogos or []
-        
-        logger.info(f"Received recommendation request: vibe={vibe}, ambience={ambience}, cuisine={cuisine}, location={location}, budget={budget}")
-        if dietary_restrictions:
-            logger.info(f"Dietary restrictions: {', '.join(dietary_restrictions)}")
-        if absolute_nogos:
-            logger.info(f"Absolute no-gos: {', '.join(absolute_nogos)}")
+        preferences = parse_preferences(request)
+        vibe, location, budget = preferences["vibe"], preferences["location"], preferences["budget"]
+        cuisine = primary_cuisine(preferences["cuisines"])
+
+        # Popular combinations are pre-generated in the background
+        warm_pool.record(preferences)
+        pooled = warm_pool.get(preferences)
+        if pooled is not None:
+            logger.info(f"Using pre-generated restaurant: {pooled.get('name')}")
+            return with_session(build_ai_response(pooled, vibe, cuisine, location, budget), preferences)
         
         # Try to get recommendations from Azure OpenAI
-        restaurants = await generate_azure_openai_recommendation({
-            "vibe": vibe,
-            "ambience": ambience,
-            "location": location,
-            "cuisines": request.cuisines,
-            "budget": budget,
-            "partySize": request.partySize,
-            "dietaryRestrictions": dietary_restrictions,
-            "absoluteNogos": absolute_nogos
-        })
+        restaurants = await generate_azure_openai_recommendation(preferences)
         
         # If we got restaurants from Azure OpenAI, use the first one
         if restaurants and len(restaurants) > 0:
             restaurant_data = restaurants[0]
             logger.info(f"Using AI-generated restaurant: {restaurant_data.get('name')}")
             
-            # Process menu items if available
-            menu_items = []
-            if "menuItems" in restaurant_data:
-                menu_items = restaurant_data["menuItems"]
-            else:
-                # Generate some basic menu items based on cuisine
-                menu_items = [
-                    {
-                        "name": f"{cuisine.capitalize()} Special",
-                        "description": f"Chef's special {cuisine} dish",
-                        "price": "$" + str(random.randint(15, 30)),
-                        "category": "Main"
-                    },
-                    {
-                        "name": f"Traditional {cuisine.capitalize()} Appetizer",
-                        "description": f"Classic {cuisine} starter",
-                        "price": "$" + str(random.randint(8, 15)),
-                        "category": "Appetizer"
-                    }
-                ]
-            
-            description_templates = [
-                "Looking for a {vibe} spot with {cuisine} cuisine in {location}? I have just the place for you: {name}! {description}",
-                "Based on your vibe for {vibe} and love for {cuisine}, you should definitely check out {name} in {location}! {description}",
-                "For your perfect {vibe} experience, {name} in {location} serves amazing {cuisine} dishes. {description}",
-                "Feeling like {vibe}? {name} in {location} is a fantastic {cuisine} restaurant that fits your style! {description}",
-                "{name} is a {cuisine} gem in {location} that matches your {vibe} vibe perfectly. {description}",
-            ]
-
-            recommendation_text = random.choice(description_templates).format(
-                vibe=vibe.lower(),
-                cuisine=cuisine.lower(),
-                location=location,
-                name=restaurant_data.get('name', 'this spot'),
-                description=restaurant_data.get('description', '')
-            )
-
-            # Get a reliable image URL and try to convert to base64 if needed
-            image_url = restaurant_data.get('imageUrl', '')
-            if not image_url:
-                cuisine_keyword = cuisine.replace(' ', '+')
-                image_url = f"https://source.unsplash.com/featured/?{cuisine_keyword},restaurant"
-                
-            # Ensure the image URL is accessible
-            try:
-                # Try to validate the image URL is working
-                if not ImageUtils.download_image(image_url):
-                    # Fallback to Unsplash if the provided URL doesn't work
-                    logger.warning(f"Image URL {image_url} is not accessible, using fallback")
-                    cuisine_keyword = cuisine.replace(' ', '+')
-                    image_url = f"https://source.unsplash.com/featured/?{cuisine_keyword},restaurant"
-            except Exception as img_err:
-                logger.warning(f"Error processing image URL: {img_err}")
-                cuisine_keyword = cuisine.replace(' ', '+')
-                image_url = f"https://source.unsplash.com/featured/?{cuisine_keyword},restaurant"
-
-            restaurant = Restaurant(
-                id=f"ai-{random.randint(1000, 9999)}",
-                name=restaurant_data.get('name', 'Sample Restaurant'),
-                cuisineType=restaurant_data.get('cuisine', cuisine.capitalize()),
-                priceRange=restaurant_data.get('priceRange', budget),
-                location=restaurant_data.get('location', location),
-                rating=restaurant_data.get('rating', 4.5),
-                description=restaurant_data.get('description', 'A delightful spot for your meal.'),
-                address=restaurant_data.get('fullAddress', f"{random.randint(1,999)} Main St, {location}"),
-                phone=restaurant_data.get('phone', f"[Sample] ({random.randint(200,999)}) {random.randint(100,999)}-{random.randint(1000,9999)}"),
-                clean_name=restaurant_data.get('name', 'samplerestaurant').lower().replace(' ', '').replace("'", ''),
-                website=get_website_url(restaurant_data),
-                imageUrl=image_url,
-                openingHours=restaurant_data.get('openingHours', ["11:00 AM - 10:00 PM"] * 7),
-                highlights=restaurant_data.get('highlights', [cuisine.capitalize(), vibe.capitalize(), location]),
-                reasonsToRecommend=[
-                    f"Perfect for a {vibe} experience",
-                    f"Authentic {cuisine} cuisine",
-                    f"Matches your {budget} budget"
-                ],
-                menuItems=menu_items
-            )
-
-            return AdviseResponse(response=recommendation_text, restaurant=restaurant)
+            return with_session(build_ai_response(restaurant_data, vibe, cuisine, location, budget), preferences)
 
         # Fallback to static sample
-        fallback_data = random.choice(RESTAURANT_DATA.get(cuisine, RESTAURANT_DATA["italian"]))
-        logger.warning("Using fallback data.")
+        return with_session(build_fallback_response(preferences), preferences)
 
-        cuisine_keyword = cuisine.replace(' ', '+')
-        image_url = f"https://source.unsplash.com/featured/?{cuisine_keyword},restaurant"
-        
-        # Ensure the image URL works
-        try:
-            if not ImageUtils.download_image(image_url):
-                logger.warning(f"Fallback image URL {image_url} is not accessible, using generic fallback")
-                image_url = "https://source.unsplash.com/featured/?restaurant"
-        except Exception as img_err:
-            logger.warning(f"Error processing fallback image URL: {img_err}")
-            image_url = "https://source.unsplash.com/featured/?restaurant"
-            
-        restaurant = Restaurant(
-            id=f"static-{random.randint(1000, 9999)}",
-            name=fallback_data["name"],
-            cuisineType=cuisine.capitalize(),
-            priceRange=fallback_data.get("priceRange", "$$"),
-            location=location,
-            rating=fallback_data.get("rating", 4.5),
-            description=fallback_data["description"],
-            address=f"{random.randint(1,999)} Park Ave, {location}",
-            phone=f"[Sample] ({random.randint(200,999)}) {random.randint(100,999)}-{random.randint(1000,9999)}",
-            website=get_website_url(fallback_data),
-            imageUrl=image_url,
-            openingHours=["11:00 AM - 10:00 PM"] * 7,
-            highlights=["Locally loved", "Charming setting", "Great food"],
-            reasonsToRecommend=[
-                f"Perfect for a {vibe} experience",
-                f"Classic {cuisine} dishes",
-                f"Great ambiance and value"
-            ],
-            menuItems=[]
-        )
+    except Exception as e:
+        logger.exception("Error generating recommendation")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.post("/advise/batch", response_model=AdviseBatchResponse)
+async def get_recommendations(request: AdviseRequest, count: int = Query(3, ge=1, le=5)):
+    """
+    Return up to `count` ranked recommendations generated in a single LLM call.
+
+    The returned sessionId lets /restaurant/refine work on this list
+    without it being sent back, and the candidates also fill the recommendation cache
+    so later /advise calls for the same preferences skip the LLM.
+    """
+    try:
+        preferences = parse_preferences(request)
+        vibe, location, budget = preferences["vibe"], preferences["location"], preferences["budget"]
+        cuisine = primary_cuisine(preferences["cuisines"])
+
+        restaurants = await generate_azure_openai_recommendations(preferences, count)
+        if not restaurants:
+            fallback = build_fallback_response(preferences)
+            return AdviseBatchResponse(response=fallback.response, restaurants=[fallback.restaurant],
+                                       sessionId=open_session(preferences, [fallback.restaurant]))
 
-        response_text = f"Based on your vibe for {vibe}, you might enjoy {restaurant.name} in {location}."
-        return AdviseResponse(response=response_text, restaurant=restaurant)
+        responses = [
+            build_ai_response(restaurant_data, vibe, cuisine, location, budget)
+            for restaurant_data in restaurants
+        ]
+        restaurants = [response.restaurant for response in responses]
+        return AdviseBatchResponse(
+            response=responses[0].response,
+            restaurants=restaurants,
+            sessionId=open_session(preferences, restaurants)
+        )
 
     except Exception as e:
-        logger.exception("Error generating recommendation")
+        logger.exception("Error generating recommendations")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+# Restaurant fields streamed in the `restaurant` event, keyed by LLM name -> schema name
+CORE_FIELDS = {
+    "name": "name",
+    "cuisine": "cuisineType",
+    "priceRange": "priceRange",
+    "location": "location",
+    "rating": "rating",
+    "description": "description",
+    "fullAddress": "address",
+    "phone": "phone",
+    "website": "website",
+}
+DETAIL_FIELDS = ("openingHours", "highlights", "menuItems")
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _recommendation_events(preferences: dict):
+    vibe, location, budget = preferences["vibe"], preferences["location"], preferences["budget"]
+    cuisine = primary_cuisine(preferences["cuisines"])
+    parser = RestaurantStreamParser()
+    intro = None
+    sent_core = False
+
+    try:
+        async for delta in stream_azure_openai_recommendation(preferences):
+            for key, value in parser.feed(delta):
+                fields = parser.fields
+                if intro is None and "name" in fields and "description" in fields:
+                    intro = build_recommendation_text(fields, vibe, cuisine, location)
+                    yield _sse("intro", {"response": intro})
+
+                # The schema lists core fields first, so a finished detail field means they are all in
+                if not sent_core and (key in DETAIL_FIELDS or CORE_FIELDS.keys() <= fields.keys()):
+                    sent_core = True
+                    yield _sse("restaurant", {
+                        CORE_FIELDS[name]: fields[name] for name in CORE_FIELDS if name in fields
+                    })
+                if key in DETAIL_FIELDS:
+                    yield _sse("details", {key: value})
+
+        restaurant_data = parser.finish()
+        if restaurant_data is not None:
+            final = build_ai_response(restaurant_data, vibe, cuisine, location, budget)
+            if intro is not None:
+                # Keep the text the client already rendered
+                final.response = intro
+        elif restaurant_catalog.query({}, limit=1):
+            logger.error("No usable restaurant in streamed response, using catalog data")
+            final = build_fallback_response(preferences)
+        else:
+            logger.error("No usable restaurant in streamed response, using sample data")
+            final = build_ai_response(get_sample_restaurant(preferences)[0], vibe, cuisine, location, budget)
+
+        yield _sse("done", with_session(final, preferences).dict())
+
+    except Exception:
+        logger.exception("Error streaming recommendation")
+        yield _sse("error", {"detail": "Internal server error"})
+
+@router.post("/advise/stream")
+async def stream_recommendation(request: AdviseRequest):
+    """
+    Server-sent events variant of /advise.
+
+    Sends `intro` with the recommendation text as soon as the restaurant's
+    name and description are generated, `restaurant` with its core fields,
+    one `details` event per finished opening hours / highlights / menu items
+    field, and finally `done` carrying the same AdviseResponse /advise
+    returns. `error` replaces the remaining events if generation fails.
+    """
+    preferences = parse_preferences(request)
+    return StreamingResponse(
+        _recommendation_events(preferences),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
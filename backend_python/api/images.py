@@ -1,92 +1,148 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form
-from fastapi.responses import JSONResponse, Response
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse
 from typing import Optional
 import uuid
 import logging
 import os
 from pathlib import Path
-from utils.imageUtils import ImageUtils
+from services.image_cache import image_cache
+from services.image_delivery import image_delivery
+from services.image_store import image_store, valid_name
+from services.image_transform import UnsupportedImage, image_transformer
+from services.image_upload import EmptyUpload, UploadTooLarge, image_uploader
 from utils.azure_storage import azure_storage
+from utils.multipart_stream import BodyTooLarge, MultipartError, MultipartReader
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def save_local_image(image_data: bytes, filename: str) -> str:
-    """Save image to local static directory as fallback"""
-    try:
-        static_dir = Path("static/images")
-        static_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_path = static_dir / filename
-        with open(file_path, "wb") as f:
-            f.write(image_data)
-            
-        return f"/static/images/{filename}"
-    except Exception as e:
-        logger.error(f"Error saving local image: {e}")
-        return ""
+# /images/upload reads its form itself; this documents it like File/Form parameters would
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "name": {"type": "string"},
+                    },
+                }
+            }
+        },
+    }
+}
 
-@router.post("/images/upload")
-async def upload_image(
-    file: UploadFile = File(...),
-    name: Optional[str] = Form(None)
-):
+# Room for the multipart framing and the name field around the file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+def upload_name(value: str) -> str:
+    """The image name for an upload's `name` field: its last path component, or 400 if that isn't a valid name."""
+    if not value:
+        return value
+    # Never let the name point outside the container or static/images
+    name = os.path.basename(value)
+    if not valid_name(name):
+        raise HTTPException(status_code=400, detail=f"Invalid image name: {value!r}")
+    return name
+
+@router.post("/images/upload", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_image(request: Request):
     """
     Upload an image to Azure Blob Storage
+
+    The multipart form is parsed as it arrives and the file hashed and
+    spooled to a temporary file in blocks, never read into memory; only
+    content that isn't stored yet is then sent to storage. Uploads past
+    IMAGE_UPLOAD_MAX_BYTES are rejected with 413: on their Content-Length
+    before anything is read, otherwise as soon as the limit is crossed.
     """
+    received = None
     try:
-        contents = await file.read()
-        if not contents:
-            raise HTTPException(status_code=400, detail="Empty file")
-            
+        form = MultipartReader(request, image_uploader.max_bytes + UPLOAD_FORM_OVERHEAD)
+        name = None
+        filename = ""
+        async for part in form.parts():
+            if part.name == "file" and received is None:
+                filename = part.filename or ""
+                received = await image_uploader.receive(part.chunks(), part.content_type)
+            elif part.name == "name":
+                # Checked as soon as it arrives: sent before the file, a bad name costs no upload
+                name = upload_name(await part.text(max_bytes=1024))
+        if received is None:
+            raise HTTPException(status_code=422, detail="Missing form field: file")
+
         # Generate a unique filename if one wasn't provided
         if not name:
-            file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-            name = f"{uuid.uuid4()}.{file_extension}"
-        
-        # Try to upload to Azure Blob Storage
-        image_url = None
-        if azure_storage.initialized:
-            image_url = azure_storage.upload_image(contents, name)
-            
-        # If Azure Storage failed, save locally as fallback
-        if not image_url:
-            logger.warning("Azure Storage upload failed, saving locally")
-            local_url = save_local_image(contents, name)
-            
-            if not local_url:
-                raise HTTPException(status_code=500, detail="Failed to save image")
-                
+            file_extension = filename.split(".")[-1] if "." in filename else "jpg"
+            name = upload_name(f"{uuid.uuid4()}.{file_extension}")
+
+        result = await image_uploader.save(received, name)
+
+        if result.storage == "local":
+            logger.warning("Azure Storage upload failed, saved locally")
             return JSONResponse(
                 status_code=200,
                 content={
                     "message": "Image saved locally (Azure Storage not available)",
-                    "url": local_url,
+                    "url": result.url,
                     "name": name,
-                    "storage": "local"
+                    "storage": "local",
+                    "size": result.size,
+                    "sha256": result.sha256
                 }
             )
-            
+
         return {
             "message": "Image uploaded successfully to Azure",
-            "url": image_url,
+            "url": result.url,
             "name": name,
-            "storage": "azure"
+            "storage": "azure",
+            "size": result.size,
+            "sha256": result.sha256
         }
+    except HTTPException:
+        raise
+    except EmptyUpload:
+        raise HTTPException(status_code=400, detail="Empty file")
+    except (UploadTooLarge, BodyTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MultipartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.exception(f"Error uploading image: {e}")
         raise HTTPException(status_code=500, detail=f"Error uploading image: {str(e)}")
+    finally:
+        # Staged content nothing was saved from (a no-op once saved)
+        if received is not None:
+            await image_uploader.discard(received)
 
 @router.get("/images/{image_name}")
 async def get_image_info(image_name: str):
     """
     Get information about an image
+
+    Existence is checked against the image index, then the image cache
+    index or the blob's properties; the image itself is never downloaded.
     """
     try:
+        # Uploaded images are in the index
+        stored = image_store.resolve(image_name)
+        if stored is not None:
+            return {
+                "name": image_name,
+                "url": image_store.url(stored),
+                "exists": True,
+                "storage": stored.storage,
+                "size": stored.size,
+                "sha256": stored.sha256
+            }
+
         # Check if the image exists in Azure Blob Storage
         if azure_storage.initialized:
-            image_data = azure_storage.download_image(image_name)
-            if image_data:
+            if await image_delivery.blob_entry(image_name) is not None:
                 return {
                     "name": image_name,
                     "url": f"{azure_storage.blob_service_client.url}{azure_storage.container_name}/{image_name}",
@@ -113,46 +169,62 @@ async def get_image_info(image_name: str):
         logger.exception(f"Error getting image info: {e}")
         raise HTTPException(status_code=500, detail=f"Error retrieving image info: {str(e)}")
 
+@router.delete("/images/{image_name}")
+async def delete_image(image_name: str):
+    """
+    Delete an image name
+
+    The content is deleted by the image GC once no other name refers to it.
+    """
+    if not image_store.release(image_name):
+        raise HTTPException(status_code=404, detail="Image not found")
+    image_cache.invalidate(image_name)
+    return {"name": image_name, "deleted": True}
+
 @router.get("/images/{image_name}/content")
-async def get_image(image_name: str):
+async def get_image(image_name: str, request: Request):
     """
     Get the actual image content
+
+    Streamed from Azure Blob Storage or the local fallback, with ETag,
+    Last-Modified and Cache-Control headers. Supports single Range
+    requests and answers If-None-Match / If-Modified-Since with 304.
     """
     try:
-        # Try to get the image from Azure Blob Storage
-        if azure_storage.initialized:
-            image_data = azure_storage.download_image(image_name)
-            if image_data:
-                # Determine content type based on file extension
-                content_type = "image/jpeg"  # Default
-                if image_name.lower().endswith(".png"):
-                    content_type = "image/png"
-                elif image_name.lower().endswith(".gif"):
-                    content_type = "image/gif"
-                elif image_name.lower().endswith(".webp"):
-                    content_type = "image/webp"
-                    
-                return Response(content=image_data, media_type=content_type)
-        
-        # Check if image exists locally
-        local_path = Path(f"static/images/{image_name}")
-        if local_path.exists():
-            with open(local_path, "rb") as f:
-                image_data = f.read()
-                
-            # Determine content type based on file extension
-            content_type = "image/jpeg"  # Default
-            if image_name.lower().endswith(".png"):
-                content_type = "image/png"
-            elif image_name.lower().endswith(".gif"):
-                content_type = "image/gif"
-            elif image_name.lower().endswith(".webp"):
-                content_type = "image/webp"
-                
-            return Response(content=image_data, media_type=content_type)
-        
-        # Image not found
-        raise HTTPException(status_code=404, detail="Image not found")
+        response = await image_delivery.respond(image_name, request.headers)
     except Exception as e:
         logger.exception(f"Error retrieving image: {e}")
-        raise HTTPException(status_code=500, detail=f"Error retrieving image: {str(e)}") 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error retrieving image: {str(e)}")
+
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
+
+@router.get("/images/{image_name}/variant")
+async def get_image_variant(
+    image_name: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=4096, description="Largest width in pixels"),
+    q: int = Query(75, ge=1, le=100, description="Encoder quality"),
+    format: str = Query("webp", description="webp, avif or jpeg")
+):
+    """
+    Get a resized and re-encoded copy of an image
+
+    The width is rounded up to one of IMAGE_VARIANT_WIDTHS and the quality
+    to a multiple of 5. Each variant is generated once, stored next to the
+    images, and then served like /images/{image_name}/content.
+    """
+    try:
+        response = await image_transformer.respond(image_name, w, q, format, request.headers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnsupportedImage as e:
+        raise HTTPException(status_code=415, detail=f"Image can't be transcoded: {e}")
+    except Exception as e:
+        logger.exception(f"Error generating image variant: {e}")
+        raise HTTPException(status_code=500, detail=f"Error generating image variant: {str(e)}")
+
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
@@ -0,0 +1,43 @@
+from fastapi import APIRouter
+from services.cache_purger import cache_purger
+from services.enrichment_cache import enrichment_cache
+from services.image_cache import image_cache
+from services.image_delivery import image_delivery
+from services.image_store import image_store
+from services.image_transform import image_transformer
+from services.image_upload import image_uploader
+from services.openai_service import llm_governor, llm_resilience, recommendation_flight
+from services.prompt_builder import token_usage
+from services.recommendation_cache import recommendation_cache
+from services.refine_engine import refine_engine
+from services.restaurant_catalog import restaurant_catalog
+from services.session_store import session_store
+from services.warm_pool import warm_pool
+from utils.http_client import outbound_http
+from utils.image_probe import image_prober
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def get_metrics():
+    """Counters for the in-process performance layers of this worker."""
+    return {
+        "recommendation_cache": recommendation_cache.stats(),
+        "llm_coalescing": recommendation_flight.stats(),
+        "llm_governor": llm_governor.stats(),
+        "llm_resilience": llm_resilience.stats(),
+        "llm_tokens": token_usage.stats(),
+        "warm_pool": warm_pool.stats(),
+        "image_probe": image_prober.stats(),
+        "outbound_http": outbound_http.stats(),
+        "bing_cache": enrichment_cache.stats(),
+        "image_upload": image_uploader.stats(),
+        "image_store": image_store.stats(),
+        "image_delivery": image_delivery.stats(),
+        "image_cache": image_cache.stats(),
+        "image_variants": image_transformer.stats(),
+        "restaurant_catalog": restaurant_catalog.stats(),
+        "refine": refine_engine.stats(),
+        "sessions": session_store.stats(),
+        "cache_purge": cache_purger.stats(),
+    }
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException
-from models.schemas import RefineRequest, RefineResponse
-import random
+from models.schemas import RefineRequest, RefineResponse, Restaurant
+from api.advise import build_ai_response, restaurant_from_catalog
+from services.openai_service import generate_refined_recommendations
+from services.refine_engine import refine_engine
+from services.session_store import session_store
 import logging
 
 # Setup logger
@@ -8,25 +11,89 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def with_reason(restaurant: Restaurant, reason: str) -> Restaurant:
+    """Put the refine reason first, where the app's cards show it."""
+    reasons = [reason] + [r for r in restaurant.reasonsToRecommend if r != reason]
+    return restaurant.copy(update={"reasonsToRecommend": reasons})
+
 @router.post("/restaurant/refine", response_model=RefineResponse)
 async def refine_recommendations(request: RefineRequest):
     """
     Refine previous restaurant recommendations based on user feedback message.
+
+    The feedback is parsed into constraints (cheaper, no sushi, closer to
+    downtown, more romantic...) and applied locally to the previous
+    recommendations, restaurants shown earlier in the session and catalog
+    matches, in a few milliseconds. Only when nothing satisfies the
+    feedback is the LLM asked, once.
+
+    With the sessionId returned by /advise (or an earlier refine) the
+    server already has the previous recommendations; previousRecommendations
+    is only needed without one, and then opens a new session.
     """
+    session = session_store.get(request.sessionId) if request.sessionId else None
+    if session is None and request.sessionId and not request.previousRecommendations:
+        raise HTTPException(status_code=404, detail="Unknown or expired session; send previousRecommendations instead")
+
     try:
         logger.info(f"Received refine request based on feedback: {request.userMessage}")
 
-        # For now, just a very simple mock refinement: shuffle restaurants
-        refined_restaurants = request.previousRecommendations.copy()
+        if session is None:
+            session = session_store.create({}, [r.dict() for r in request.previousRecommendations])
+        previous = session.recommendations
+        preferences = session.preferences
+        result = refine_engine.refine(previous, request.userMessage, history=session.candidates)
+        constraints = result.constraints
+        location = (constraints.location.title() or preferences.get("location")
+                    or (previous[0].get("location") if previous else None) or "NYC")
+        vibe = " and ".join(constraints.vibes) or preferences.get("vibe") or "great"
+
+        refined_restaurants = []
+        reasoning = None
+        if not result.satisfied:
+            llm_preferences = {
+                "vibe": vibe,
+                "location": location,
+                "cuisines": (constraints.cuisines or preferences.get("cuisines")
+                             or [r.get("cuisineType") for r in previous[:1]]),
+                "budget": ("$" * constraints.price_target or preferences.get("budget")
+                           or (previous[0].get("priceRange") if previous else None) or "$$"),
+                "absoluteNogos": constraints.excluded + [
+                    n for n in preferences.get("absoluteNogos") or [] if n not in constraints.excluded
+                ],
+                # Earlier feedback in the session still applies
+                "feedback": "; ".join(session.user_messages()[-3:] + [request.userMessage]),
+            }
+            restaurants = await generate_refined_recommendations(llm_preferences, max(len(previous), 1))
+            if restaurants:
+                cuisine = (llm_preferences["cuisines"][0] if llm_preferences["cuisines"] else "restaurant").lower()
+                refined_restaurants = [
+                    with_reason(build_ai_response(data, vibe, cuisine, location, llm_preferences["budget"]).restaurant,
+                                f"Picked for: '{request.userMessage}'")
+                    for data in restaurants
+                ]
+                reasoning = f"Found new places for your feedback: '{request.userMessage}'."
 
-        # Simulate refinement by reordering / slight random change
-        random.shuffle(refined_restaurants)
+        if not refined_restaurants:
+            for candidate, reason in result.ranked:
+                if candidate["source"] == "catalog":
+                    cuisine = candidate.get("cuisine") or "restaurant"
+                    restaurant = restaurant_from_catalog(candidate, vibe, cuisine.lower(), location)
+                else:
+                    restaurant = Restaurant(**{k: v for k, v in candidate.items() if k != "source"})
+                refined_restaurants.append(with_reason(restaurant, reason))
 
-        reasoning = f"Updated recommendations based on your feedback: '{request.userMessage}'. Hope you like these better!"
+            if result.satisfied:
+                reasoning = f"Updated recommendations based on your feedback: '{request.userMessage}'."
+            else:
+                reasoning = (f"Nothing matched '{request.userMessage}' exactly, "
+                             f"so these are the closest options we have.")
 
+        session_store.update(session, [r.dict() for r in refined_restaurants], request.userMessage, reasoning)
         return RefineResponse(
             recommendations=refined_restaurants,
-            reasoning=reasoning
+            reasoning=reasoning,
+            sessionId=session.id
         )
 
     except Exception as e:
@@ -0,0 +1,96 @@
+"""
+Bing quota and latency saved by the enrichment cache.
+
+Replays batches of restaurant lookups whose names follow a Zipf-like
+popularity curve against a local stub Bing server, once with the cache
+disabled (the old behaviour) and once with a fresh cache file.
+
+    python -m benchmarks.bench_bing_enrichment --batches 50 --batch-size 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+
+from benchmarks.stubs import ServerThread
+
+def make_bing_stub(latency: float) -> FastAPI:
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.get("/v7.0/search")
+    async def search(request: Request):
+        app.state.calls += 1
+        await asyncio.sleep(latency)
+        query = request.query_params["q"]
+        if "Unknown" in query:
+            return {"webPages": {"value": []}}
+        slug = query.split(" restaurant")[0].lower().replace(" ", "")
+        return {"webPages": {"value": [{"url": f"https://www.{slug}.example.com"}]}}
+
+    return app
+
+def make_batches(batches: int, batch_size: int, names: int, seed: int = 3):
+    rng = random.Random(seed)
+    population = [f"Restaurant {i}" for i in range(names)] + ["Unknown Place"]
+    weights = [1 / (rank + 1) for rank in range(len(population))]
+    return [
+        [{"name": name, "location": "NYC"} for name in rng.choices(population, weights, k=batch_size)]
+        for _ in range(batches)
+    ]
+
+async def replay(bing_service, batches) -> float:
+    start = time.perf_counter()
+    for batch in batches:
+        for restaurant in batch:
+            await bing_service.search_bing_for_restaurant(restaurant["name"], restaurant["location"])
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--names", type=int, default=200, help="distinct restaurants")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub Bing latency in seconds")
+    args = parser.parse_args()
+
+    batches = make_batches(args.batches, args.batch_size, args.names)
+    lookups = args.batches * args.batch_size
+
+    with ServerThread(make_bing_stub(args.latency)) as stub, tempfile.TemporaryDirectory() as tmp:
+        os.environ["BING_API_KEY"] = "benchmark"
+        os.environ["BING_CACHE_PATH"] = os.path.join(tmp, "bing.sqlite3")
+        from services import bing_service
+        from services.enrichment_cache import enrichment_cache
+        bing_service.BING_SEARCH_URL = f"{stub.url}/v7.0/search"
+        stub_app = stub.server.config.app
+
+        async def run():
+            enrichment_cache.ttl = 0
+            uncached = await replay(bing_service, batches)
+            uncached_calls = stub_app.state.calls
+
+            enrichment_cache.ttl = 7 * 24 * 3600
+            stub_app.state.calls = 0
+            cached = await replay(bing_service, batches)
+            return uncached, uncached_calls, cached, stub_app.state.calls
+
+        uncached, uncached_calls, cached, cached_calls = asyncio.run(run())
+
+    print(f"{lookups} lookups over {args.names} restaurants, stub latency {args.latency * 1000:.0f} ms")
+    print(f"{'mode':<14} {'Bing calls':>10} {'seconds':>8}")
+    print(f"{'no cache':<14} {uncached_calls:>10} {uncached:>8.2f}")
+    print(f"{'cache':<14} {cached_calls:>10} {cached:>8.2f}")
+    print(f"quota saved: {1 - cached_calls / uncached_calls:.1%}")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,161 @@
+"""
+Cold start and per-worker memory of the catalog: dicts vs indexed vs mmap snapshot.
+
+Starts --workers fresh processes per mode, like gunicorn workers, each
+loading the same synthetic catalog and answering random queries:
+
+    dict      json.load into RESTAURANT_DATA-style {cuisine: [record dicts]}
+    indexed   RestaurantCatalog built from the JSONL file in every worker
+    snapshot  RestaurantCatalog mapping a snapshot built once offline
+
+Memory is read from /proc/self/smaps_rollup (Linux) while all workers of a
+mode are alive: RSS counts shared pages in every worker, PSS splits them
+between the workers mapping them, private is what each worker owns.
+Every string of the catalog is read once first, so snapshot pages are all
+resident. Then the snapshot is rebuilt several times while queries run,
+to show reloads are picked up without failed or stalled queries.
+
+    python -m benchmarks.bench_catalog_snapshot --restaurants 100000 --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.stubs import CATALOG_CITIES, CATALOG_CUISINES, CATALOG_ADJECTIVES, synthetic_catalog
+
+def memory_kb() -> dict:
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+def random_preferences(rng: random.Random) -> dict:
+    return {
+        "cuisines": [rng.choice(CATALOG_CUISINES)],
+        "location": rng.choice(CATALOG_CITIES),
+        "budget": "$" * rng.randint(1, 4),
+        "vibe": rng.choice(CATALOG_ADJECTIVES),
+    }
+
+def worker(mode: str, path: str, queries: int, barrier, results) -> None:
+    import services.restaurant_catalog as restaurant_catalog_module
+    before = memory_kb()
+    start = time.perf_counter()
+    if mode == "dict":
+        grouped = {}
+        with open(path) as f:
+            for record in json.load(f):
+                grouped.setdefault(record["cuisine"].lower(), []).append(record)
+        load_seconds = time.perf_counter() - start
+        rng = random.Random(os.getpid())
+        for _ in range(queries):
+            preferences = random_preferences(rng)
+            [r for r in grouped.get(preferences["cuisines"][0], []) if r["city"] == preferences["location"]][:10]
+        sum(len(r["name"]) + len(r["description"]) for records in grouped.values() for r in records)
+    else:
+        catalog = restaurant_catalog_module.RestaurantCatalog(reload_interval=0).load(path)
+        load_seconds = time.perf_counter() - start
+        rng = random.Random(os.getpid())
+        for _ in range(queries):
+            catalog.query(random_preferences(rng))
+        data = catalog._data
+        for column in data.STRING_COLUMNS:
+            values = getattr(data, column)
+            sum(len(values[row]) for row in range(data.size))
+    barrier.wait()
+    after = memory_kb()
+    results.put((mode, load_seconds, {key: after[key] - before[key] for key in after}))
+    barrier.wait()
+
+def run_mode(mode: str, path: str, workers: int, queries: int):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, queries, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return rows
+
+def reload_under_load(source: str, snapshot: str, rebuilds: int):
+    from services.restaurant_catalog import RestaurantCatalog
+
+    catalog = RestaurantCatalog(reload_interval=0.05).load(snapshot)
+    rng = random.Random(3)
+    latencies, empty = [], 0
+    command = [sys.executable, "-m", "services.catalog_snapshot", source, snapshot]
+    for _ in range(rebuilds):
+        writer = subprocess.Popen(command, cwd=BACKEND, stdout=subprocess.DEVNULL)
+        # Keep querying until the rebuilt file has been swapped in
+        reloads = catalog.reloads
+        while writer.poll() is None or catalog.reloads == reloads:
+            start = time.perf_counter()
+            if not catalog.query(random_preferences(rng)):
+                empty += 1
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return catalog.reloads, len(latencies), empty, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--restaurants", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=1000, help="queries per worker before measuring")
+    parser.add_argument("--rebuilds", type=int, default=3, help="snapshot rebuilds during the reload check")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "catalog.json")
+        jsonl_path = os.path.join(tmp, "catalog.jsonl")
+        snapshot_path = os.path.join(tmp, "catalog.snap")
+        records = list(synthetic_catalog(args.restaurants))
+        with open(json_path, "w") as f:
+            json.dump(records, f)
+        with open(jsonl_path, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        del records
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "services.catalog_snapshot", jsonl_path, snapshot_path],
+                       cwd=BACKEND, check=True, stdout=subprocess.DEVNULL)
+        build_seconds = time.perf_counter() - start
+
+        print(f"{args.restaurants} restaurants, {args.workers} workers; snapshot "
+              f"{os.path.getsize(snapshot_path) / 2**20:.1f} MB, built offline in {build_seconds:.1f} s")
+        print(f"{'mode':<9} {'load s':>7} {'RSS MB':>7} {'PSS MB':>7} {'private MB':>10}   (per worker, mean)")
+        for mode, path in (("dict", json_path), ("indexed", jsonl_path), ("snapshot", snapshot_path)):
+            rows = run_mode(mode, path, args.workers, args.queries)
+            mean = lambda key: statistics.mean(row[2][key] for row in rows) / 1024
+            print(f"{mode:<9} {statistics.mean(row[1] for row in rows):>7.3f} "
+                  f"{mean('rss'):>7.1f} {mean('pss'):>7.1f} {mean('private'):>10.1f}")
+
+        reloads, queries, empty, latencies = reload_under_load(jsonl_path, snapshot_path, args.rebuilds)
+        print(f"\nreload under load: {reloads} swaps over {queries} queries, {empty} empty results, "
+              f"p50 {statistics.median(latencies) * 1000:.3f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.3f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,142 @@
+"""
+Blob Storage traffic and latency of image requests with and without the tiered image cache.
+
+Starts the app in a separate process with Azure Storage pointed at a local
+blob emulator (benchmarks.stubs.make_blob_stub) that answers each request
+after --blob-latency, and sends the same skewed (Zipf) stream of
+unconditional /images/{name}/content and /images/{name} requests to it in
+three configurations:
+
+    uncached   IMAGE_CACHE_VALIDATE_SECONDS=0, no memory or disk budget:
+               every request reads properties and content from the blob
+    memory     memory tier only (no disk budget)
+    disk       disk tier only
+    tiered     memory (thumbnails) and disk tiers, the defaults
+
+Most images are thumbnails, some are full-size photos. Reports the
+requests and megabytes the blob store served, the cache hits from
+/metrics, and p50/p99 latency. Exits non-zero if the memory tier gets no
+hits without the disk tier.
+
+    python -m benchmarks.bench_image_cache --requests 3000 --blob-latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.stubs import ServerThread, blob_connection_string, free_port, make_blob_stub
+
+CONFIGS = {
+    "uncached": {"IMAGE_CACHE_VALIDATE_SECONDS": "0", "IMAGE_CACHE_MEMORY_BYTES": "0", "IMAGE_CACHE_DISK_BYTES": "0"},
+    "memory": {"IMAGE_CACHE_DISK_BYTES": "0"},
+    "disk": {"IMAGE_CACHE_MEMORY_BYTES": "0"},
+    "tiered": {},
+}
+
+def serve(port: int) -> None:
+    import uvicorn
+    from main import app
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+async def replay(url: str, plan, concurrency: int):
+    import httpx
+
+    timings = []
+    queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async def worker():
+            while not queue.empty():
+                path = queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.get(path)
+                timings.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        metrics = (await client.get("/metrics")).json()["image_cache"]
+    return timings, metrics
+
+def run_config(config: str, connection_string: str, plan, concurrency: int):
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, AZURE_STORAGE_CONNECTION_STRING=connection_string, PYTHONPATH=BACKEND,
+                   IMAGE_CACHE_DIR=os.path.join(workdir, "cache"), **CONFIGS[config])
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_image_cache", "--serve", str(port)],
+                                  cwd=workdir, env=env, stderr=subprocess.DEVNULL)
+        try:
+            import httpx
+            url = f"http://127.0.0.1:{port}"
+            for _ in range(200):
+                try:
+                    httpx.get(f"{url}/health")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+            return asyncio.run(replay(url, plan, concurrency))
+        finally:
+            server.terminate()
+            server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--info-fraction", type=float, default=0.2, help="share of /images/{name} existence checks")
+    parser.add_argument("--blob-latency", type=float, default=0.02, help="seconds per blob request")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+
+    rng = random.Random(23)
+    images = {}
+    for i in range(args.images):
+        # 80% thumbnails of 10-150 KB, the rest photos of 0.5-3 MB
+        size = rng.randint(10, 150) * 1024 if rng.random() < 0.8 else rng.randint(512, 3072) * 1024
+        images[f"bench-{i}.jpg"] = os.urandom(size)
+    names = list(images)
+    weights = [1 / (rank + 1) for rank in range(len(names))]
+    plan = [f"/images/{name}" if rng.random() < args.info_fraction else f"/images/{name}/content"
+            for name in rng.choices(names, weights, k=args.requests)]
+
+    blob_app = make_blob_stub(latency=args.blob_latency)
+    with ServerThread(blob_app) as blob:
+        connection_string = blob_connection_string(blob.url)
+        from azure.storage.blob import BlobServiceClient
+        container = BlobServiceClient.from_connection_string(connection_string).get_container_client("images")
+        container.create_container()
+        for name, data in images.items():
+            container.upload_blob(name, data)
+
+        print(f"{args.requests} requests ({args.info_fraction:.0%} existence checks) for {args.images} images "
+              f"({sum(map(len, images.values())) / 2**20:.0f} MB), {args.concurrency} at a time, "
+              f"{args.blob_latency * 1000:g} ms per blob request")
+        print(f"{'config':<9} {'blob reqs':>9} {'blob MB':>8} {'memory hits':>11} {'disk hits':>9} "
+              f"{'p50 ms':>7} {'p99 ms':>7}")
+        for config in CONFIGS:
+            reads, sent = blob_app.state.reads, blob_app.state.bytes_sent
+            timings, metrics = run_config(config, connection_string, plan, args.concurrency)
+            timings.sort()
+            print(f"{config:<9} {blob_app.state.reads - reads:>9} {(blob_app.state.bytes_sent - sent) / 2**20:>8.0f} "
+                  f"{metrics['memory_hits']:>11} {metrics['disk_hits']:>9} "
+                  f"{statistics.median(timings) * 1000:>7.1f} {timings[int(len(timings) * 0.99) - 1] * 1000:>7.1f}")
+            if config == "memory" and not metrics["memory_hits"]:
+                sys.exit("the memory tier must cache thumbnails without the disk tier")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Storage, upload traffic and upload latency with content-addressed image storage.
+
+Uploads --uploads photos through /images/upload to a local blob emulator
+(benchmarks.stubs.make_blob_stub), each one a re-upload of an earlier
+photo with probability --duplicate-fraction (the same picture shared or
+saved again), then deletes --delete-fraction of the names and runs the
+image GC. Reports the bytes the blob emulator received and stores, the
+dedup ratio and reclaimed bytes from /metrics, and the upload latency of
+new and duplicate photos. Uploads are spooled locally until their hash
+is known, so only new content (and generated variants) may be sent to
+the emulator. Before content addressing every upload was also stored
+under its own name, i.e. stored bytes equalled the uploaded bytes. A
+JPEG uploaded under two names has variants generated, and once both
+names are deleted, GC must delete its variants with its content. Exits
+non-zero if either doesn't hold.
+
+    python -m benchmarks.bench_image_dedup --uploads 200 --duplicate-fraction 0.4
+"""
+import argparse
+import io
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.stubs import ServerThread, blob_connection_string, make_blob_stub
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.4)
+    parser.add_argument("--delete-fraction", type=float, default=0.3)
+    parser.add_argument("--blob-latency", type=float, default=0.005, help="seconds per blob request")
+    args = parser.parse_args()
+
+    rng = random.Random(25)
+    blob_app = make_blob_stub(latency=args.blob_latency)
+    with ServerThread(blob_app) as blob, tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.environ["AZURE_STORAGE_CONNECTION_STRING"] = blob_connection_string(blob.url)
+        os.environ["IMAGE_GC_INTERVAL"] = "0"
+        os.environ["IMAGE_GC_GRACE"] = "0"
+        os.environ["IMAGE_CACHE_DIR"] = os.path.join(workdir, "cache")
+        from fastapi.testclient import TestClient
+        from main import app
+        from services.image_store import image_store
+        logging.disable(logging.INFO)
+
+        photos = []
+        uploaded = 0
+        latency = {"new": [], "duplicate": []}
+        with TestClient(app) as client:
+            for i in range(args.uploads):
+                if photos and rng.random() < args.duplicate_fraction:
+                    data, kind = rng.choice(photos), "duplicate"
+                else:
+                    data, kind = os.urandom(rng.randint(200, 3000) * 1024), "new"
+                    photos.append(data)
+                start = time.perf_counter()
+                response = client.post("/images/upload", files={"file": (f"photo-{i}.jpg", data, "image/jpeg")},
+                                       data={"name": f"photo-{i}.jpg"})
+                latency[kind].append(time.perf_counter() - start)
+                response.raise_for_status()
+                uploaded += len(data)
+
+            from PIL import Image
+            jpeg = io.BytesIO()
+            Image.new("RGB", (640, 480), (200, 80, 40)).save(jpeg, "JPEG")
+            for name in ("shared-1.jpg", "shared-2.jpg"):
+                client.post("/images/upload", files={"file": (name, jpeg.getvalue(), "image/jpeg")},
+                            data={"name": name}).raise_for_status()
+            for width in (160, 320):
+                client.get("/images/shared-1.jpg/variant", params={"w": width}).raise_for_status()
+            variants = [key for key in blob_app.state.blobs if key[1].startswith("variants/")]
+            distinct = sum(len(data) for data in photos) + len(jpeg.getvalue())
+            distinct += sum(blob_app.state.blobs[key]["size"] for key in variants)
+            sent = blob_app.state.bytes_received
+
+            for i in rng.sample(range(args.uploads), int(args.uploads * args.delete_fraction)):
+                client.delete(f"/images/photo-{i}.jpg").raise_for_status()
+            client.delete("/images/shared-1.jpg").raise_for_status()
+            time.sleep(0.01)
+            image_store.collect_garbage()
+            variants_kept = [key for key in variants if key in blob_app.state.blobs]
+            client.delete("/images/shared-2.jpg").raise_for_status()
+            time.sleep(0.01)
+            image_store.collect_garbage()
+            variants_left = [key for key in variants if key in blob_app.state.blobs]
+            stats = client.get("/metrics").json()["image_store"]
+
+        stored = sum(entry["size"] for entry in blob_app.state.blobs.values())
+        print(f"{args.uploads} uploads ({len(photos)} distinct photos, 200 KB - 3 MB), "
+              f"{args.duplicate_fraction:.0%} re-uploads, {args.blob_latency * 1000:g} ms per blob request")
+        print(f"uploaded        {uploaded / 2**20:8.1f} MB")
+        print(f"sent to blob    {sent / 2**20:8.1f} MB  ({distinct / 2**20:.1f} MB of distinct content and variants)")
+        print(f"dedup ratio     {stats['dedup_ratio']:8.2f}  ({stats['duplicate_uploads']} duplicate uploads)")
+        print(f"deleted {int(args.uploads * args.delete_fraction)} names, GC reclaimed "
+              f"{stats['bytes_reclaimed'] / 2**20:.1f} MB; {stored / 2**20:.1f} MB stored in "
+              f"{len(blob_app.state.blobs)} blobs for {stats['names']} names")
+        for kind, timings in latency.items():
+            if timings:
+                print(f"{kind:<9} upload p50 {statistics.median(timings) * 1000:6.1f} ms")
+        print(f"variants        {len(variants)} generated, {len(variants_kept)} kept while referenced, "
+              f"{len(variants_left)} left after GC")
+        if sent > distinct:
+            sys.exit("only new content may be sent to blob storage")
+        if len(variants) != 2 or variants_kept != variants or variants_left:
+            sys.exit("variants must be kept while their content is referenced and deleted with it")
+
+if __name__ == "__main__":
+    main()
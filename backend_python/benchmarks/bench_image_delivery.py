@@ -0,0 +1,177 @@
+"""
+Bytes transferred and latency of image content requests, with and without HTTP caching.
+
+Starts the app in a separate process, with images in a local blob
+emulator (benchmarks.stubs.make_blob_stub) or in static/images, and
+replays the same request mix against two endpoints:
+
+    read-all   the previous /images/{name}/content: the whole image read
+               into memory and returned, without validators
+    streamed   /images/{name}/content: streamed, with ETag, Last-Modified,
+               Cache-Control, Range and 304 support
+
+Clients behave like an app with an HTTP cache: a revisit of an image the
+client already has sends If-None-Match with the ETag it got (the
+previous endpoint sent none, so that is a full download), and a resumed
+download asks for the second half with Range. Reports response body
+bytes, and p50/p99 latency.
+
+    python -m benchmarks.bench_image_delivery --requests 2000 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.stubs import ServerThread, blob_connection_string, free_port, make_blob_stub
+
+ENDPOINTS = {"read-all": "/bench/read-all-content/{name}", "streamed": "/images/{name}/content"}
+
+def serve(port: int) -> None:
+    """The app plus the pre-streaming content endpoint."""
+    import uvicorn
+    from fastapi import HTTPException
+    from fastapi.responses import Response
+    from main import app
+    from services.image_delivery import content_type_for
+    from utils.azure_storage import azure_storage
+
+    @app.get("/bench/read-all-content/{name}")
+    async def read_all_content(name: str):
+        if azure_storage.initialized:
+            image_data = azure_storage.download_image(name)
+            if image_data:
+                return Response(content=image_data, media_type=content_type_for(name))
+        path = os.path.join("static/images", name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return Response(content=f.read(), media_type=content_type_for(name))
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+def request_plan(rng: random.Random, names, requests: int, clients: int):
+    """(client, image, kind) per request; kind is "first", "revisit" or "resume"."""
+    seen = [set() for _ in range(clients)]
+    plan = []
+    for _ in range(requests):
+        client = rng.randrange(clients)
+        name = rng.choice(names)
+        if name not in seen[client]:
+            kind = "first"
+            seen[client].add(name)
+        else:
+            kind = "resume" if rng.random() < 0.1 else "revisit"
+        plan.append((client, name, kind))
+    return plan
+
+async def replay(url: str, path: str, plan, concurrency: int):
+    import httpx
+
+    etags = {}
+    sizes = {}
+    timings = []
+    transferred = 0
+    queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async def worker():
+            nonlocal transferred
+            while not queue.empty():
+                client_id, name, kind = queue.get_nowait()
+                headers = {}
+                etag = etags.get((client_id, name))
+                if kind == "revisit" and etag:
+                    headers["If-None-Match"] = etag
+                elif kind == "resume" and name in sizes:
+                    headers["Range"] = f"bytes={sizes[name] // 2}-"
+                start = time.perf_counter()
+                response = await client.get(path.format(name=name), headers=headers)
+                timings.append(time.perf_counter() - start)
+                assert response.status_code in (200, 206, 304), response.status_code
+                transferred += len(response.content)
+                if response.status_code == 200:
+                    sizes[name] = len(response.content)
+                    if "etag" in response.headers:
+                        etags[(client_id, name)] = response.headers["etag"]
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return transferred, timings
+
+def run_variant(variant: str, env: dict, workdir: str, plan, concurrency: int):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_image_delivery", "--serve", str(port)],
+                              cwd=workdir, env=env, stderr=subprocess.DEVNULL)
+    try:
+        import httpx
+        url = f"http://127.0.0.1:{port}"
+        for _ in range(200):
+            try:
+                httpx.get(f"{url}/health")
+                break
+            except httpx.TransportError:
+                time.sleep(0.05)
+        return asyncio.run(replay(url, ENDPOINTS[variant], plan, concurrency))
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--blob-latency", type=float, default=0.005, help="seconds per blob request")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+
+    rng = random.Random(6)
+    images = {f"bench-{i}.jpg": os.urandom(rng.randint(100, 2000) * 1024) for i in range(args.images)}
+    plan = request_plan(rng, list(images), args.requests, args.clients)
+    kinds = {kind: sum(1 for _, _, k in plan if k == kind) for kind in ("first", "revisit", "resume")}
+    print(f"{args.requests} requests for {args.images} images (100 KB - 2 MB) from {args.clients} clients, "
+          f"{args.concurrency} at a time: {kinds['first']} first, {kinds['revisit']} revisits, {kinds['resume']} resumes")
+    print(f"{'storage':<8} {'endpoint':<9} {'MB sent':>8} {'p50 ms':>8} {'p99 ms':>8}")
+
+    blob_app = make_blob_stub(latency=args.blob_latency)
+    with ServerThread(blob_app) as blob, tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "static", "images"))
+        for name, data in images.items():
+            with open(os.path.join(workdir, "static", "images", name), "wb") as f:
+                f.write(data)
+
+        import hashlib
+        from azure.storage.blob import BlobServiceClient, ContentSettings
+        service = BlobServiceClient.from_connection_string(blob_connection_string(blob.url))
+        container = service.get_container_client("images")
+        container.create_container()
+        for name, data in images.items():
+            container.upload_blob(name, data, content_settings=ContentSettings(content_type="image/jpeg"),
+                                  metadata={"sha256": hashlib.sha256(data).hexdigest()})
+
+        env = dict(os.environ, PYTHONPATH=BACKEND, IMAGE_CACHE_DIR=os.path.join(workdir, "cache"))
+        env.pop("AZURE_STORAGE_CONNECTION_STRING", None)
+        for storage, storage_env in (("blob", dict(env, AZURE_STORAGE_CONNECTION_STRING=blob_connection_string(blob.url))),
+                                     ("local", env)):
+            for variant in ENDPOINTS:
+                transferred, timings = run_variant(variant, storage_env, workdir, plan, args.concurrency)
+                timings.sort()
+                print(f"{storage:<8} {variant:<9} {transferred / 2**20:>8.0f} "
+                      f"{statistics.median(timings) * 1000:>8.1f} {timings[int(len(timings) * 0.99) - 1] * 1000:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Verdicts and latency of the image URL prober against a local stub image host.
+
+Probes URLs on a stub server that answers with an image, a 404, an HTML
+page, a HEAD rejection (so the prober falls back to a ranged GET) and a
+response slower than the probe timeout, and checks each verdict. Then
+probes them all again to check that cached verdicts are reused without
+a request, and that concurrent probes of one URL share a single request.
+Exits non-zero if any check fails; prints the probe latencies.
+
+    python -m benchmarks.bench_image_probe --timeout 0.2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+from benchmarks.stubs import ServerThread
+
+# path -> expected verdict
+CASES = {
+    "/good.jpg": True,
+    "/missing.jpg": False,
+    "/page.html": False,
+    "/head-rejected.jpg": True,
+    "/slow.jpg": False,
+}
+
+def make_image_host_stub(slow_latency: float) -> FastAPI:
+    app = FastAPI()
+    app.state.hits = Counter()
+
+    @app.api_route("/{path}", methods=["GET", "HEAD"])
+    async def image(path: str, request: Request):
+        app.state.hits[f"/{path}"] += 1
+        if path == "good.jpg":
+            return Response(status_code=200, media_type="image/jpeg", headers={"Content-Length": "1024"})
+        if path == "page.html":
+            return Response("<html></html>", media_type="text/html")
+        if path == "head-rejected.jpg":
+            if request.method == "HEAD":
+                return Response(status_code=405)
+            assert request.headers.get("range") == "bytes=0-0"
+            return Response(b"\xff", status_code=206, media_type="image/jpeg",
+                            headers={"Content-Range": "bytes 0-0/1024"})
+        if path == "slow.jpg":
+            await asyncio.sleep(slow_latency)
+            return Response(status_code=200, media_type="image/jpeg")
+        return Response(status_code=404)
+
+    return app
+
+async def run(base_url: str, app: FastAPI, timeout: float) -> list:
+    from utils.http_client import outbound_http
+    from utils.image_probe import ImageUrlProber
+
+    prober = ImageUrlProber()
+    failures = []
+
+    def check(condition: bool, message: str) -> None:
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    await outbound_http.start()
+    try:
+        latency = {}
+        for path, expected in CASES.items():
+            start = time.perf_counter()
+            verdict = await prober.probe(base_url + path)
+            latency[path] = time.perf_counter() - start
+            check(verdict is expected, f"{path:<19} -> {verdict!s:<5} in {latency[path] * 1000:6.1f} ms")
+        check(latency["/slow.jpg"] < timeout * 2, f"slow host given up on after the {timeout * 1000:g} ms timeout")
+        check(app.state.hits["/head-rejected.jpg"] == 2, "HEAD rejection falls back to one ranged GET")
+
+        hits = sum(app.state.hits.values())
+        start = time.perf_counter()
+        verdicts = [await prober.probe(base_url + path) for path in CASES]
+        elapsed = time.perf_counter() - start
+        check(verdicts == list(CASES.values()) and sum(app.state.hits.values()) == hits,
+              f"cached verdicts reused without requests ({elapsed * 1000:.2f} ms for {len(CASES)} probes)")
+        check(all(prober.cached_verdict(base_url + path) is expected for path, expected in CASES.items()),
+              "cached_verdict() answers for probed URLs, negative verdicts included")
+
+        url = base_url + "/good.jpg?concurrent"
+        verdicts = await asyncio.gather(*(prober.probe(url) for _ in range(20)))
+        check(all(verdicts) and app.state.hits["/good.jpg"] == 2,
+              "20 concurrent probes of a new URL share one request")
+
+        url = base_url + "/good.jpg?background"
+        prober.probe_in_background(url)
+        check(prober.cached_verdict(url) is None, "probe_in_background() returns before the probe")
+        await asyncio.sleep(timeout)
+        check(prober.cached_verdict(url) is True, "background probe verdict is cached")
+    finally:
+        await outbound_http.close()
+    print(f"stats: {prober.stats()}")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--timeout", type=float, default=0.2, help="probe timeout in seconds")
+    args = parser.parse_args()
+    os.environ["HTTP_TIMEOUT_IMAGE_PROBE"] = str(args.timeout)
+
+    app = make_image_host_stub(slow_latency=args.timeout * 5)
+    with ServerThread(app) as server:
+        failures = asyncio.run(run(server.url, app, args.timeout))
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+if __name__ == "__main__":
+    main()
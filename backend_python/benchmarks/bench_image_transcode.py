@@ -0,0 +1,82 @@
+"""
+Payload bytes saved and transcoding throughput of /images/{name}/variant.
+
+Generates photo-like JPEGs (gradients, shapes and sensor-like noise,
+saved at quality 90 the way phones upload them) and transcodes each one to
+every --widths x --formats variant with utils.image_transcode.transcode
+in a process pool, the way services.image_transform does. Reports per
+variant the average size against the full-size source, and throughput
+as variants per CPU-second (per core) and per wall-second across the pool.
+
+    python -m benchmarks.bench_image_transcode --images 12 --workers 2
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from utils.image_transcode import available_formats, transcode
+
+def photo(seed: int, size=(2400, 1600)) -> bytes:
+    """A JPEG with smooth areas, edges and noise, compressing about like a photo."""
+    rng = random.Random(seed)
+    width, height = size
+    base = Image.merge("RGB", [
+        Image.linear_gradient("L").rotate(rng.randint(0, 359)).resize(size),
+        Image.radial_gradient("L").resize(size),
+        Image.linear_gradient("L").resize(size).transpose(Image.Transpose.FLIP_LEFT_RIGHT),
+    ])
+    draw = ImageDraw.Draw(base)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randint(20, 300)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    base = base.filter(ImageFilter.GaussianBlur(3))
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    image = Image.blend(base, noise, 0.12)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--widths", type=int, nargs="+", default=[320, 640, 1080])
+    parser.add_argument("--formats", nargs="+", default=list(available_formats()))
+    parser.add_argument("--quality", type=int, default=75)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    sources = [photo(seed) for seed in range(args.images)]
+    source_size = statistics.mean(map(len, sources))
+    print(f"{args.images} sources of 2400x1600, {source_size / 1024:.0f} KB on average; "
+          f"quality {args.quality}, {args.workers} worker processes")
+    print(f"{'format':<6} {'width':>5} {'avg KB':>7} {'saved':>6} {'per core/s':>10} {'pool/s':>7}")
+
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Start the workers before timing
+        list(pool.map(transcode, sources[:1] * args.workers, [160] * args.workers,
+                      [args.quality] * args.workers, ["jpeg"] * args.workers))
+        for fmt in args.formats:
+            for width in args.widths:
+                start = time.perf_counter()
+                results = list(pool.map(transcode, sources, [width] * len(sources),
+                                        [args.quality] * len(sources), [fmt] * len(sources)))
+                elapsed = time.perf_counter() - start
+                size = statistics.mean(len(data) for data, _ in results)
+                cpu_seconds = sum(cpu for _, cpu in results)
+                print(f"{fmt:<6} {width:>5} {size / 1024:>7.1f} {1 - size / source_size:>6.1%} "
+                      f"{len(results) / cpu_seconds:>10.1f} {len(results) / elapsed:>7.1f}")
+
+if __name__ == "__main__":
+    main()
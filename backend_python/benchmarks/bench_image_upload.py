@@ -0,0 +1,195 @@
+"""
+Memory and event-loop stalls of concurrent image uploads: read-all vs streamed blocks.
+
+Starts the app in a separate process with Azure Storage pointed at a local
+blob emulator (benchmarks.stubs.make_blob_stub), then sends --uploads
+concurrent multipart uploads of each --size-mb, streamed from the client
+so it holds no copies. Each endpoint runs in a fresh server process:
+
+    parse-only  reference: Starlette's multipart parsing, which spools each
+                file to a temporary file past 1 MB, then reads it in chunks
+    read-all    the previous /images/upload: await file.read(), then the
+                blocking azure_storage.upload_image() on the event loop
+    streamed    /images/upload: the form parsed from the request stream, each
+                block hashed and spooled by one executor call as it arrives,
+                then new content staged to blob storage from the spool
+
+Reports the server's peak RSS growth during the burst (VmHWM from
+/proc, Linux), the burst's wall time, and the latency of /health requests
+sent while it runs. Streamed memory should not grow with the upload
+size, and stays below parse-only, which buffers up to 1 MB per file
+before spooling; read-all grows with it. Then checks that an upload past
+IMAGE_UPLOAD_MAX_BYTES is refused on its Content-Length before its body
+is read.
+
+    python -m benchmarks.bench_image_upload --uploads 50 --size-mb 10 20
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.stubs import ServerThread, blob_connection_string, free_port, make_blob_stub
+
+BOUNDARY = "benchmark-boundary"
+ENDPOINTS = {"parse-only": "/bench/parse-only", "read-all": "/bench/read-all-upload", "streamed": "/images/upload"}
+
+def serve(port: int) -> None:
+    """The app plus the reference and pre-streaming upload endpoints."""
+    import uvicorn
+    from fastapi import File, UploadFile
+    from main import app
+    from utils.azure_storage import azure_storage
+
+    @app.post(ENDPOINTS["parse-only"])
+    async def parse_only(file: UploadFile = File(...)):
+        digest = hashlib.sha256()
+        while True:
+            chunk = await file.read(2**20)
+            if not chunk:
+                break
+            digest.update(chunk)
+        return {"sha256": digest.hexdigest()}
+
+    @app.post(ENDPOINTS["read-all"])
+    async def read_all_upload(file: UploadFile = File(...)):
+        contents = await file.read()
+        return {"url": azure_storage.upload_image(contents, file.filename), "sha256": hashlib.sha256(contents).hexdigest()}
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+def proc_status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+async def upload_body(name: str, size: int, block: bytes):
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+           f"Content-Type: image/jpeg\r\n\r\n").encode()
+    for offset in range(0, size, len(block)):
+        yield block[:size - offset]
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+async def burst(url: str, path: str, uploads: int, size: int):
+    import httpx
+
+    block = os.urandom(2**20)
+    expected = hashlib.sha256()
+    for offset in range(0, size, len(block)):
+        expected.update(block[:size - offset])
+    health = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=url, timeout=None,
+                                 limits=httpx.Limits(max_connections=uploads + 10)) as client:
+        async def upload(i: int):
+            headers = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+            response = await client.post(path, content=upload_body(f"bench-{i}.jpg", size, block), headers=headers)
+            response.raise_for_status()
+            assert response.json()["sha256"] == expected.hexdigest()
+
+        async def ping():
+            while not done.is_set():
+                start = time.perf_counter()
+                (await client.get("/health")).raise_for_status()
+                health.append(time.perf_counter() - start)
+                await asyncio.sleep(0.02)
+
+        pinger = asyncio.create_task(ping())
+        start = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(uploads)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await pinger
+    return elapsed, health
+
+def run_variant(variant: str, connection_string: str, uploads: int, size: int):
+    port = free_port()
+    env = dict(os.environ, AZURE_STORAGE_CONNECTION_STRING=connection_string, PYTHONPATH=BACKEND,
+               IMAGE_UPLOAD_MAX_BYTES=str(size + 1))
+    with tempfile.TemporaryDirectory() as workdir:
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_image_upload", "--serve", str(port)],
+                                  cwd=workdir, env=env, stderr=subprocess.DEVNULL)
+        try:
+            import httpx
+            url = f"http://127.0.0.1:{port}"
+            for _ in range(200):
+                try:
+                    httpx.get(f"{url}/health")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+            baseline = proc_status_kb(server.pid, "VmRSS")
+            elapsed, health = asyncio.run(burst(url, ENDPOINTS[variant], uploads, size))
+            peak = proc_status_kb(server.pid, "VmHWM")
+        finally:
+            server.terminate()
+            server.wait()
+    return (peak - baseline) / 1024, elapsed, health
+
+def oversized(connection_string: str, size: int) -> None:
+    """Send one upload twice the limit with its Content-Length; it should get a 413 without being read."""
+    import httpx
+
+    port = free_port()
+    env = dict(os.environ, AZURE_STORAGE_CONNECTION_STRING=connection_string, PYTHONPATH=BACKEND,
+               IMAGE_UPLOAD_MAX_BYTES=str(size // 2))
+    with tempfile.TemporaryDirectory() as workdir:
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_image_upload", "--serve", str(port)],
+                                  cwd=workdir, env=env, stderr=subprocess.DEVNULL)
+        try:
+            url = f"http://127.0.0.1:{port}"
+            for _ in range(200):
+                try:
+                    httpx.get(f"{url}/health")
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.05)
+            start = time.perf_counter()
+            response = httpx.post(f"{url}/images/upload", files={"file": ("big.jpg", os.urandom(size), "image/jpeg")},
+                                  headers={"Expect": "100-continue"}, timeout=60)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+    print(f"{size / 2**20:g} MB upload over a {size / 2**21:g} MB limit: {response.status_code} in {elapsed * 1000:.0f} ms")
+    if response.status_code != 413:
+        sys.exit(f"expected 413 for an oversized upload, got {response.status_code}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=50)
+    parser.add_argument("--size-mb", type=float, nargs="+", default=[10, 20])
+    parser.add_argument("--blob-latency", type=float, default=0.005, help="seconds per blob request")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+
+    blob_app = make_blob_stub(latency=args.blob_latency, keep_data=False)
+    with ServerThread(blob_app) as blob:
+        connection_string = blob_connection_string(blob.url)
+        print(f"{args.uploads} concurrent uploads, {args.blob_latency * 1000:g} ms per blob request")
+        print(f"{'endpoint':<11} {'MB each':>7} {'peak RSS +MB':>13} {'burst s':>8} {'/health p50 ms':>15} {'/health max ms':>15}")
+        for size_mb in args.size_mb:
+            for variant in ENDPOINTS:
+                growth, elapsed, health = run_variant(variant, connection_string, args.uploads, int(size_mb * 2**20))
+                print(f"{variant:<11} {size_mb:>7g} {growth:>13.0f} {elapsed:>8.1f} "
+                      f"{statistics.median(health) * 1000:>15.1f} {max(health) * 1000:>15.1f}")
+        print(f"blob emulator received {blob_app.state.bytes_received / 2**20:.0f} MB, "
+              f"{blob_app.state.staged_blocks} staged blocks")
+        oversized(connection_string, int(args.size_mb[0] * 2**20))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Throughput of concurrent recommendation calls against a local stub LLM.
+
+Compares the old behaviour (sync client called on the event loop) with the
+executor offload and the AsyncAzureOpenAI path, and reports the worst event
+loop stall seen by a heartbeat task while the calls were running.
+
+    python -m benchmarks.bench_llm_concurrency --requests 32 --latency 0.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import ServerThread, make_llm_stub
+
+async def heartbeat(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Return the largest delay between scheduled and actual wake-ups."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+async def run_mode(openai_service, mode: str, requests: int) -> dict:
+    def preferences(i):
+        # Distinct locations so every call reaches the LLM instead of the cache
+        return {"vibe": "romantic", "cuisines": ["italian"], "location": f"NYC {mode} {i}", "budget": "$$"}
+
+    saved_async_client = openai_service.async_client
+
+    async def blocking_call():
+        # What the service did before: a sync HTTP call inside a coroutine
+        openai_service.client.chat.completions.create(
+            model=openai_service.MODEL_DEPLOYMENT_NAME,
+            messages=[{"role": "user", "content": "recommend"}],
+            max_tokens=1000,
+        )
+
+    if mode == "executor":
+        openai_service.async_client = None
+    try:
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(heartbeat(stop))
+        start = time.perf_counter()
+        if mode == "blocking":
+            await asyncio.gather(*(blocking_call() for _ in range(requests)))
+        else:
+            await asyncio.gather(*(
+                openai_service.generate_azure_openai_recommendation(preferences(i))
+                for i in range(requests)
+            ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        worst_stall = await monitor
+    finally:
+        openai_service.async_client = saved_async_client
+
+    return {
+        "mode": mode,
+        "elapsed_s": elapsed,
+        "throughput_rps": requests / elapsed,
+        "worst_loop_stall_ms": worst_stall * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="LLM_MAX_CONCURRENCY")
+    args = parser.parse_args()
+
+    with ServerThread(make_llm_stub(latency=args.latency)) as stub:
+        os.environ["AZURE_OPENAI_API_KEY"] = "benchmark"
+        os.environ["AZURE_OPENAI_ENDPOINT"] = stub.url
+        os.environ["AZURE_OPENAI_CLIENT_MODE"] = "async"
+        os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency)
+        # Measure concurrency alone, not the token budget
+        os.environ["LLM_TOKENS_PER_MINUTE"] = "1e9"
+        from services import openai_service
+
+        async def run_all():
+            # One event loop for every mode: the semaphore and async client bind to it
+            return [await run_mode(openai_service, mode, args.requests)
+                    for mode in ("blocking", "executor", "async")]
+
+        print(f"{args.requests} requests, stub latency {args.latency}s, LLM_MAX_CONCURRENCY={args.concurrency}")
+        print(f"{'mode':<10} {'elapsed s':>10} {'req/s':>8} {'max stall ms':>13}")
+        for result in asyncio.run(run_all()):
+            print(f"{result['mode']:<10} {result['elapsed_s']:>10.2f} "
+                  f"{result['throughput_rps']:>8.1f} {result['worst_loop_stall_ms']:>13.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+How a traffic spike is answered with and without the LLM governor's budgets.
+
+Fires a burst of /advise-style recommendation calls over a handful of
+preference combinations at a stub LLM that enforces a tokens-per-minute
+quota like Azure OpenAI's. Without budgets the calls over quota get 429s
+and fall back to the sample restaurant; with them, calls that can't be
+admitted within the deadline are shed to the cache or static data before
+ever reaching the upstream.
+
+    python -m benchmarks.bench_llm_governor --requests 120 --seconds 4 --tpm 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import ServerThread, make_llm_stub
+
+async def spike(openai_service, requests: int, seconds: float, combinations: int) -> dict:
+    rng = random.Random(7)
+    outcomes = {"restaurant": 0, "sample": 0, "static": 0}
+    latencies = []
+
+    async def one(delay: float, location: str):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        preferences = {"vibe": "romantic", "cuisines": ["italian"], "location": location, "budget": "$$"}
+        restaurants = await openai_service.generate_azure_openai_recommendation(preferences)
+        latencies.append(time.perf_counter() - start)
+        if not restaurants:
+            outcomes["static"] += 1
+        elif restaurants[0].get("name") == "Sample Restaurant":
+            outcomes["sample"] += 1
+        else:
+            outcomes["restaurant"] += 1
+
+    await asyncio.gather(*(
+        one(i * seconds / requests, f"NYC {rng.randrange(combinations)}") for i in range(requests)
+    ))
+    latencies.sort()
+    return {
+        **outcomes,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--seconds", type=float, default=4.0, help="duration of the burst")
+    parser.add_argument("--combinations", type=int, default=30, help="distinct preference combinations")
+    parser.add_argument("--tpm", type=float, default=20000, help="stub deployment quota, tokens per minute")
+    parser.add_argument("--latency", type=float, default=0.5, help="stub LLM latency in seconds")
+    parser.add_argument("--deadline", type=float, default=2.0, help="LLM_QUEUE_DEADLINE_SECONDS")
+    args = parser.parse_args()
+
+    stub_app = make_llm_stub(latency=args.latency, tokens_per_minute=args.tpm)
+    with ServerThread(stub_app) as stub:
+        os.environ["AZURE_OPENAI_API_KEY"] = "benchmark"
+        os.environ["AZURE_OPENAI_ENDPOINT"] = stub.url
+        os.environ["AZURE_OPENAI_CLIENT_MODE"] = "async"
+        os.environ["LLM_QUEUE_DEADLINE_SECONDS"] = str(args.deadline)
+        from services import openai_service
+        from services.llm_governor import LLMGovernor
+        from services.llm_resilience import ResilientCaller
+        from services.recommendation_cache import RecommendationCache
+
+        # No client retries: a retried 429 would only wait out the stub's quota window
+        openai_service.async_client = openai_service.async_client.with_options(max_retries=0)
+
+        async def run_all():
+            results = []
+            for mode, tpm in (("no budget", 1e12), ("governed", args.tpm)):
+                openai_service.llm_governor = LLMGovernor(max_concurrency=8, tokens_per_minute=tpm)
+                openai_service.recommendation_cache = RecommendationCache()
+                # A breaker left open by the previous mode would answer for the governor
+                openai_service.llm_resilience = ResilientCaller()
+                # Each mode starts with the stub's quota fully available
+                stub_app.state.calls = stub_app.state.throttled = 0
+                stub_app.state.charges.clear()
+                result = await spike(openai_service, args.requests, args.seconds, args.combinations)
+                governor = openai_service.llm_governor.stats()
+                result.update(mode=mode, calls=stub_app.state.calls, throttled=stub_app.state.throttled,
+                              shed=governor["shed_predicted"] + governor["shed_deadline"])
+                results.append(result)
+            return results
+
+        print(f"{args.requests} requests in {args.seconds}s over {args.combinations} combinations, "
+              f"stub quota {args.tpm:.0f} TPM, deadline {args.deadline}s")
+        print(f"{'mode':<10} {'LLM calls':>9} {'429s':>5} {'shed':>5} {'restaurant':>10} "
+              f"{'sample':>7} {'static':>7} {'p50 s':>6} {'p95 s':>6}")
+        for r in asyncio.run(run_all()):
+            print(f"{r['mode']:<10} {r['calls']:>9} {r['throttled']:>5} {r['shed']:>5} {r['restaurant']:>10} "
+                  f"{r['sample']:>7} {r['static']:>7} {r['p50']:>6.2f} {r['p95']:>6.2f}")
+
+if __name__ == "__main__":
+    import logging
+    # 429s are expected here and logged as errors
+    logging.disable(logging.ERROR)
+    main()
@@ -0,0 +1,223 @@
+"""
+Tail latency with hedged LLM calls, and outage cost with the circuit breaker.
+
+Runs recommendation calls against a stub LLM with injected faults. First
+a small fraction of calls are very slow: compares latency percentiles
+with and without hedging. Then every call fails with a 500: compares how
+long requests take to reach the fallback, and how many upstream calls
+they make, with and without the circuit breaker. Finally checks that an
+open breaker lets a single trial call through once --open-seconds have
+passed, re-opens when it fails and closes when the LLM is back, and
+that a streamed recommendation whose upstream hangs gives up after the
+attempt timeout.
+
+Checks that hedges fire and win, that hedging bounds the p99 latency
+below the slow calls, that the breaker opens, half-opens and closes, and
+that 429s don't open it; exits non-zero if any check fails. Checks that
+need more slow calls or outage requests than the arguments give are
+skipped.
+
+    python -m benchmarks.bench_llm_resilience --requests 200 --slow-fraction 0.04
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import ServerThread, make_llm_stub
+
+def percentile(ordered, q: float) -> float:
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+async def run_requests(openai_service, tag: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        # Distinct locations so every call reaches the LLM instead of the cache
+        preferences = {"vibe": "romantic", "cuisines": ["italian"], "location": f"NYC {tag} {i}", "budget": "$$"}
+        async with semaphore:
+            start = time.perf_counter()
+            await openai_service.generate_azure_openai_recommendation(preferences)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.3, help="normal stub LLM latency in seconds")
+    parser.add_argument("--slow-fraction", type=float, default=0.04)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--outage-requests", type=int, default=40)
+    parser.add_argument("--open-seconds", type=float, default=0.5, help="breaker open time in the recovery run")
+    parser.add_argument("--attempt-timeout", type=float, default=0.5, help="attempt timeout in the hung stream run")
+    args = parser.parse_args()
+
+    stub_app = make_llm_stub(latency=args.latency, slow_fraction=args.slow_fraction, slow_latency=args.slow_latency)
+    with ServerThread(stub_app) as stub:
+        os.environ["AZURE_OPENAI_API_KEY"] = "benchmark"
+        os.environ["AZURE_OPENAI_ENDPOINT"] = stub.url
+        os.environ["AZURE_OPENAI_CLIENT_MODE"] = "async"
+        os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency * 2)
+        os.environ["LLM_TOKENS_PER_MINUTE"] = "1e9"
+        from services import openai_service
+        from services.llm_resilience import CircuitBreaker, ResilientCaller
+
+        async def tail_latency():
+            results = []
+            for mode, hedging in (("no hedging", False), ("p95 hedging", True)):
+                caller = ResilientCaller(hedge_min_delay=args.latency / 2, min_samples=20)
+                caller.hedging = hedging
+                openai_service.llm_resilience = caller
+                # Warm-up fills the latency window the hedge delay comes from
+                await run_requests(openai_service, f"warm {mode}", 40, args.concurrency)
+                stub_app.state.calls = 0
+                latencies = await run_requests(openai_service, mode, args.requests, args.concurrency)
+                results.append((mode, latencies, stub_app.state.calls, caller.stats()))
+            return results
+
+        async def outage():
+            stub_app.state.failure_rate = 1.0
+            stub_app.state.slow_fraction = 0.0
+            results = []
+            for mode, min_calls in (("no breaker", 10 ** 9), ("breaker", 5)):
+                openai_service.llm_resilience = ResilientCaller(breaker=CircuitBreaker(min_calls=min_calls))
+                stub_app.state.calls = 0
+                latencies = await run_requests(openai_service, f"outage {mode}", args.outage_requests, args.concurrency)
+                results.append((mode, latencies, stub_app.state.calls))
+            return results
+
+        async def recovery():
+            breaker = CircuitBreaker(min_calls=5, open_seconds=args.open_seconds)
+            caller = ResilientCaller(breaker=breaker)
+            openai_service.llm_resilience = caller
+            states = []
+
+            async def step(name: str, requests: int):
+                # Calls the breaker let through, whatever the client retries of each
+                admitted = caller.calls
+                await run_requests(openai_service, f"recovery {name}", requests, args.concurrency)
+                states.append((name, breaker.state, caller.calls - admitted))
+
+            await step("after failures", 10)
+            # Half-open: of the concurrent requests only one trial reaches the LLM, and it fails
+            await asyncio.sleep(args.open_seconds)
+            await step("failed trial", args.concurrency)
+            stub_app.state.failure_rate = 0.0
+            await asyncio.sleep(args.open_seconds)
+            await step("good trial", args.concurrency)
+            await step("closed", args.concurrency)
+            return states, breaker.opens
+
+        async def throttled():
+            # 429s from the provider's quota are the governor's business, not an outage
+            stub_app.state.failure_rate = 0.0
+            caller = ResilientCaller(breaker=CircuitBreaker(min_calls=5))
+            openai_service.llm_resilience = caller
+            throttled_app = make_llm_stub(latency=0.01, tokens_per_minute=1)
+            with ServerThread(throttled_app) as throttled_stub:
+                client = openai_service.async_client
+                openai_service.async_client = client.with_options(base_url=f"{throttled_stub.url}/openai",
+                                                                  max_retries=0)
+                try:
+                    await run_requests(openai_service, "throttled", 20, args.concurrency)
+                finally:
+                    openai_service.async_client = client
+            return caller.breaker.state, caller.stats()["throttled"]
+
+        async def hung_stream():
+            openai_service.llm_resilience = ResilientCaller(attempt_timeout=args.attempt_timeout)
+            stub_app.state.latency = 60.0
+            start = time.perf_counter()
+            preferences = {"vibe": "romantic", "cuisines": ["italian"], "location": "NYC hung", "budget": "$$"}
+            chunks = [chunk async for chunk in openai_service.stream_azure_openai_recommendation(preferences)]
+            stub_app.state.latency = args.latency
+            return time.perf_counter() - start, chunks, openai_service.llm_resilience.stats()
+
+        async def run_all():
+            return (await tail_latency(), await outage(), await recovery(), await throttled(),
+                    await hung_stream())
+
+        tail, down, (states, opens), (throttled_state, throttled_calls), hung = asyncio.run(run_all())
+
+    print(f"{args.requests} requests, {args.slow_fraction:.0%} of LLM calls take {args.slow_latency}s instead of {args.latency}s")
+    print(f"{'mode':<12} {'p50 s':>6} {'p95 s':>6} {'p99 s':>6} {'max s':>6} {'LLM calls':>9} {'hedge wins':>10}")
+    for mode, latencies, calls, stats in tail:
+        print(f"{mode:<12} {statistics.median(latencies):>6.2f} {percentile(latencies, 0.95):>6.2f} "
+              f"{percentile(latencies, 0.99):>6.2f} {latencies[-1]:>6.2f} {calls:>9} "
+              f"{stats['hedge_wins']:>4}/{stats['hedges']:<5}")
+
+    print(f"\n{args.outage_requests} requests while every LLM call fails")
+    print(f"{'mode':<12} {'mean s':>7} {'max s':>6} {'LLM calls':>9}")
+    for mode, latencies, calls in down:
+        print(f"{mode:<12} {statistics.mean(latencies):>7.2f} {latencies[-1]:>6.2f} {calls:>9}")
+
+    print(f"\nbreaker recovery, {args.open_seconds}s open, {args.concurrency} concurrent requests per step")
+    for step, state, calls in states:
+        print(f"{step:<15} {state:<10} {calls:>3} calls admitted")
+
+    failures = []
+
+    def check(condition: bool, message: str) -> None:
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    def skip(message: str) -> None:
+        print(f"skip {message}")
+
+    print()
+    (_, plain, _, plain_stats), (_, hedged, _, hedged_stats) = tail
+    check(plain_stats["hedges"] == 0, "no hedges with hedging off")
+    # Hedging is only measurable with a few slow calls, and while they stay below the p95
+    if args.requests * args.slow_fraction >= 3 and args.slow_fraction < 0.05:
+        check(hedged_stats["hedges"] > 0 and hedged_stats["hedge_wins"] > 0,
+              f"hedges fire past the p95 delay and win ({hedged_stats['hedge_wins']}/{hedged_stats['hedges']})")
+        # Requests stay slow only if their hedge is slow too
+        q = 1 - max(0.01, 2 * args.slow_fraction ** 2)
+        if args.slow_fraction >= 0.02:
+            check(percentile(plain, 0.99) >= args.slow_latency, "without hedging the slow calls reach the p99")
+        check(percentile(hedged, q) < args.slow_latency / 2,
+              f"hedged p{q * 100:g} {percentile(hedged, q):.2f}s stays below half the {args.slow_latency}s slow calls")
+    else:
+        skip(f"hedging checks: {args.requests * args.slow_fraction:.1f} slow calls expected, 3 needed below p95")
+
+    (_, unguarded, unguarded_calls), (_, guarded, guarded_calls) = down
+    # The breaker opens after min_calls failures; calls already in flight still go out
+    let_through = 5 + args.concurrency
+    per_request = unguarded_calls / args.outage_requests
+    check(guarded_calls <= let_through * per_request,
+          f"open breaker keeps requests off the failing LLM ({guarded_calls} vs {unguarded_calls} calls)")
+    if args.outage_requests >= 2 * let_through:
+        check(statistics.mean(guarded) < statistics.mean(unguarded) / 2, "open breaker answers the fallback faster")
+    else:
+        skip(f"fallback latency check: {args.outage_requests} outage requests, {2 * let_through} needed")
+
+    check(states[0][1] == CircuitBreaker.OPEN, "breaker opens after repeated failures")
+    check(states[1][1] == CircuitBreaker.OPEN and states[1][2] == 1,
+          "half-open breaker lets one trial through and re-opens when it fails")
+    check(states[2][1] == CircuitBreaker.CLOSED and states[2][2] == 1,
+          "half-open breaker closes when its trial succeeds")
+    check(states[3][2] == args.concurrency, "closed breaker lets every call through")
+    check(opens == 2, f"breaker opened twice ({opens})")
+    check(throttled_state == CircuitBreaker.CLOSED and throttled_calls > 0,
+          f"429s don't open the breaker ({throttled_calls} throttled calls)")
+
+    elapsed, chunks, stream_stats = hung
+    check(not chunks and elapsed < args.attempt_timeout + 1 and stream_stats["attempt_timeouts"] == 1,
+          f"hung stream gives up after the {args.attempt_timeout}s attempt timeout ({elapsed:.2f}s)")
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+if __name__ == "__main__":
+    import logging
+    # Injected failures are logged as errors
+    logging.disable(logging.CRITICAL)
+    main()
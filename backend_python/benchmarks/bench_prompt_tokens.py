@@ -0,0 +1,174 @@
+"""
+Prompt size of recommendation calls: the old inline template vs prompt_builder.
+
+Counts prompt tokens for the same preferences both ways, for one
+restaurant and for a batch of three, and how much of each prompt is a
+prefix shared by every call (what a provider-side prompt cache can
+reuse, once a prompt reaches its 1024-token minimum). Then sends the new prompts through request_recommendations to a
+local LLM stub and reports the token usage recorded for /metrics. Exits
+non-zero unless the new prompts are at least --min-reduction smaller,
+both counted here and as reported by the stub, and every call asks for
+response_format json_object.
+
+    python -m benchmarks.bench_prompt_tokens --requests 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import (
+    CATALOG_ADJECTIVES, CATALOG_CITIES, CATALOG_CUISINES, CATALOG_DIETARY, CATALOG_DISHES,
+    SAMPLE_COMPLETION, ServerThread, count_tokens, make_llm_stub,
+)
+
+# Shortest prompt Azure OpenAI serves from its prompt cache
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+def legacy_messages(preferences: dict, count: int = 1) -> list:
+    """The prompt generate_azure_openai_recommendation built before prompt_builder."""
+    cuisines = preferences.get('cuisines', [])
+    cuisine_str = cuisines[0] if cuisines and len(cuisines) > 0 else "italian"
+    preferences_text = f"""
+    - Cuisine: {cuisine_str}
+    - Vibe: {preferences.get('vibe', 'romantic')}
+    - Location: {preferences.get('location', 'NYC')}
+    - Budget: {preferences.get('budget', '$$')}
+"""
+    restaurant_schema = f"""    {{
+        "name": "Restaurant Name",
+        "cuisine": "Cuisine Type",
+        "priceRange": "Price Range",
+        "location": "Location",
+        "rating": 4.5,
+        "description": "Detailed description",
+        "fullAddress": "Full address",
+        "phone": "Phone number",
+        "website": "Website URL",
+        "imageUrl": "Image URL",
+        "openingHours": ["Opening hours for each day"],
+        "highlights": ["Highlight 1", "Highlight 2", "Highlight 3"],
+        "menuItems": [
+            {{
+                "name": "Dish Name",
+                "description": "Dish description",
+                "price": "Price",
+                "category": "Category"
+            }}
+        ]
+    }}
+"""
+    if count == 1:
+        prompt = f"""
+    Based on the following preferences, recommend a restaurant:{preferences_text}
+    Return the recommendation in this JSON format:
+{restaurant_schema}    """
+    else:
+        prompt = f"""
+    Based on the following preferences, recommend {count} different restaurants,
+    best match first:{preferences_text}
+    Return the recommendations in this JSON format, with {count} entries in "restaurants":
+    {{"restaurants": [
+{restaurant_schema}    ]}}
+    """
+    return [
+        {"role": "system", "content": "You are a restaurant recommendation assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+def random_preferences(rng: random.Random) -> dict:
+    return {
+        "vibe": rng.choice(CATALOG_ADJECTIVES),
+        "ambience": rng.choice(["", "quiet", "candlelit", "outdoor seating"]),
+        "location": rng.choice(CATALOG_CITIES),
+        "cuisines": [rng.choice(CATALOG_CUISINES)],
+        "budget": "$" * rng.randint(1, 4),
+        "partySize": str(rng.randint(2, 6)),
+        "dietaryRestrictions": rng.sample(CATALOG_DIETARY, rng.randint(0, 2)),
+        "absoluteNogos": rng.sample(CATALOG_DISHES, rng.randint(0, 1)),
+    }
+
+def prompt_tokens(messages: list) -> int:
+    # Chat framing adds about three tokens per message
+    return sum(count_tokens(m["content"]) + 3 for m in messages)
+
+def shared_prefix_tokens(prompts: list) -> int:
+    """Tokens of the longest prefix every prompt starts with."""
+    prefix = os.path.commonprefix(prompts)
+    return count_tokens(prefix)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--min-reduction", type=float, default=0.2, help="smallest prompt token saving that passes")
+    args = parser.parse_args()
+
+    stub_app = make_llm_stub(latency=0.01, content=json.dumps(SAMPLE_COMPLETION))
+    with ServerThread(stub_app) as stub:
+        os.environ.update(AZURE_OPENAI_API_KEY="bench", AZURE_OPENAI_ENDPOINT=stub.url, AZURE_OPENAI_CLIENT_MODE="async")
+        from services.openai_service import request_recommendations
+        from services.prompt_builder import recommendation_messages, token_usage
+
+        rng = random.Random(8)
+        samples = [random_preferences(rng) for _ in range(args.requests)]
+
+        print(f"{args.requests} preference sets, tokens counted with "
+              f"{'tiktoken o200k_base' if count_tokens.__globals__['_ENCODING'] else 'a word/punctuation approximation'}")
+        print(f"{'prompt':<32} {'tokens/call':>12} {'shared prefix':>14}")
+        reductions = []
+        legacy_tokens = {}
+        for count in (1, 3):
+            rows = {}
+            for name, build in (("old template", legacy_messages), ("prompt_builder", recommendation_messages)):
+                built = [build(preferences, count) for preferences in samples]
+                tokens = sum(prompt_tokens(messages) for messages in built) / len(built)
+                flat = ["\n".join(m["content"] for m in messages) for messages in built]
+                rows[name] = tokens
+                print(f"{f'{name}, {count} restaurant(s)':<32} {tokens:>12.0f} {shared_prefix_tokens(flat):>14}")
+            reductions.append(1 - rows["prompt_builder"] / rows["old template"])
+            legacy_tokens[count] = rows["old template"]
+        print(f"prompt tokens saved: {', '.join(f'{r:.0%}' for r in reductions)} (1 and 3 restaurants)")
+        from services.prompt_builder import SYSTEM_PROMPT
+        print(f"system prompt: {count_tokens(SYSTEM_PROMPT)} tokens, "
+              f"{'above' if count_tokens(SYSTEM_PROMPT) >= PROMPT_CACHE_MIN_TOKENS else 'below'} the "
+              f"{PROMPT_CACHE_MIN_TOKENS}-token prompt caching minimum")
+
+        async def run():
+            response_formats = []
+            for preferences in samples:
+                await request_recommendations(preferences, 1)
+                response_formats.append(stub_app.state.last_request.get("response_format"))
+            return response_formats
+        response_formats = asyncio.run(run())
+
+    usage = token_usage.stats()
+    stub_prompt_tokens = usage["prompt_tokens"] / usage["calls"]
+    print(f"through the stub: {usage['calls']} calls, {stub_prompt_tokens:.0f} prompt "
+          f"and {usage['completion_tokens'] / usage['calls']:.0f} completion tokens per call, "
+          f"response_format={response_formats[-1]}")
+
+    failures = []
+
+    def check(condition: bool, message: str) -> None:
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    check(min(reductions) >= args.min_reduction,
+          f"prompt tokens drop by at least {args.min_reduction:.0%} ({min(reductions):.0%})")
+    check(usage["calls"] == args.requests and stub_prompt_tokens <= legacy_tokens[1] * (1 - args.min_reduction),
+          f"stub-reported prompt tokens {stub_prompt_tokens:.0f} at least {args.min_reduction:.0%} "
+          f"below the old template's {legacy_tokens[1]:.0f}")
+    check(all(rf == {"type": "json_object"} for rf in response_formats),
+          "every call sets response_format json_object")
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
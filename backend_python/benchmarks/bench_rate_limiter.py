@@ -0,0 +1,209 @@
+"""
+Memory and per-check cost of the rate limiter with a million distinct client IPs.
+
+Simulates a scan or IP rotation: every request comes from a new IP, spread
+over a few rate-limit windows. Compares the sliding-window MemoryBackend
+with the previous timestamp-list limiter, which kept every IP forever, and
+times the mmap'd SharedMemoryBackend. Then checks that one client hammering
+several worker processes gets the same limit with the shared backend, and
+`workers` times it with per-process counters.
+
+Finally runs RedisBackend's Lua script against fakeredis (pip install
+"fakeredis[lua]"; skipped without it): `workers` nodes with their own
+client to one server must allow one client exactly the limit between
+them, the script must decide like MemoryBackend over a sequence crossing
+window boundaries, it must be re-sent with EVAL after SCRIPT FLUSH, and a
+failing server must fail open. Exits non-zero if any check fails.
+
+    python -m benchmarks.bench_rate_limiter --ips 1000000 --workers 4
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from middleware.rate_limit_backends import MemoryBackend, RedisBackend, SharedMemoryBackend
+
+class TimestampListLimiter:
+    """The previous engine: a list of request timestamps per IP, never evicted."""
+
+    def __init__(self):
+        self.request_history = {}
+
+    def hit(self, key, cost, limit, time_window, now):
+        history = [t for t in self.request_history.get(key, []) if now - t < time_window]
+        allowed = len(history) < limit
+        if allowed:
+            history.append(now)
+        self.request_history[key] = history
+        return allowed
+
+def replay(limiter, ips: int, windows: int, time_window: float) -> None:
+    step = time_window * windows / ips
+    for i in range(ips):
+        limiter.hit(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{i >> 24}", 1, 60, time_window, i * step)
+
+def run(factory, ips: int, windows: int, time_window: float):
+    # Timed without tracemalloc, which slows every allocation down
+    gc.collect()
+    start = time.perf_counter()
+    replay(factory(), ips, windows, time_window)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    limiter = factory()
+    replay(limiter, ips, windows, time_window)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return limiter, elapsed, current, peak
+
+def hammer(backend_name: str, path: str, requests: int, limit: int, allowed) -> None:
+    backend = SharedMemoryBackend(path=path, slots=1024) if backend_name == "shared" else MemoryBackend()
+    count = sum(backend.hit("203.0.113.7", 1, limit, 3600).allowed for _ in range(requests))
+    with allowed.get_lock():
+        allowed.value += count
+
+def allowed_across_workers(backend_name: str, workers: int, requests: int, limit: int) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        allowed = multiprocessing.Value("i", 0)
+        processes = [
+            multiprocessing.Process(
+                target=hammer, args=(backend_name, os.path.join(tmp, "limits.bin"), requests, limit, allowed)
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return allowed.value
+
+class CountingRedis:
+    """Wraps a redis.asyncio client, counting EVALSHA and EVAL calls."""
+
+    def __init__(self, client):
+        self.client = client
+        self.evalsha_calls = 0
+        self.eval_calls = 0
+
+    async def evalsha(self, *args):
+        self.evalsha_calls += 1
+        return await self.client.evalsha(*args)
+
+    async def eval(self, *args):
+        self.eval_calls += 1
+        return await self.client.eval(*args)
+
+class DownRedis:
+    async def evalsha(self, *args):
+        raise ConnectionError("Connection refused")
+
+    async def eval(self, *args):
+        raise ConnectionError("Connection refused")
+
+async def redis_checks(workers: int, limit: int, check) -> None:
+    from fakeredis import FakeServer
+    from fakeredis.aioredis import FakeRedis
+
+    server = FakeServer()
+    clients = [CountingRedis(FakeRedis(server=server)) for _ in range(workers)]
+    nodes = [RedisBackend(client=client) for client in clients]
+
+    async def hammer_node(node):
+        allowed = 0
+        for _ in range(limit * 2):
+            allowed += (await node.hit("203.0.113.7", 1, limit, 3600)).allowed
+        return allowed
+
+    start = time.perf_counter()
+    allowed = sum(await asyncio.gather(*(hammer_node(node) for node in nodes)))
+    elapsed = time.perf_counter() - start
+    print(f"{'redis backend (fake)':<24} allowed {allowed}, "
+          f"{elapsed / (workers * limit * 2) * 1e6:.0f} us/check against fakeredis")
+    check(allowed == limit, f"{workers} redis nodes allow one client exactly {limit}")
+    check(sum(c.eval_calls for c in clients) <= workers and sum(c.evalsha_calls for c in clients) == workers * limit * 2,
+          "script sent with EVAL at most once per node, then called by SHA")
+
+    # The same hits, crossing window boundaries, through both backends
+    rng = random.Random(7)
+    memory, node = MemoryBackend(), nodes[0]
+    now, mismatches, hits = 10_000.0, 0, 2000
+    for _ in range(hits):
+        now += rng.expovariate(1.0)
+        cost = rng.choice((1, 1, 1, 5))
+        expected = memory.hit("198.51.100.9", cost, 30, 60.0, now)
+        got = await node.hit("198.51.100.9", cost, 30, 60.0, now)
+        mismatches += expected.allowed != got.allowed or expected.remaining != got.remaining
+    check(mismatches == 0, f"Lua script decides like MemoryBackend over {hits} hits ({mismatches} differ)")
+
+    await clients[0].client.script_flush()
+    before = clients[0].eval_calls
+    result = await node.hit("192.0.2.1", 1, limit, 3600)
+    check(result.allowed and clients[0].eval_calls == before + 1, "script re-sent with EVAL after SCRIPT FLUSH")
+
+    down = RedisBackend(client=DownRedis())
+    result = await down.hit("192.0.2.1", 1, limit, 3600)
+    check(result.allowed and down.errors == 1, "an unreachable server fails open")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ips", type=int, default=1000000, help="distinct client IPs")
+    parser.add_argument("--windows", type=int, default=10, help="rate-limit windows the requests are spread over")
+    parser.add_argument("--max-keys", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=4, help="processes sharing one client's limit")
+    args = parser.parse_args()
+
+    shared_dir = tempfile.TemporaryDirectory()
+    engines = [
+        ("timestamp lists (old)", TimestampListLimiter),
+        ("sliding window + LRU", lambda: MemoryBackend(max_keys=args.max_keys)),
+        ("shared mmap table", lambda: SharedMemoryBackend(
+            path=os.path.join(shared_dir.name, f"limits-{time.monotonic_ns()}.bin"), slots=args.max_keys)),
+    ]
+    print(f"{args.ips} distinct IPs over {args.windows} windows of 60 s")
+    print(f"{'engine':<24} {'us/check':>9} {'retained MB':>12} {'peak MB':>8}")
+    for name, factory in engines:
+        limiter, elapsed, current, peak = run(factory, args.ips, args.windows, 60.0)
+        print(f"{name:<24} {elapsed / args.ips * 1e6:>9.2f} {current / 2**20:>12.1f} {peak / 2**20:>8.1f}")
+        if isinstance(limiter, MemoryBackend):
+            print(f"{'':<24} keys retained: {len(limiter)} (evicted {limiter.evictions})")
+        elif isinstance(limiter, SharedMemoryBackend):
+            print(f"{'':<24} fixed {limiter.slots * limiter.SLOT.size / 2**20:.1f} MB mmap'd table, outside the Python heap")
+    shared_dir.cleanup()
+
+    limit = 60
+    print(f"\none client, {args.workers} workers x {limit * 2} requests, limit {limit}")
+    for backend_name in ("memory", "shared"):
+        allowed = allowed_across_workers(backend_name, args.workers, limit * 2, limit)
+        print(f"{backend_name + ' backend':<24} allowed {allowed}")
+
+    failures = []
+
+    def check(condition: bool, message: str) -> None:
+        print(f"{'ok  ' if condition else 'FAIL'} {message}")
+        if not condition:
+            failures.append(message)
+
+    try:
+        import fakeredis  # noqa: F401
+        import lupa  # noqa: F401
+    except ImportError:
+        print("skip redis backend checks: pip install \"fakeredis[lua]\"")
+    else:
+        asyncio.run(redis_checks(args.workers, limit, check))
+    if failures:
+        sys.exit(f"{len(failures)} check(s) failed")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,87 @@
+"""
+Latency of local refine requests, and how many of them need the LLM.
+
+Loads a synthetic catalog from a snapshot, then runs typical refine
+messages ("cheaper", "no sushi", "closer to downtown", "more romantic"...)
+through the refine engine against three previous recommendations each.
+Reports per-message latency and the share of messages the engine could
+not satisfy, which /restaurant/refine would send to the LLM.
+
+    python -m benchmarks.bench_refine --restaurants 100000 --requests 2000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import CATALOG_ADJECTIVES, CATALOG_CUISINES, CATALOG_DISHES, CATALOG_NEIGHBORHOODS, synthetic_catalog
+from services import catalog_snapshot
+from services.refine_engine import RefineEngine
+from services.restaurant_catalog import RestaurantCatalog
+
+def random_message(rng: random.Random) -> str:
+    return rng.choice([
+        "cheaper please",
+        "something fancier",
+        f"no {rng.choice(CATALOG_CUISINES)}",
+        f"closer to {rng.choice(CATALOG_NEIGHBORHOODS).lower()}",
+        f"more {rng.choice(CATALOG_ADJECTIVES)}",
+        f"I'd rather have {rng.choice(CATALOG_DISHES)}",
+        f"{rng.choice(CATALOG_CUISINES)} instead, and cheaper",
+        "better rated, no sushi",
+        "something quieter near the waterfront",
+        "hmm not sure",
+    ])
+
+def previous_recommendations(rng: random.Random, records) -> list:
+    picks = rng.sample(records, 3)
+    return [{
+        "id": str(i), "name": r["name"], "description": r["description"], "cuisineType": r["cuisine"],
+        "priceRange": r["priceRange"], "location": r["location"], "rating": r["rating"], "imageUrl": r["imageUrl"],
+        "address": "", "phone": "", "website": "", "openingHours": [], "highlights": r["highlights"],
+        "reasonsToRecommend": [],
+    } for i, r in enumerate(picks)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--restaurants", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    records = list(synthetic_catalog(args.restaurants))
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "catalog.jsonl")
+        snapshot = os.path.join(tmp, "catalog.snap")
+        with open(source, "w") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        catalog_snapshot.main([source, snapshot])
+        catalog = RestaurantCatalog(reload_interval=0).load(snapshot)
+
+        engine = RefineEngine(catalog=catalog)
+        rng = random.Random(4)
+        sample = records[:5000]
+        timings = []
+        for _ in range(args.requests):
+            previous = previous_recommendations(rng, sample)
+            message = random_message(rng)
+            start = time.perf_counter()
+            engine.refine(previous, message)
+            timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    print(f"{args.requests} refine requests over {args.restaurants} restaurants")
+    print(f"local refine: p50 {statistics.median(timings) * 1000:.2f} ms, "
+          f"p99 {timings[int(len(timings) * 0.99) - 1] * 1000:.2f} ms, max {timings[-1] * 1000:.1f} ms")
+    print(f"needing the LLM: {engine.unsatisfied} of {engine.refines} ({engine.unsatisfied / engine.refines:.0%})")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,109 @@
+"""
+Load time, memory and query latency of the indexed restaurant catalog.
+
+Generates a synthetic catalog, loads it through RestaurantCatalog and
+times query() for random preferences, against a linear scan over a list of
+dicts doing the same filtering (how RESTAURANT_DATA-style data would have
+to be searched at that size).
+
+    python -m benchmarks.bench_restaurant_catalog --restaurants 100000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import (
+    CATALOG_CITIES,
+    CATALOG_CUISINES,
+    CATALOG_DIETARY,
+    CATALOG_ADJECTIVES,
+    synthetic_catalog,
+)
+from services.restaurant_catalog import RestaurantCatalog
+
+def random_preferences(rng: random.Random) -> dict:
+    return {
+        "cuisines": [rng.choice(CATALOG_CUISINES)],
+        "location": rng.choice(CATALOG_CITIES),
+        "budget": "$" * rng.randint(1, 4),
+        "vibe": rng.choice(CATALOG_ADJECTIVES),
+        "dietaryRestrictions": rng.sample(CATALOG_DIETARY, rng.randint(0, 1)),
+    }
+
+def linear_scan(records, preferences: dict, limit: int = 10):
+    cuisine = preferences["cuisines"][0]
+    matches = [
+        record for record in records
+        if record["cuisine"].lower() == cuisine
+        and record["city"] == preferences["location"]
+        and record["priceRange"] == preferences["budget"]
+        and preferences["vibe"] in record["description"]
+        and all(tag in record["dietaryTags"] for tag in preferences["dietaryRestrictions"])
+    ]
+    matches.sort(key=lambda record: -record["rating"])
+    return matches[:limit]
+
+def time_queries(fn, queries):
+    timings = []
+    for preferences in queries:
+        start = time.perf_counter()
+        fn(preferences)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--restaurants", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "catalog.jsonl")
+        with open(path, "w") as f:
+            for record in synthetic_catalog(args.restaurants):
+                f.write(json.dumps(record) + "\n")
+
+        start = time.perf_counter()
+        RestaurantCatalog().load(path)
+        load_seconds = time.perf_counter() - start
+
+        # Memory is measured on a second load; tracemalloc slows the first down several times
+        gc.collect()
+        tracemalloc.start()
+        catalog = RestaurantCatalog().load(path)
+        catalog_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        gc.collect()
+        tracemalloc.start()
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    rng = random.Random(1)
+    queries = [random_preferences(rng) for _ in range(args.queries)]
+    indexed = time_queries(lambda preferences: catalog.query(preferences, limit=10), queries)
+    scanned = time_queries(lambda preferences: linear_scan(records, preferences), queries[:100])
+
+    print(f"{args.restaurants} restaurants, {args.queries} random queries")
+    print(f"catalog load: {load_seconds:.2f} s, {catalog_bytes / 2**20:.1f} MB "
+          f"(list of dicts: {dict_bytes / 2**20:.1f} MB)")
+    print(f"{'lookup':<14} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'linear scan':<14} {scanned[0] * 1000:>8.3f} {scanned[1] * 1000:>8.3f}")
+    print(f"{'query()':<14} {indexed[0] * 1000:>8.3f} {indexed[1] * 1000:>8.3f}")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,119 @@
+"""
+Parse latency and recovery rate of the restaurant parser on malformed completions.
+
+Builds a seeded fuzz corpus from well-formed restaurant JSON: markdown
+fences, chatty prefixes/suffixes, trailing commas, and completions cut off
+at random points the way max_tokens truncates them. Each case is parsed in
+one shot and as a stream of random-sized chunks, and compared with plain
+json.loads (what the service used before).
+
+    python -m benchmarks.bench_restaurant_parser --cases 2000
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import SAMPLE_COMPLETION
+from utils.restaurant_parser import RestaurantStreamParser, parse_restaurant_json
+
+def _restaurant(rng: random.Random) -> dict:
+    data = copy.deepcopy(SAMPLE_COMPLETION)
+    data["name"] = f"Stub \"Bistro\" #{rng.randint(1, 9999)}"
+    data["description"] = "Cozy, candlelit; serves {pasta} & [wine]. " * rng.randint(1, 4)
+    data["menuItems"] = [
+        {"name": f"Dish {i}", "description": "House special, with a \\ backslash", "price": f"${10 + i}", "category": "Main"}
+        for i in range(rng.randint(1, 8))
+    ]
+    return data
+
+def _mutations():
+    def fenced(text, rng):
+        return f"```json\n{text}\n```"
+
+    def chatty(text, rng):
+        return f"Sure! Here is a great option for your date:\n\n{text}\n\nEnjoy your meal!"
+
+    def trailing_commas(text, rng):
+        return text.replace("\n  }", ",\n  }").replace("\n}", ",\n}")
+
+    def truncated(text, rng):
+        return text[:rng.randint(len(text) // 4, len(text) - 1)]
+
+    def fenced_truncated(text, rng):
+        return truncated(fenced(text, rng), rng)
+
+    return {
+        "clean": lambda text, rng: text,
+        "fenced": fenced,
+        "chatty": chatty,
+        "trailing_commas": trailing_commas,
+        "truncated": truncated,
+        "fenced_truncated": fenced_truncated,
+    }
+
+def build_corpus(cases: int, seed: int = 7):
+    rng = random.Random(seed)
+    mutations = _mutations()
+    corpus = []
+    for i in range(cases):
+        kind = list(mutations)[i % len(mutations)]
+        text = json.dumps(_restaurant(rng), indent=2 if rng.random() < 0.5 else None)
+        corpus.append((kind, mutations[kind](text, rng)))
+    return corpus
+
+def _json_loads(text):
+    try:
+        value = json.loads(text)
+        return value if isinstance(value, dict) else None
+    except json.JSONDecodeError:
+        return None
+
+def _streamed(text, rng):
+    parser = RestaurantStreamParser()
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 24)
+        parser.feed(text[pos:pos + size])
+        pos += size
+    return parser.finish()
+
+def run(corpus, name, parse):
+    rng = random.Random(11)
+    timings, recovered = [], {}
+    for kind, text in corpus:
+        start = time.perf_counter()
+        result = parse(text, rng)
+        timings.append(time.perf_counter() - start)
+        ok = bool(result and result.get("name"))
+        total, good = recovered.get(kind, (0, 0))
+        recovered[kind] = (total + 1, good + ok)
+
+    timings.sort()
+    good = sum(g for _, g in recovered.values())
+    print(f"\n{name}: recovery {good / len(corpus):.1%}, "
+          f"mean {statistics.mean(timings) * 1e6:.0f} us, p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} us")
+    for kind, (total, good) in recovered.items():
+        print(f"  {kind:<17} {good / total:>7.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cases", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.cases)
+    print(f"{len(corpus)} completions, mean {statistics.mean(len(t) for _, t in corpus):.0f} chars")
+    run(corpus, "json.loads", lambda text, rng: _json_loads(text))
+    run(corpus, "parse_restaurant_json", lambda text, rng: parse_restaurant_json(text))
+    run(corpus, "RestaurantStreamParser (chunked)", _streamed)
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,101 @@
+"""
+Refine requests carrying the previous recommendations vs a session id.
+
+Opens a session with three fully populated recommendations (hours,
+highlights, menu), then sends the same refine messages through the app
+two ways: with the recommendations in the request body, as clients had to
+before sessions, and with just the session id. Reports request size and
+per-request latency, and how much of it is validating the body.
+
+    python -m benchmarks.bench_session_refine --requests 500
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import CATALOG_ADJECTIVES, CATALOG_CUISINES, CATALOG_DISHES
+from models.schemas import RefineRequest
+
+def full_recommendation(i: int, rng: random.Random) -> dict:
+    cuisine = rng.choice(CATALOG_CUISINES).title()
+    return {
+        "id": str(i),
+        "name": f"{rng.choice(CATALOG_ADJECTIVES).title()} {cuisine} House {i}",
+        "description": f"A {rng.choice(CATALOG_ADJECTIVES)} {cuisine.lower()} spot known for its "
+                       f"{rng.choice(CATALOG_DISHES)} and a long, candle-lit dining room.",
+        "cuisineType": cuisine,
+        "priceRange": "$" * rng.randint(1, 4),
+        "location": "NYC",
+        "rating": round(rng.uniform(3.5, 5.0), 1),
+        "imageUrl": f"https://images.example.com/restaurants/{i}/hero.jpg",
+        "address": f"{rng.randint(1, 999)} Example Street, New York, NY 10001",
+        "phone": "(212) 555-0100",
+        "website": f"https://www.restaurant{i}.example.com",
+        "openingHours": [f"{day}: 5:00 PM - 11:00 PM" for day in
+                         ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")],
+        "highlights": [f"{rng.choice(CATALOG_ADJECTIVES).title()} atmosphere" for _ in range(4)],
+        "reasonsToRecommend": ["Perfect for a date night", "Great wine list", "Attentive service"],
+        "menuItems": [
+            {"name": f"{dish.title()}", "description": f"House {dish} with seasonal sides", "price": f"${rng.randint(12, 45)}"}
+            for dish in rng.sample(CATALOG_DISHES, 6)
+        ],
+    }
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    # Local refine only: the LLM fallback would dominate both variants alike
+    os.environ.pop("AZURE_OPENAI_API_KEY", None)
+    from fastapi.testclient import TestClient
+    from main import app
+    from services.session_store import session_store
+
+    client = TestClient(app)
+    rng = random.Random(5)
+    previous = [full_recommendation(i, rng) for i in range(3)]
+    messages = ["cheaper please", "something more lively", f"no {CATALOG_CUISINES[0]}", "better rated"]
+
+    results = {}
+    for variant in ("previousRecommendations", "sessionId"):
+        sizes, timings, validation = [], [], []
+        for n in range(args.requests):
+            message = messages[n % len(messages)]
+            if variant == "sessionId":
+                # A fresh session per request, so both variants refine the same three restaurants
+                body = {"sessionId": session_store.create({}, previous).id, "userMessage": message}
+            else:
+                body = {"previousRecommendations": previous, "userMessage": message}
+            payload = json.dumps(body)
+            sizes.append(len(payload))
+
+            start = time.perf_counter()
+            RefineRequest.parse_raw(payload)
+            validation.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            response = client.post("/restaurant/refine", content=payload, headers={"Content-Type": "application/json"})
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+        results[variant] = (statistics.mean(sizes), percentiles(timings), statistics.median(validation))
+
+    print(f"{args.requests} refine requests per variant, 3 previous recommendations")
+    print(f"{'request carries':<24} {'bytes':>7} {'p50 ms':>8} {'p99 ms':>8} {'parse ms':>9}")
+    for variant, (size, (p50, p99), parse) in results.items():
+        print(f"{variant:<24} {size:>7.0f} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f} {parse * 1000:>9.3f}")
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.WARNING)
+    main()
@@ -0,0 +1,113 @@
+"""
+Free-text retrieval over the catalog with the hashed TF-IDF vector index.
+
+Builds the catalog (and its vectors) from a synthetic set of restaurants,
+then times free-text searches three ways: a pure-Python cosine loop over
+sparse word-weight dicts, the index's sparse scoring of one query, and
+its chunked matrix product for a batch of queries. Reports the memory of
+the sparse vectors and of the dense float32 matrix they replace. Also times ranking only the rows a
+preference bitmap selects, as the /advise fallback does, and what a
+refine request does: re-ranking a handful of previous recommendations
+against the message.
+
+    python -m benchmarks.bench_vector_index --restaurants 100000 --batch 64
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.stubs import CATALOG_ADJECTIVES, CATALOG_CUISINES, CATALOG_DISHES, synthetic_catalog
+from services.restaurant_catalog import bitmap_mask, build_catalog
+from services.vector_index import rank, top_k
+
+def random_message(rng: random.Random) -> str:
+    return f"something {rng.choice(CATALOG_ADJECTIVES)} with {rng.choice(CATALOG_DISHES)}, maybe {rng.choice(CATALOG_CUISINES)}"
+
+def python_search(documents, embedder, text: str, k: int):
+    """Cosine similarity over sparse dicts, no NumPy: what the index replaces."""
+    query = embedder._weights(text)
+    scored = []
+    for row, document in enumerate(documents):
+        score = sum(weight * document.get(bucket, 0.0) for bucket, weight in query.items())
+        scored.append((score, row))
+    scored.sort(reverse=True)
+    return scored[:k]
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--restaurants", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    records = list(synthetic_catalog(args.restaurants))
+    start = time.perf_counter()
+    data = build_catalog(records)
+    build_seconds = time.perf_counter() - start
+    embedder = data.embedder
+
+    rng = random.Random(2)
+    messages = [random_message(rng) for _ in range(args.queries)]
+
+    # The pure-Python loop is slow; time it on a few queries only
+    documents = [
+        embedder._weights(f"{r['cuisine']} {r['description']} {' '.join(r['highlights'])}") for r in records
+    ]
+    loop = []
+    for text in messages[:10]:
+        start = time.perf_counter()
+        python_search(documents, embedder, text, args.k)
+        loop.append(time.perf_counter() - start)
+
+    single = []
+    for text in messages:
+        start = time.perf_counter()
+        top_k(data.vectors, embedder.embed([text]), args.k)
+        single.append(time.perf_counter() - start)
+
+    batched = []
+    for i in range(0, len(messages), args.batch):
+        chunk = messages[i:i + args.batch]
+        start = time.perf_counter()
+        top_k(data.vectors, embedder.embed(chunk), args.k)
+        batched.append((time.perf_counter() - start) / len(chunk))
+
+    # The /advise fallback: rank one preference match set (a cuisine at a price, ~1/60 of rows) by the vibe text
+    masked = []
+    for text in messages:
+        start = time.perf_counter()
+        bitmap = data.index["cuisine"][rng.choice(CATALOG_CUISINES)] & data.index["price"][str(rng.randint(1, 4))]
+        top_k(data.vectors, embedder.embed([text]), args.k, bitmap_mask(bitmap, data.size))
+        masked.append(time.perf_counter() - start)
+
+    candidates = [f"{r['cuisine']} {r['name']} {r['description']}" for r in records[:8]]
+    refine = []
+    for text in messages:
+        start = time.perf_counter()
+        rank(text, candidates, embedder)
+        refine.append(time.perf_counter() - start)
+
+    print(f"{args.restaurants} restaurants, {embedder.dim}-dim vectors "
+          f"({data.vectors.nbytes / 2**20:.0f} MB sparse, {data.size * embedder.dim * 4 / 2**20:.0f} MB dense), "
+          f"catalog + vectors built in {build_seconds:.1f} s")
+    print(f"{'search':<36} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, timings in (("python loop (10 queries)", loop),
+                          ("index, 1 query", single),
+                          (f"index, batch of {args.batch} (per query)", batched),
+                          ("index, cuisine + price matches", masked),
+                          ("refine re-rank, 8 candidates", refine)):
+        p50, p99 = percentiles(timings)
+        print(f"{name:<36} {p50 * 1000:>8.3f} {p99 * 1000:>8.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Local stand-ins for upstream services and data used by the benchmarks.
+
+Each stub is a small FastAPI app served by uvicorn on a background thread,
+so benchmarks exercise the real client code paths over real sockets.
+synthetic_catalog() generates restaurant catalogs of any size.
+"""
+import asyncio
+import itertools
+import json
+import random
+import re
+import socket
+import threading
+import time
+from collections import deque
+from email.utils import formatdate, parsedate_to_datetime
+from xml.sax.saxutils import escape
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+SAMPLE_COMPLETION = {
+    "name": "Stub Trattoria",
+    "cuisine": "Italian",
+    "priceRange": "$$",
+    "location": "NYC",
+    "rating": 4.6,
+    "description": "A stub restaurant served by the local benchmark LLM.",
+    "fullAddress": "1 Benchmark Way, NYC",
+    "phone": "(555) 000-0000",
+    "website": "https://www.stubtrattoria.com",
+    "imageUrl": "https://images.unsplash.com/photo-1517248135467-4c7edcad34c4?w=800&q=80",
+    "openingHours": ["11:00 AM - 10:00 PM"] * 7,
+    "highlights": ["Handmade pasta", "Candlelit tables", "Natural wine"],
+    "menuItems": [
+        {"name": "Cacio e Pepe", "description": "Pecorino, black pepper", "price": "$22", "category": "Main"}
+    ],
+}
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+# Approximates BPE: a token per word, per short run of punctuation (`":"`, `","`) and per
+# line break or run of indentation
+_TOKEN = re.compile(r"\w+|[^\w\s]{1,3}|\s*\n\s*| {2,}")
+
+def count_tokens(text: str) -> int:
+    """GPT-4o tokens in text with tiktoken if its encoding is available, else an approximation."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return len(_TOKEN.findall(text))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class ServerThread:
+    """Run an ASGI app with uvicorn on a daemon thread."""
+
+    def __init__(self, app, port: int = None):
+        self.port = port or free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+def make_llm_stub(latency: float = 0.5,
+                  content: str = None,
+                  tokens_per_minute: float = None,
+                  slow_fraction: float = 0.0,
+                  slow_latency: float = 0.0,
+                  failure_rate: float = 0.0,
+                  seed: int = 11) -> FastAPI:
+    """
+    Fake Azure OpenAI chat completions endpoint with a fixed latency.
+
+    With tokens_per_minute set it enforces a quota like Azure's: each call
+    is charged its prompt characters / 4 plus max_tokens over a sliding
+    minute, and calls over quota get a 429 with Retry-After. A
+    `slow_fraction` of calls take `slow_latency` instead, and a
+    `failure_rate` of calls answer 500. The latency and fault settings are
+    kept on app.state so a benchmark can change them while it runs.
+    Responses report usage counted with count_tokens(), and the last
+    request body is kept as app.state.last_request.
+    """
+    app = FastAPI()
+    app.state.calls = 0
+    app.state.last_request = None
+    app.state.throttled = 0
+    app.state.failed = 0
+    app.state.latency = latency
+    app.state.slow_fraction = slow_fraction
+    app.state.slow_latency = slow_latency
+    app.state.failure_rate = failure_rate
+    rng = random.Random(seed)
+    # (time, tokens) charged in the last minute; replace to reset the quota
+    app.state.charges = deque()
+    body = content if content is not None else json.dumps(SAMPLE_COMPLETION)
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        app.state.calls += 1
+        payload = await request.json()
+        app.state.last_request = payload
+        if tokens_per_minute:
+            cost = sum(len(m.get("content", "")) for m in payload["messages"]) // 4 + payload.get("max_tokens", 0)
+            charges = app.state.charges
+            now = time.monotonic()
+            while charges and charges[0][0] < now - 60:
+                charges.popleft()
+            if sum(charged for _, charged in charges) + cost > tokens_per_minute:
+                app.state.throttled += 1
+                retry_after = max(int(charges[0][0] + 60 - now) + 1, 1) if charges else 1
+                return JSONResponse(
+                    status_code=429,
+                    content={"error": {"code": "429", "message": "Rate limit exceeded"}},
+                    headers={"Retry-After": str(retry_after)},
+                )
+            charges.append((now, cost))
+        slow = rng.random() < app.state.slow_fraction
+        await asyncio.sleep(app.state.slow_latency if slow else app.state.latency)
+        if rng.random() < app.state.failure_rate:
+            app.state.failed += 1
+            return JSONResponse(status_code=500, content={"error": {"code": "500", "message": "Injected failure"}})
+        # Chat framing adds about three tokens per message
+        prompt_tokens = sum(count_tokens(m.get("content", "")) + 3 for m in payload["messages"])
+        completion_tokens = count_tokens(body)
+        return {
+            "id": f"stub-{app.state.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": body},
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    return app
+
+# Azurite's well-known development account; the blob stub doesn't check signatures
+BLOB_STUB_ACCOUNT = "devstoreaccount1"
+BLOB_STUB_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+
+def blob_connection_string(url: str) -> str:
+    """AZURE_STORAGE_CONNECTION_STRING pointing the Azure SDK at a blob stub served at url."""
+    return (f"DefaultEndpointsProtocol=http;AccountName={BLOB_STUB_ACCOUNT};AccountKey={BLOB_STUB_KEY};"
+            f"BlobEndpoint={url}/{BLOB_STUB_ACCOUNT};")
+
+def make_blob_stub(latency: float = 0.0, keep_data: bool = True) -> FastAPI:
+    """
+    Minimal Azure Blob Storage emulator: containers, single-shot and block
+    uploads, properties, ranged downloads, listing and deletes.
+
+    Each request waits `latency` seconds. With keep_data=False block
+    contents are dropped after counting, so a benchmark can push gigabytes
+    through it (such blobs can't be downloaded). app.state.blobs maps
+    (container, name) to the stored blob, app.state.staged_blocks,
+    app.state.bytes_received and app.state.bytes_sent count the traffic,
+    app.state.reads the blob GET and HEAD requests.
+    """
+    app = FastAPI()
+    app.state.latency = latency
+    app.state.containers = set()
+    app.state.blobs = {}
+    app.state.blocks = {}
+    app.state.staged_blocks = 0
+    app.state.bytes_received = 0
+    app.state.bytes_sent = 0
+    app.state.reads = 0
+    versions = itertools.count(1)
+
+    async def receive(request: Request):
+        """Request body, or just its length when data isn't kept."""
+        if keep_data:
+            body = await request.body()
+            app.state.bytes_received += len(body)
+            return body
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+        app.state.bytes_received += size
+        return size
+
+    def store(container: str, blob: str, data, request: Request) -> Response:
+        etag = f'"0x{next(versions):016X}"'
+        app.state.blobs[(container, blob)] = {
+            "data": data if keep_data else None,
+            "size": len(data) if keep_data else data,
+            "etag": etag,
+            "last_modified": formatdate(time.time(), usegmt=True),
+            "content_type": request.headers.get("x-ms-blob-content-type", "application/octet-stream"),
+            "metadata": {k: v for k, v in request.headers.items() if k.startswith("x-ms-meta-")},
+        }
+        return Response(status_code=201, headers={"ETag": etag, "Last-Modified": app.state.blobs[(container, blob)]["last_modified"]})
+
+    @app.api_route("/{account}/{container}", methods=["GET", "HEAD", "PUT"])
+    async def container_operation(account: str, container: str, request: Request):
+        await asyncio.sleep(app.state.latency)
+        if request.method == "PUT":
+            app.state.containers.add(container)
+            return Response(status_code=201)
+        if container not in app.state.containers:
+            return Response(status_code=404, headers={"x-ms-error-code": "ContainerNotFound"})
+        if request.query_params.get("comp") == "list":
+            prefix = request.query_params.get("prefix", "")
+            blobs = "".join(
+                f"<Blob><Name>{escape(name)}</Name><Properties><Last-Modified>{stored['last_modified']}</Last-Modified>"
+                f"<Etag>{stored['etag']}</Etag><Content-Length>{stored['size']}</Content-Length>"
+                f"<Content-Type>{stored['content_type']}</Content-Type><BlobType>BlockBlob</BlobType></Properties></Blob>"
+                for (blob_container, name), stored in sorted(app.state.blobs.items())
+                if blob_container == container and name.startswith(prefix)
+            )
+            body = (f'<?xml version="1.0" encoding="utf-8"?><EnumerationResults ServiceEndpoint="{request.base_url}" '
+                    f'ContainerName="{container}"><Prefix>{escape(prefix)}</Prefix><Blobs>{blobs}</Blobs>'
+                    f'<NextMarker /></EnumerationResults>')
+            return Response(content=body, media_type="application/xml")
+        return Response(status_code=200)
+
+    @app.put("/{account}/{container}/{blob:path}")
+    async def put_blob(account: str, container: str, blob: str, request: Request):
+        await asyncio.sleep(app.state.latency)
+        comp = request.query_params.get("comp")
+        if comp == "block":
+            app.state.blocks[(container, blob, request.query_params["blockid"])] = await receive(request)
+            app.state.staged_blocks += 1
+            return Response(status_code=201)
+        if comp == "blocklist":
+            ids = re.findall(r"<(?:Latest|Uncommitted|Committed)>([^<]+)<", (await request.body()).decode())
+            parts = [app.state.blocks.pop((container, blob, block_id)) for block_id in ids]
+            return store(container, blob, b"".join(parts) if keep_data else sum(parts), request)
+        return store(container, blob, await receive(request), request)
+
+    @app.delete("/{account}/{container}/{blob:path}")
+    async def delete_blob(account: str, container: str, blob: str, request: Request):
+        await asyncio.sleep(app.state.latency)
+        stored = app.state.blobs.get((container, blob))
+        if stored is None:
+            return Response(status_code=404, headers={"x-ms-error-code": "BlobNotFound"})
+        since = request.headers.get("if-unmodified-since")
+        if since and parsedate_to_datetime(stored["last_modified"]) > parsedate_to_datetime(since):
+            return Response(status_code=412, headers={"x-ms-error-code": "ConditionNotMet"})
+        del app.state.blobs[(container, blob)]
+        return Response(status_code=202)
+
+    @app.api_route("/{account}/{container}/{blob:path}", methods=["GET", "HEAD"])
+    async def get_blob(account: str, container: str, blob: str, request: Request):
+        await asyncio.sleep(app.state.latency)
+        app.state.reads += 1
+        stored = app.state.blobs.get((container, blob))
+        if stored is None:
+            return Response(status_code=404, headers={"x-ms-error-code": "BlobNotFound"})
+        headers = {
+            "ETag": stored["etag"],
+            "Last-Modified": stored["last_modified"],
+            "Content-Type": stored["content_type"],
+            "x-ms-blob-type": "BlockBlob",
+            "Accept-Ranges": "bytes",
+            **stored["metadata"],
+        }
+        if_match = request.headers.get("if-match")
+        if if_match and if_match != stored["etag"]:
+            return Response(status_code=412, headers={"x-ms-error-code": "ConditionNotMet"})
+        if request.method == "HEAD":
+            return Response(status_code=200, headers={**headers, "Content-Length": str(stored["size"])})
+
+        data = stored["data"]
+        match = re.match(r"bytes=(\d+)-(\d*)", request.headers.get("x-ms-range") or request.headers.get("range") or "")
+        if match is None:
+            app.state.bytes_sent += len(data)
+            return Response(content=data, status_code=200, headers=headers)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+        if start >= len(data):
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}",
+                                                      "x-ms-error-code": "InvalidRange"})
+        app.state.bytes_sent += end - start + 1
+        return Response(content=data[start:end + 1], status_code=206,
+                        headers={**headers, "Content-Range": f"bytes {start}-{end}/{len(data)}"})
+
+    return app
+
+CATALOG_CUISINES = [
+    "italian", "japanese", "french", "mexican", "thai", "indian", "chinese", "korean",
+    "american", "mediterranean", "spanish", "greek", "vietnamese", "seafood", "vegan",
+]
+CATALOG_CITIES = ["NYC", "Brooklyn", "Chicago", "San Francisco", "Seattle", "Austin", "Boston", "Miami"]
+CATALOG_NEIGHBORHOODS = [
+    "Downtown", "Midtown", "Uptown", "Old Town", "Waterfront", "Arts District",
+    "West Village", "Harbor", "Riverside", "Market Square",
+]
+CATALOG_ADJECTIVES = [
+    "romantic", "cozy", "casual", "trendy", "elegant", "lively", "quiet", "candlelit",
+    "rooftop", "bustling", "intimate", "relaxed", "modern", "hidden",
+]
+CATALOG_DISHES = [
+    "handmade pasta", "omakase", "wood-fired pizza", "street tacos", "curries", "dim sum",
+    "tasting menu", "small plates", "grilled seafood", "natural wine", "craft cocktails", "brunch",
+]
+CATALOG_DIETARY = ["vegetarian", "vegan", "gluten-free", "halal", "kosher", "dairy-free"]
+
+def synthetic_catalog(count: int, seed: int = 5):
+    """Yield `count` catalog records shaped like RESTAURANT_DATA entries, plus city and dietaryTags."""
+    rng = random.Random(seed)
+    for i in range(count):
+        cuisine = rng.choice(CATALOG_CUISINES)
+        adjectives = rng.sample(CATALOG_ADJECTIVES, 2)
+        dishes = rng.sample(CATALOG_DISHES, 2)
+        yield {
+            "name": f"{cuisine.title()} House {i}",
+            "description": f"A {adjectives[0]}, {adjectives[1]} {cuisine} spot known for {dishes[0]} and {dishes[1]}.",
+            "cuisine": cuisine.title(),
+            "priceRange": "$" * rng.randint(1, 4),
+            "location": rng.choice(CATALOG_NEIGHBORHOODS),
+            "city": rng.choice(CATALOG_CITIES),
+            "rating": round(rng.uniform(3.0, 5.0), 1),
+            "imageUrl": f"https://source.unsplash.com/featured/?{cuisine},restaurant",
+            "dietaryTags": rng.sample(CATALOG_DIETARY, rng.randint(0, 2)),
+            "highlights": [dish.capitalize() for dish in dishes],
+        }
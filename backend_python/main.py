@@ -1,11 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
-from api import advise, health, refine, images
+from api import advise, health, refine, images, metrics
+from middleware.rate_limiter import get_rate_limiter
+from services.cache_purger import cache_purger
+from services.image_cache import image_cache
+from services.image_store import image_store
+from services.restaurant_catalog import restaurant_catalog
+from services.warm_pool import warm_pool
+from utils.http_client import outbound_http
 from utils.logger import setup_logger
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    restaurant_catalog.load()
+    image_cache.remove_legacy_dir()
+    await outbound_http.start()
+    warm_pool.start()
+    image_store.start()
+    cache_purger.start()
+    yield
+    await cache_purger.stop()
+    await image_store.stop()
+    await warm_pool.stop()
+    await outbound_http.close()
+
+app = FastAPI(lifespan=lifespan)
 
 setup_logger()
 
@@ -17,6 +39,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if os.environ.get("RATE_LIMIT_ENABLED", "0") == "1":
+    app.middleware("http")(get_rate_limiter(app))
+
 # Create static directory if it doesn't exist
 os.makedirs("static/images", exist_ok=True)
 
@@ -31,6 +56,7 @@ app.include_router(advise.router)
 app.include_router(health.router)
 app.include_router(refine.router)
 app.include_router(images.router)
+app.include_router(metrics.router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,301 @@
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process file locks, use MemoryBackend
+    fcntl = None
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float
+    reset_after: float
+
+def sliding_window_check(previous: float,
+                         current: float,
+                         elapsed: float,
+                         cost: int,
+                         limit: int,
+                         time_window: float):
+    """
+    Sliding-window-counter decision shared by all backends.
+
+    The request rate is estimated as the current window's count plus the
+    previous window's count weighted by how much of it still overlaps the
+    sliding window. Returns (allowed, estimate after the request, retry_after).
+    """
+    weight = 1.0 - elapsed / time_window
+    estimate = previous * weight + current
+    if estimate + cost <= limit:
+        return True, estimate + cost, 0.0
+
+    if current + cost > limit:
+        # Not enough room even once the previous window has slid out: wait
+        # for the next window, then for enough of this one to slide out too
+        retry_after = time_window - elapsed + time_window * (1.0 - (limit - cost) / max(current, 1))
+        return False, estimate, max(retry_after, 0.0)
+
+    # Wait until enough of the previous window has slid out
+    needed_weight = (limit - current - cost) / previous
+    return False, estimate, max((1.0 - needed_weight) * time_window - elapsed, 0.0)
+
+def check_window(previous: float,
+                 current: float,
+                 elapsed: float,
+                 cost: int,
+                 limit: int,
+                 time_window: float) -> RateLimitResult:
+    allowed, estimate, retry_after = sliding_window_check(previous, current, elapsed, cost, limit, time_window)
+    return RateLimitResult(
+        allowed=allowed,
+        limit=limit,
+        remaining=max(int(limit - estimate), 0),
+        retry_after=retry_after,
+        reset_after=time_window - elapsed,
+    )
+
+class _Window:
+    __slots__ = ("index", "previous", "current")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.previous = 0
+        self.current = 0
+
+class MemoryBackend:
+    """
+    Per-process sliding-window counters with bounded memory.
+
+    Each key costs one small __slots__ object in an LRU-ordered dict. Keys
+    idle for more than a full window carry no weight and are evicted from
+    the LRU end as requests come in, and at most `max_keys` are kept.
+    """
+
+    def __init__(self, max_keys: int = None):
+        self.max_keys = max_keys or int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000))
+        self._windows: "OrderedDict[str, _Window]" = OrderedDict()
+        self.evictions = 0
+
+    def hit(self, key: str, cost: int, limit: int, time_window: float, now: float = None) -> RateLimitResult:
+        now = time.time() if now is None else now
+        index = int(now // time_window)
+        elapsed = now - index * time_window
+
+        window = self._windows.get(key)
+        if window is None:
+            window = _Window(index)
+            self._windows[key] = window
+        else:
+            self._windows.move_to_end(key)
+            if window.index != index:
+                window.previous = window.current if window.index == index - 1 else 0
+                window.current = 0
+                window.index = index
+
+        result = check_window(window.previous, window.current, elapsed, cost, limit, time_window)
+        if result.allowed:
+            window.current += cost
+        self._evict(index)
+        return result
+
+    def _evict(self, index: int) -> None:
+        windows = self._windows
+        while windows:
+            oldest = next(iter(windows.values()))
+            # Counts older than the previous window no longer affect any decision
+            if oldest.index >= index - 1 and len(windows) <= self.max_keys:
+                break
+            windows.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+class SharedMemoryBackend:
+    """
+    Sliding-window counters in an mmap'd file shared by every worker on the host.
+
+    The file is a fixed-size open-addressing table of 24-byte slots (key
+    hash, window index, previous count, current count). A check-and-increment
+    holds an exclusive flock on the file, so gunicorn workers enforce one
+    limit between them. Slots whose counts have expired are reused; if all
+    probed slots are live, the one with the oldest window is taken over.
+    """
+
+    SLOT = struct.Struct("<QqII")
+    MAX_PROBES = 16
+
+    def __init__(self, path: str = None, slots: int = None):
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryBackend needs fcntl (POSIX only)")
+        self.path = path or os.environ.get(
+            "RATE_LIMIT_SHARED_PATH", os.path.join(tempfile.gettempdir(), "datemeal_rate_limit.bin")
+        )
+        self.slots = slots or int(os.environ.get("RATE_LIMIT_SHARED_SLOTS", 65536))
+        size = self.slots * self.SLOT.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self.evictions = 0
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Stable across processes (unlike hash()); 0 marks an empty slot
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") | 1
+
+    def hit(self, key: str, cost: int, limit: int, time_window: float, now: float = None) -> RateLimitResult:
+        now = time.time() if now is None else now
+        index = int(now // time_window)
+        elapsed = now - index * time_window
+        key_hash = self._hash(key)
+        slot_struct = self.SLOT
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, previous, current, window_index = self._find_slot(key_hash, index)
+            if window_index != index:
+                previous = current if window_index == index - 1 else 0
+                current = 0
+            result = check_window(previous, current, elapsed, cost, limit, time_window)
+            if result.allowed:
+                current += cost
+            slot_struct.pack_into(self._map, offset, key_hash, index, previous, current)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return result
+
+    def _find_slot(self, key_hash: int, index: int):
+        """Return (offset, previous, current, window index) of the slot to use for key_hash."""
+        slot_struct = self.SLOT
+        start = key_hash % self.slots
+        free = None
+        oldest = None
+        for probe in range(min(self.MAX_PROBES, self.slots)):
+            offset = (start + probe) % self.slots * slot_struct.size
+            stored_hash, window_index, previous, current = slot_struct.unpack_from(self._map, offset)
+            if stored_hash == key_hash:
+                return offset, previous, current, window_index
+            if free is None and (stored_hash == 0 or window_index < index - 1):
+                free = offset
+            if oldest is None or window_index < oldest[1]:
+                oldest = (offset, window_index)
+        if free is None:
+            self.evictions += 1
+            free = oldest[0]
+        return free, 0, 0, index
+
+    def __len__(self) -> int:
+        slot_struct = self.SLOT
+        return sum(
+            1 for offset in range(0, self.slots * slot_struct.size, slot_struct.size)
+            if slot_struct.unpack_from(self._map, offset)[0]
+        )
+
+class RedisBackend:
+    """
+    Sliding-window counters in Redis (or any server speaking its protocol), for multiple hosts.
+
+    Each key uses one counter per window, `<prefix><key>:<window index>`,
+    expiring after two windows. A Lua script reads both windows and
+    increments the current one only if the request is allowed, so the
+    check-and-increment is atomic across nodes. The script is called by
+    its SHA1 with EVALSHA, and sent in full with EVAL only when the
+    server doesn't have it cached (after a restart or SCRIPT FLUSH).
+    `client` is anything with redis.asyncio's `evalsha()` and `eval()`;
+    by default one is created from `url`. Redis errors fail open, so an
+    outage doesn't take the API down.
+    """
+
+    SCRIPT = """
+local previous = tonumber(redis.call('GET', KEYS[1]) or '0')
+local current = tonumber(redis.call('GET', KEYS[2]) or '0')
+local cost = tonumber(ARGV[1])
+local allowed = 0
+if previous * tonumber(ARGV[3]) + current + cost <= tonumber(ARGV[2]) then
+    redis.call('INCRBY', KEYS[2], cost)
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[4]))
+    allowed = 1
+end
+return {allowed, previous, current}
+"""
+
+    def __init__(self, url: str = None, client=None, prefix: str = "datemeal:ratelimit:"):
+        if client is None:
+            if redis_asyncio is None:
+                raise RuntimeError("RedisBackend needs the redis package (pip install redis)")
+            client = redis_asyncio.from_url(url or os.environ.get("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+        self.prefix = prefix
+        self.script_sha = hashlib.sha1(self.SCRIPT.encode()).hexdigest()
+        self.errors = 0
+
+    async def hit(self, key: str, cost: int, limit: int, time_window: float, now: float = None) -> RateLimitResult:
+        now = time.time() if now is None else now
+        index = int(now // time_window)
+        elapsed = now - index * time_window
+        weight = 1.0 - elapsed / time_window
+        args = (
+            2, f"{self.prefix}{key}:{index - 1}", f"{self.prefix}{key}:{index}",
+            cost, limit, weight, int(time_window * 2) + 1,
+        )
+        try:
+            try:
+                allowed, previous, current = await self.client.evalsha(self.script_sha, *args)
+            except Exception as e:
+                if not _is_no_script(e):
+                    raise
+                # EVAL runs the script and caches it for the next EVALSHA
+                allowed, previous, current = await self.client.eval(self.SCRIPT, *args)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rate limit backend unavailable, allowing request: {e}")
+            return RateLimitResult(True, limit, limit, 0.0, time_window - elapsed)
+
+        result = check_window(int(previous), int(current), elapsed, cost, limit, time_window)
+        if result.allowed != bool(allowed):
+            # Float rounding at the boundary; the script's decision is authoritative
+            result = result._replace(allowed=bool(allowed))
+        return result
+
+def _is_no_script(error: Exception) -> bool:
+    """Whether a Redis error means the server doesn't have the script cached."""
+    return type(error).__name__ == "NoScriptError" or str(error).startswith("NOSCRIPT")
+
+def create_backend(name: str = None):
+    """
+    Build the backend named by RATE_LIMIT_BACKEND: "shared" (default), "redis" or "memory".
+
+    Falls back to the per-process MemoryBackend when the chosen backend
+    can't be used on this host.
+    """
+    name = (name or os.environ.get("RATE_LIMIT_BACKEND", "shared")).lower()
+    try:
+        if name == "redis":
+            return RedisBackend()
+        if name == "shared":
+            return SharedMemoryBackend()
+    except (RuntimeError, OSError) as e:
+        logger.error(f"Rate limit backend '{name}' unavailable, limiting per worker instead: {e}")
+    return MemoryBackend()
@@ -1,51 +1,74 @@
-from fastapi import Request, HTTPException
-import time
+from fastapi import Request
+from fastapi.responses import JSONResponse
+import inspect
+import math
 import logging
-from typing import Dict, List, Tuple
+from typing import Dict, List
 import os
 
+from middleware.rate_limit_backends import RateLimitResult, create_backend
+
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
-    """Simple in-memory rate limiter for API endpoints"""
-    
-    def __init__(self, 
-                 max_requests: int = None, 
-                 time_window: int = None):
+    """Sliding-window rate limiter middleware for API endpoints"""
+
+    def __init__(self,
+                 max_requests: int = None,
+                 time_window: int = None,
+                 backend=None,
+                 exclude_paths: List[str] = None,
+                 route_costs: Dict[str, int] = None):
         """
         Initialize rate limiter with configurable parameters
-        
+
         Args:
             max_requests: Maximum number of requests allowed in the time window
             time_window: Time window in seconds
+            backend: Counter storage; defaults to the one named by RATE_LIMIT_BACKEND
+            exclude_paths: Paths (and their sub-paths) that are never limited
+            route_costs: Path prefix -> units a request consumes (default 1); longest prefix wins
         """
         # Get values from environment or use defaults
         self.max_requests = max_requests or int(os.environ.get('RATE_LIMIT_MAX_REQUESTS', 60))
         self.time_window = time_window or int(os.environ.get('RATE_LIMIT_TIME_WINDOW', 60))
-        
-        # Store request history as {client_ip: [(timestamp1), (timestamp2), ...]}
-        self.request_history: Dict[str, List[float]] = {}
-        
-        logger.info(f"Rate limiter initialized: {self.max_requests} requests per {self.time_window} seconds")
-    
+        self.backend = backend or create_backend()
+        self.exclude_paths = [path.rstrip("/") or "/" for path in exclude_paths or [] if path]
+        self.route_costs = sorted((route_costs or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+        logger.info(f"Rate limiter initialized: {self.max_requests} requests per {self.time_window} seconds "
+                    f"({type(self.backend).__name__})")
+
     async def __call__(self, request: Request, call_next):
         """
         Rate limiting middleware
-        
+
         Args:
             request: FastAPI request object
             call_next: Next middleware in the chain
         """
+        path = request.url.path
+        cost = self._route_cost(path)
+        if cost <= 0 or self._is_excluded(path):
+            return await call_next(request)
+
         client_ip = self._get_client_ip(request)
-        
+        result = self.backend.hit(client_ip, cost, self.max_requests, self.time_window)
+        if inspect.isawaitable(result):
+            result = await result
+
         # Check if client exceeds rate limit
-        if not self._allow_request(client_ip):
+        if not result.allowed:
             logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            raise HTTPException(status_code=429, detail="Too many requests")
-        
+            headers = self._headers(result)
+            headers["Retry-After"] = str(max(math.ceil(result.retry_after), 1))
+            return JSONResponse(status_code=429, content={"detail": "Too many requests"}, headers=headers)
+
         # If allowed, process the request
-        return await call_next(request)
-    
+        response = await call_next(request)
+        response.headers.update(self._headers(result))
+        return response
+
     def _get_client_ip(self, request: Request) -> str:
         """Extract client IP from request headers or connection info"""
         # Try to get IP from X-Forwarded-For header (when behind proxy/load balancer)
@@ -53,39 +76,26 @@ class RateLimiter:
         if forwarded_for:
             # The first IP in the list is the client IP
             return forwarded_for.split(",")[0].strip()
-        
+
         # Fall back to client.host if no forwarding header
         return request.client.host if request.client else "unknown"
-    
-    def _allow_request(self, client_ip: str) -> bool:
-        """
-        Check if a request from the client_ip is allowed based on rate limits
-        
-        Args:
-            client_ip: The client's IP address
-            
-        Returns:
-            True if request is allowed, False otherwise
-        """
-        current_time = time.time()
-        
-        # Initialize history for new clients
-        if client_ip not in self.request_history:
-            self.request_history[client_ip] = []
-        
-        # Clean up old requests outside the time window
-        self.request_history[client_ip] = [
-            timestamp for timestamp in self.request_history[client_ip]
-            if current_time - timestamp < self.time_window
-        ]
-        
-        # Check if client has reached the limit
-        if len(self.request_history[client_ip]) >= self.max_requests:
-            return False
-        
-        # Add this request to history
-        self.request_history[client_ip].append(current_time)
-        return True
+
+    def _is_excluded(self, path: str) -> bool:
+        return any(path == excluded or path.startswith(excluded + "/") for excluded in self.exclude_paths)
+
+    def _route_cost(self, path: str) -> int:
+        for prefix, cost in self.route_costs:
+            if path.startswith(prefix):
+                return cost
+        return 1
+
+    @staticmethod
+    def _headers(result: RateLimitResult) -> dict:
+        return {
+            "X-RateLimit-Limit": str(result.limit),
+            "X-RateLimit-Remaining": str(result.remaining),
+            "X-RateLimit-Reset": str(math.ceil(result.reset_after)),
+        }
 
 def get_rate_limiter(app):
     """
@@ -96,8 +106,16 @@ def get_rate_limiter(app):
     time_window = int(os.environ.get("RATE_LIMIT_TIME_WINDOW", "60"))
     exclude_paths_str = os.environ.get("RATE_LIMIT_EXCLUDE_PATHS", "/health,/docs,/openapi.json")
     exclude_paths = [path.strip() for path in exclude_paths_str.split(",")]
-    
+    route_costs_str = os.environ.get("RATE_LIMIT_ROUTE_COSTS", "/advise/batch=10,/advise=5")
+    route_costs = {}
+    for item in route_costs_str.split(","):
+        if "=" in item:
+            path, cost = item.split("=", 1)
+            route_costs[path.strip()] = int(cost)
+
     return RateLimiter(
         max_requests=max_requests,
-        time_window=time_window
+        time_window=time_window,
+        exclude_paths=exclude_paths,
+        route_costs=route_costs
     )
@@ -31,11 +31,20 @@ class AdviseRequest(BaseModel):
 class AdviseResponse(BaseModel):
     response: str
     restaurant: Restaurant
+    sessionId: Optional[str] = None
+
+class AdviseBatchResponse(BaseModel):
+    response: str
+    restaurants: List[Restaurant]
+    sessionId: Optional[str] = None
 
 class RefineRequest(BaseModel):
-    previousRecommendations: List[Restaurant]
+    # With a live sessionId the server already has the recommendations; send them only without one
+    sessionId: Optional[str] = None
+    previousRecommendations: List[Restaurant] = []
     userMessage: str
 
 class RefineResponse(BaseModel):
     recommendations: List[Restaurant]
     reasoning: str
+    sessionId: Optional[str] = None
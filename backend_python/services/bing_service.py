@@ -1,7 +1,10 @@
+import asyncio
 import os
 import random
-import httpx
 import logging
+from typing import Optional
+from services.enrichment_cache import MISS, enrichment_cache
+from utils.http_client import outbound_http
 
 logger = logging.getLogger(__name__)
 
@@ -29,46 +32,18 @@ restaurant_image_ids = [
 async def search_bing_for_restaurant(restaurant_name: str, location: str = "NYC") -> dict:
     """Search Bing (or fallback) for restaurant info."""
     try:
-        query = f"{restaurant_name} restaurant {location}"
-        logger.info(f"Searching Bing for: {query}")
-
         if not BING_API_KEY:
             logger.warning("No Bing API key configured. Returning fallback image.")
             return get_fallback_image(restaurant_name)
 
-        # Set up headers
-        if IS_RAPIDAPI:
-            headers = {
-                "X-RapidAPI-Key": BING_API_KEY,
-                "X-RapidAPI-Host": RAPIDAPI_HOST,
-            }
-            search_url = RAPIDAPI_SEARCH_URL
-        else:
-            headers = {
-                "Ocp-Apim-Subscription-Key": BING_API_KEY,
-                "Accept": "application/json",
-            }
-            search_url = BING_SEARCH_URL
-
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            response = await client.get(
-                search_url,
-                headers=headers,
-                params={"q": query, "count": 1, "mkt": "en-US"}
-            )
-
-        if response.status_code != 200:
-            logger.error(f"Bing search error {response.status_code}: {response.text}")
-            return get_fallback_image(restaurant_name)
-
-        result = response.json()
-
-        # Standard format
-        webpage_url = None
-        if result.get("webPages", {}).get("value"):
-            webpage_url = result["webPages"]["value"][0]["url"]
-        elif result.get("value"):
-            webpage_url = result["value"][0]["url"]
+        # The cache is a SQLite file shared with other workers; keep its waits off the event loop
+        loop = asyncio.get_running_loop()
+        webpage_url = await loop.run_in_executor(None, enrichment_cache.get, restaurant_name, location)
+        if webpage_url is MISS:
+            webpage_url = await _search_bing_webpage(restaurant_name, location)
+            await loop.run_in_executor(None, enrichment_cache.set, restaurant_name, location, webpage_url)
+        elif webpage_url is not None:
+            webpage_url = webpage_url["url"]
 
         # Always return at least an image URL
         final_result = get_fallback_image(restaurant_name)
@@ -81,6 +56,50 @@ async def search_bing_for_restaurant(restaurant_name: str, location: str = "NYC"
         logger.exception(f"Error in Bing search: {e}")
         return get_fallback_image(restaurant_name)
 
+async def _search_bing_webpage(restaurant_name: str, location: str) -> Optional[dict]:
+    """
+    Query Bing for the restaurant's webpage.
+
+    Returns {"url": ...}, or None when Bing has no result. Raises on request
+    errors so they are not cached as negative results.
+    """
+    query = f"{restaurant_name} restaurant {location}"
+    logger.info(f"Searching Bing for: {query}")
+
+    # Set up headers
+    if IS_RAPIDAPI:
+        headers = {
+            "X-RapidAPI-Key": BING_API_KEY,
+            "X-RapidAPI-Host": RAPIDAPI_HOST,
+        }
+        search_url = RAPIDAPI_SEARCH_URL
+    else:
+        headers = {
+            "Ocp-Apim-Subscription-Key": BING_API_KEY,
+            "Accept": "application/json",
+        }
+        search_url = BING_SEARCH_URL
+
+    response = await outbound_http.request(
+        "bing",
+        "GET",
+        search_url,
+        headers=headers,
+        params={"q": query, "count": 1, "mkt": "en-US"}
+    )
+
+    if response.status_code != 200:
+        raise RuntimeError(f"Bing search error {response.status_code}: {response.text}")
+
+    result = response.json()
+
+    # Standard format
+    if result.get("webPages", {}).get("value"):
+        return {"url": result["webPages"]["value"][0]["url"]}
+    if result.get("value"):
+        return {"url": result["value"][0]["url"]}
+    return None
+
 def get_fallback_image(name: str) -> dict:
     """Generate a consistent fallback Unsplash image for a restaurant."""
     name_sum = sum(ord(c) for c in name)
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from services.enrichment_cache import enrichment_cache
+from services.recommendation_cache import recommendation_cache
+from services.session_store import session_store
+
+logger = logging.getLogger(__name__)
+
+class CachePurger:
+    """
+    Deletes expired rows from the SQLite-backed caches and session store in the background.
+
+    Reads already ignore expired rows, but nothing else removes them, so
+    without a purge the shared files only grow. start() runs every
+    registered purge every `interval` seconds on the default thread pool,
+    since each one is a blocking DELETE over its table.
+    """
+
+    def __init__(self, purges: List[Tuple[str, Callable[[], int]]], interval: float = None):
+        self.interval = interval if interval is not None else float(os.environ.get("CACHE_PURGE_INTERVAL", 600))
+        self._purges = purges
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.failures = 0
+        self.purged: Dict[str, int] = {name: 0 for name, _ in purges}
+
+    def start(self) -> None:
+        """Run purge() every `interval` seconds on the running event loop."""
+        if self.interval <= 0:
+            logger.info("Cache purge disabled (CACHE_PURGE_INTERVAL=0)")
+            return
+        self._task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def purge(self) -> int:
+        """Run every purge once and return the number of rows deleted; a failing purge doesn't stop the others."""
+        deleted = 0
+        for name, purge in self._purges:
+            try:
+                count = purge()
+            except Exception:
+                self.failures += 1
+                logger.exception(f"Purging expired {name} rows failed")
+                continue
+            self.purged[name] += count
+            deleted += count
+        self.runs += 1
+        return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "purged": dict(self.purged),
+        }
+
+    async def _purge_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            deleted = await loop.run_in_executor(None, self.purge)
+            if deleted:
+                logger.info(f"Purged {deleted} expired cache rows")
+
+# Create a singleton instance
+cache_purger = CachePurger([
+    ("recommendation_cache", recommendation_cache.purge_expired),
+    ("bing_cache", enrichment_cache.purge_expired),
+    ("sessions", session_store.purge_expired),
+])
@@ -0,0 +1,210 @@
+"""
+Binary snapshot format for the restaurant catalog.
+
+A snapshot is a built catalog laid out so workers can mmap it instead of
+parsing JSON and building Python objects: the pages are shared by every
+process mapping the same file, and opening one costs a header parse no
+matter how many restaurants it holds.
+
+Layout (little-endian, sections 8-byte aligned):
+
+    MAGIC | uint32 header length | JSON header | sections...
+
+The header gives the row count, the cuisine names, and (offset, length)
+of every section: one per numeric column (an array of codes), two per
+string column (uint32 start/end offsets into a UTF-8 blob; identical
+strings share their bytes), one bitmap per indexed term, and the sparse
+text vectors (int64 row offsets, bucket indices and float32 weights)
+with their idf weights.
+
+Build one offline and point RESTAURANT_CATALOG_PATH at it:
+
+    python -m services.catalog_snapshot restaurants.jsonl catalog.snap
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from services.vector_index import HashedTfidf, SparseVectors
+
+MAGIC = b"DMCATv3\0"
+_MAGIC_PREFIX = b"DMCAT"
+_HEADER_LENGTH = struct.Struct("<I")
+_ALIGN = 8
+
+class StringColumn(Sequence[str]):
+    """Row-indexed strings decoded on demand from a mapped UTF-8 blob."""
+
+    __slots__ = ("_starts", "_ends", "_blob")
+
+    def __init__(self, starts: memoryview, ends: memoryview, blob: memoryview):
+        self._starts = starts
+        self._ends = ends
+        self._blob = blob
+
+    def __getitem__(self, row: int) -> str:
+        return str(self._blob[self._starts[row]:self._ends[row]], "utf-8")
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+def is_snapshot(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)).startswith(_MAGIC_PREFIX)
+    except OSError:
+        return False
+
+def write_snapshot(data: Any, path: str) -> int:
+    """
+    Write a built catalog (CatalogData) to path atomically.
+
+    The file is written next to the destination and renamed over it, so
+    workers watching the path only ever see a complete snapshot.
+
+    Args:
+        data: The CatalogData to serialize
+        path: Destination file
+
+    Returns:
+        int: Size of the snapshot in bytes
+    """
+    sections: List[bytes] = []
+    offset = 0
+
+    def add(payload: bytes) -> Tuple[int, int]:
+        nonlocal offset
+        start = offset
+        padding = -len(payload) % _ALIGN
+        sections.append(payload + b"\0" * padding)
+        offset += len(payload) + padding
+        return start, len(payload)
+
+    columns: Dict[str, Any] = {}
+    for name, typecode in data.ARRAY_COLUMNS.items():
+        columns[name] = [typecode, *add(array(typecode, getattr(data, name)).tobytes())]
+    for name in data.STRING_COLUMNS:
+        blob = bytearray()
+        placed: Dict[str, Tuple[int, int]] = {}
+        starts, ends = array("I"), array("I")
+        for value in getattr(data, name):
+            if value not in placed:
+                encoded = value.encode("utf-8")
+                placed[value] = (len(blob), len(blob) + len(encoded))
+                blob += encoded
+            start, end = placed[value]
+            starts.append(start)
+            ends.append(end)
+        columns[name] = ["s", *add(starts.tobytes()), *add(ends.tobytes()), *add(bytes(blob))]
+
+    bitmap_length = (data.size + 7) // 8
+    index = {
+        field: {term: add(bitmap.to_bytes(bitmap_length, "little"))[0] for term, bitmap in terms.items()}
+        for field, terms in data.index.items()
+    }
+    vectors = data.vectors
+    header = json.dumps({
+        "size": data.size,
+        "cuisines": data.cuisines,
+        "columns": columns,
+        "bitmap_length": bitmap_length,
+        "index": index,
+        "dim": vectors.dim,
+        "vector_indptr": add(np.asarray(vectors.indptr, dtype=np.int64).tobytes()),
+        "vector_indices": [vectors.indices.dtype.str, *add(vectors.indices.tobytes())],
+        "vector_values": add(np.asarray(vectors.values, dtype=np.float32).tobytes()),
+        "idf": add(np.asarray(data.embedder.idf, dtype=np.float32).tobytes()),
+    }).encode("utf-8")
+    prefix = MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+    prefix += b"\0" * (-len(prefix) % _ALIGN)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(prefix)
+            for section in sections:
+                f.write(section)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(prefix) + offset
+
+def read_snapshot(path: str, data: Any) -> Any:
+    """
+    Map a snapshot file into an empty CatalogData.
+
+    Columns and vectors stay in the mapping and are read in place; only
+    the posting bitmaps are copied out, as Python ints, since queries AND
+    them.
+
+    Args:
+        path: Snapshot file written by write_snapshot
+        data: A fresh CatalogData to fill
+
+    Returns:
+        The filled CatalogData
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a restaurant catalog snapshot in format {MAGIC[:-1].decode()}; rebuild it")
+    header_length, = _HEADER_LENGTH.unpack_from(view, len(MAGIC))
+    header_start = len(MAGIC) + _HEADER_LENGTH.size
+    header = json.loads(bytes(view[header_start:header_start + header_length]))
+    base = header_start + header_length
+    base += -base % _ALIGN
+
+    def section(start: int, length: int) -> memoryview:
+        return view[base + start:base + start + length]
+
+    data.size = header["size"]
+    data.cuisines = header["cuisines"]
+    for name, (typecode, *place) in header["columns"].items():
+        if typecode == "s":
+            starts, ends, blob = (section(*place[i:i + 2]) for i in (0, 2, 4))
+            setattr(data, name, StringColumn(starts.cast("I"), ends.cast("I"), blob))
+        else:
+            setattr(data, name, section(*place).cast(typecode))
+    length = header["bitmap_length"]
+    data.index = {
+        field: {term: int.from_bytes(section(start, length), "little") for term, start in terms.items()}
+        for field, terms in header["index"].items()
+    }
+    data.all = (1 << data.size) - 1
+    data.embedder = HashedTfidf(header["dim"], idf=np.frombuffer(section(*header["idf"]), dtype=np.float32))
+    indices_dtype, *indices = header["vector_indices"]
+    data.vectors = SparseVectors(
+        np.frombuffer(section(*header["vector_indptr"]), dtype=np.int64),
+        np.frombuffer(section(*indices), dtype=np.dtype(indices_dtype)),
+        np.frombuffer(section(*header["vector_values"]), dtype=np.float32),
+        header["dim"],
+    )
+    return data
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build a restaurant catalog snapshot from JSON, JSONL or CSV.")
+    parser.add_argument("source", help="restaurant records (.json list, .jsonl or .csv)")
+    parser.add_argument("output", help="snapshot file to write; replaced atomically")
+    args = parser.parse_args(argv)
+
+    from services.restaurant_catalog import build_catalog, read_records
+    data = build_catalog(read_records(args.source))
+    written = write_snapshot(data, args.output)
+    print(f"Wrote {data.size} restaurants to {args.output} ({written / 2**20:.1f} MB)")
+
+if __name__ == "__main__":
+    sys.exit(main())
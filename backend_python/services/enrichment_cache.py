@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_NON_WORD = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+
+# Returned by EnrichmentCache.get() when nothing (not even a negative result) is cached
+MISS = object()
+
+def normalize_lookup(name: str, location: str) -> str:
+    """Cache key for a restaurant lookup: lowercase, no punctuation, single spaces."""
+    def clean(value: str) -> str:
+        return _SPACES.sub(" ", _NON_WORD.sub("", (value or "").lower())).strip()
+    return f"{clean(name)}|{clean(location)}"
+
+class EnrichmentCache:
+    """
+    Persistent cache of Bing enrichment results keyed on restaurant name and location.
+
+    Stored in a SQLite file so results survive restarts and are shared by all
+    workers on the host. Lookups that found nothing are cached as negative
+    results with a shorter TTL, so unknown restaurants don't burn quota either.
+    Expired rows are deleted by the cache purger (services.cache_purger),
+    which shares the connection, hence the lock.
+    """
+
+    def __init__(self, path: str = None, ttl: float = None, negative_ttl: float = None):
+        self.path = path or os.environ.get(
+            "BING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "datemeal_bing_cache.sqlite3")
+        )
+        self.ttl = ttl if ttl is not None else float(os.environ.get("BING_CACHE_TTL", 7 * 24 * 3600))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else float(os.environ.get("BING_CACHE_NEGATIVE_TTL", 24 * 3600))
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            self._conn = self._connect(self.path)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open Bing cache at {self.path}, using memory only: {e}")
+            self._conn = self._connect(":memory:")
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bing_enrichment ("
+            "key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+        )
+        return conn
+
+    def get(self, name: str, location: str) -> Any:
+        """Return the cached result dict, None for a cached negative result, or MISS."""
+        if self.ttl <= 0:
+            self.misses += 1
+            return MISS
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM bing_enrichment WHERE key = ?",
+                (normalize_lookup(name, location),)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return MISS
+        if row[0] is None:
+            self.negative_hits += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, name: str, location: str, value: Optional[Dict[str, Any]]) -> None:
+        """Cache a lookup result; pass None to record that nothing was found."""
+        if self.ttl <= 0:
+            return
+        ttl = self.ttl if value is not None else self.negative_ttl
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO bing_enrichment (key, value, expires_at) VALUES (?, ?, ?)",
+                    (normalize_lookup(name, location), json.dumps(value) if value is not None else None, time.time() + ttl)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Bing cache write failed: {e}")
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM bing_enrichment WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+# Create a singleton instance
+enrichment_cache = EnrichmentCache()
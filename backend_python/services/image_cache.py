@@ -0,0 +1,404 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from utils.azure_storage import azure_storage
+
+logger = logging.getLogger(__name__)
+
+# Where the disk tier used to be: under the public /static mount
+LEGACY_DISK_DIR = "static/.cache/images"
+INDEX_FILE = ".index.sqlite3"
+# Fills older than this were left by a worker that died mid-download
+STALE_FILL_SECONDS = 3600
+
+class BlobEntry(NamedTuple):
+    """What the cache knows about an image blob, from its properties."""
+    size: int
+    etag: str  # the blob's ETag, which changes whenever its content does
+    last_modified: float  # Unix time
+    content_type: Optional[str]
+    sha256: Optional[str]  # set by /images/upload
+
+    @classmethod
+    def from_properties(cls, properties) -> "BlobEntry":
+        return cls(
+            size=properties.size,
+            etag=properties.etag,
+            last_modified=properties.last_modified.timestamp(),
+            content_type=properties.content_settings.content_type,
+            sha256=(properties.metadata or {}).get("sha256"),
+        )
+
+class CacheFill:
+    """
+    Writes a blob into the cache tiers that take it while it is being streamed to a client.
+
+    Images up to `memory_item_bytes` are collected for the memory tier,
+    and written to a temporary file for the disk tier when it is usable
+    and they are within its per-file limit; either tier works without the
+    other. Nothing is visible in the cache until commit(); abort() throws
+    the partial copy away. write(), commit() and abort() may block on disk
+    and are meant to run on an executor thread.
+    """
+
+    def __init__(self, cache: "ImageCache", name: str, entry: BlobEntry, to_memory: bool, to_disk: bool):
+        self.cache = cache
+        self.name = name
+        self.entry = entry
+        self.written = 0
+        self._chunks: Optional[List[bytes]] = [] if to_memory else None
+        self._file = None
+        self._temp_path = None
+        if to_disk:
+            try:
+                fd, self._temp_path = tempfile.mkstemp(dir=cache.disk_dir, prefix=f".fill-{os.getpid()}-")
+                self._file = os.fdopen(fd, "wb")
+            except OSError as e:
+                if not to_memory:
+                    raise
+                logger.warning(f"Image cache can't write to {cache.disk_dir}, caching {name} in memory only: {e}")
+
+    def write(self, chunk: bytes) -> None:
+        if self._file is not None:
+            self._file.write(chunk)
+        self.written += len(chunk)
+        if self._chunks is not None:
+            self._chunks.append(chunk)
+
+    def commit(self) -> None:
+        if self.written != self.entry.size:
+            self.abort()
+            return
+        if self._file is not None:
+            self._file.close()
+            self.cache._add_to_disk(self.name, self.entry, self._temp_path)
+        if self._chunks is not None:
+            self.cache._add_to_memory(self.name, self.entry, b"".join(self._chunks))
+
+    def abort(self) -> None:
+        self._chunks = None
+        if self._file is None:
+            return
+        self._file.close()
+        try:
+            os.unlink(self._temp_path)
+        except FileNotFoundError:
+            pass
+
+class ImageCache:
+    """
+    Tiered cache of Blob Storage images: memory, then local disk, then the blob.
+
+    An index keeps each image's blob properties, so existence checks and
+    conditional requests don't reach Azure while an entry is fresh
+    (`validate_seconds`); after that the properties are fetched again,
+    which is a HEAD request, never a download. Content is cached under its
+    blob ETag, so a changed blob is never served from a stale copy:
+
+    - memory: an LRU of small images (thumbnails) up to `memory_bytes`,
+      per worker
+    - disk: an LRU of files in `disk_dir` up to `disk_bytes`, shared by all
+      workers on the host and kept across restarts. A SQLite index in the
+      directory holds the files' sizes and last use, so the budget holds
+      for all workers together and evictions are seen by all of them.
+      Last use is recorded at most every `touch_seconds` per file.
+
+    `disk_dir` is outside the public /static mount; remove_legacy_dir(),
+    run at startup, deletes where it used to be. Uploads through this
+    worker invalidate the image's entries at once; other workers see the
+    new blob when their entry is revalidated. Methods are thread-safe and
+    the ones that touch disk or Azure block, so they are called from an
+    executor.
+    """
+
+    def __init__(self,
+                 storage=azure_storage,
+                 disk_dir: str = None,
+                 memory_bytes: int = None,
+                 memory_item_bytes: int = None,
+                 disk_bytes: int = None,
+                 validate_seconds: float = None,
+                 touch_seconds: float = 60.0,
+                 max_index_entries: int = 10000):
+        self.storage = storage
+        self.disk_dir = disk_dir or os.environ.get(
+            "IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "datemeal_image_cache")
+        )
+        self.memory_bytes = memory_bytes if memory_bytes is not None else int(
+            os.environ.get("IMAGE_CACHE_MEMORY_BYTES", 64 * 2**20))
+        self.memory_item_bytes = memory_item_bytes if memory_item_bytes is not None else int(
+            os.environ.get("IMAGE_CACHE_MEMORY_ITEM_BYTES", 512 * 1024))
+        self.disk_bytes = disk_bytes if disk_bytes is not None else int(
+            os.environ.get("IMAGE_CACHE_DISK_BYTES", 1024 * 2**20))
+        self.validate_seconds = validate_seconds if validate_seconds is not None else float(
+            os.environ.get("IMAGE_CACHE_VALIDATE_SECONDS", 60))
+        self.touch_seconds = touch_seconds
+        self.max_index_entries = max_index_entries
+        self._lock = threading.Lock()
+        # name -> (entry, monotonic time its properties were fetched)
+        self._index: "OrderedDict[str, Tuple[BlobEntry, float]]" = OrderedDict()
+        # name -> (etag, content)
+        self._memory: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._memory_used = 0
+        self._disk_db: Optional[sqlite3.Connection] = None
+        self.index_hits = 0
+        self.validations = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+        self.invalidations = 0
+        self._load_disk()
+
+    def lookup(self, name: str) -> Optional[BlobEntry]:
+        """The image's blob properties, from the index while fresh, or None if there is no such blob."""
+        entry = self.fresh_entry(name)
+        if entry is not None:
+            return entry
+        properties = self.storage.get_image_properties(name)
+        with self._lock:
+            self.validations += 1
+            if properties is None:
+                self._forget(name)
+                return None
+            entry = BlobEntry.from_properties(properties)
+            previous = self._index.get(name)
+            if previous is not None and previous[0].etag != entry.etag:
+                self._forget(name)
+            self._index[name] = (entry, time.monotonic())
+            self._index.move_to_end(name)
+            while len(self._index) > self.max_index_entries:
+                self._index.popitem(last=False)
+        return entry
+
+    def fresh_entry(self, name: str) -> Optional[BlobEntry]:
+        """The indexed entry if it was validated within `validate_seconds`; never blocks."""
+        with self._lock:
+            cached = self._index.get(name)
+            if cached is None or time.monotonic() - cached[1] > self.validate_seconds:
+                return None
+            self._index.move_to_end(name)
+            self.index_hits += 1
+            return cached[0]
+
+    def memory_get(self, name: str, entry: BlobEntry) -> Optional[bytes]:
+        with self._lock:
+            cached = self._memory.get(name)
+            if cached is None or cached[0] != entry.etag:
+                return None
+            self._memory.move_to_end(name)
+            self.memory_hits += 1
+            return cached[1]
+
+    def open_disk(self, name: str, entry: BlobEntry) -> Optional[int]:
+        """
+        A read-only file descriptor on the cached copy of the blob, or None.
+
+        The caller closes it; an open descriptor stays readable if the file
+        is evicted meanwhile.
+        """
+        if self._disk_db is None:
+            return None
+        key = self._disk_key(name, entry)
+        with self._lock:
+            try:
+                row = self._disk_query("SELECT used_at FROM files WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                try:
+                    fd = os.open(os.path.join(self.disk_dir, key), os.O_RDONLY)
+                except FileNotFoundError:
+                    # Evicted by another worker between its commit and unlink
+                    self._disk_query("DELETE FROM files WHERE key = ?", (key,))
+                    self.misses += 1
+                    return None
+                now = time.time()
+                if now - row[0] > self.touch_seconds:
+                    self._disk_query("UPDATE files SET used_at = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning(f"Image cache index error: {e}")
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        return fd
+
+    def fill(self, name: str, entry: BlobEntry) -> Optional[CacheFill]:
+        """A CacheFill to cache the blob as it is downloaded, or None if no tier takes it."""
+        to_memory = 0 < entry.size <= min(self.memory_item_bytes, self.memory_bytes)
+        to_disk = self._disk_db is not None and 0 < entry.size <= self.disk_bytes // 10
+        if not to_memory and not to_disk:
+            return None
+        try:
+            return CacheFill(self, name, entry, to_memory, to_disk)
+        except OSError as e:
+            logger.warning(f"Image cache can't write to {self.disk_dir}: {e}")
+            return None
+
+    def remove_legacy_dir(self) -> None:
+        """Delete the disk tier's old directory under the public /static mount, if it is still there."""
+        if os.path.abspath(self.disk_dir) == os.path.abspath(LEGACY_DISK_DIR) or not os.path.isdir(LEGACY_DISK_DIR):
+            return
+        # It's only a cache, so it isn't moved
+        shutil.rmtree(LEGACY_DISK_DIR, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(LEGACY_DISK_DIR))
+        except OSError:
+            pass
+        logger.info(f"Removed the old image cache directory {LEGACY_DISK_DIR}")
+
+    def invalidate(self, name: str) -> None:
+        """Drop everything cached for `name`, e.g. after it was uploaded again."""
+        with self._lock:
+            self.invalidations += 1
+            self._forget(name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            disk_entries, disk_used = self._disk_query(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files"
+            ).fetchone() if self._disk_db is not None else (0, 0)
+            return {
+                "index_entries": len(self._index),
+                "index_hits": self.index_hits,
+                "validations": self.validations,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_used,
+                "memory_evictions": self.memory_evictions,
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_used,
+                "disk_evictions": self.disk_evictions,
+                "invalidations": self.invalidations,
+            }
+
+    @staticmethod
+    def _disk_key(name: str, entry: BlobEntry) -> str:
+        return hashlib.sha256(f"{name}\0{entry.etag}".encode()).hexdigest()
+
+    def _forget(self, name: str) -> None:
+        """Drop the index, memory and disk entries of `name`. Called with the lock held."""
+        cached = self._index.pop(name, None)
+        memory = self._memory.pop(name, None)
+        if memory is not None:
+            self._memory_used -= len(memory[1])
+        if cached is not None and self._disk_db is not None:
+            key = self._disk_key(name, cached[0])
+            if self._disk_query("DELETE FROM files WHERE key = ?", (key,)).rowcount:
+                self._unlink(key)
+
+    def _add_to_memory(self, name: str, entry: BlobEntry, data: bytes) -> None:
+        with self._lock:
+            previous = self._memory.pop(name, None)
+            if previous is not None:
+                self._memory_used -= len(previous[1])
+            self._memory[name] = (entry.etag, data)
+            self._memory_used += len(data)
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_used -= len(evicted)
+                self.memory_evictions += 1
+
+    def _add_to_disk(self, name: str, entry: BlobEntry, temp_path: str) -> None:
+        key = self._disk_key(name, entry)
+        os.replace(temp_path, os.path.join(self.disk_dir, key))
+        with self._lock:
+            try:
+                self._disk_query("BEGIN IMMEDIATE")
+                try:
+                    self._disk_query("INSERT OR REPLACE INTO files (key, size, used_at) VALUES (?, ?, ?)",
+                                     (key, entry.size, time.time()))
+                    evicted = self._evict_disk()
+                except BaseException:
+                    self._disk_query("ROLLBACK")
+                    raise
+                self._disk_query("COMMIT")
+            except sqlite3.Error as e:
+                logger.warning(f"Image cache index error, not caching {name}: {e}")
+                evicted = [key]
+            else:
+                self.disk_evictions += len(evicted)
+        for key in evicted:
+            self._unlink(key)
+
+    def _evict_disk(self) -> List[str]:
+        """Drop the least recently used files from the index until the budget holds; returns them."""
+        used = self._disk_query("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        evicted = []
+        if used <= self.disk_bytes:
+            return evicted
+        for key, size in self._disk_query("SELECT key, size FROM files ORDER BY used_at").fetchall():
+            evicted.append(key)
+            used -= size
+            if used <= self.disk_bytes:
+                break
+        self._disk_db.executemany("DELETE FROM files WHERE key = ?", [(key,) for key in evicted])
+        return evicted
+
+    def _disk_query(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self._disk_db.execute(sql, params)
+
+    def _unlink(self, key: str) -> None:
+        try:
+            os.unlink(os.path.join(self.disk_dir, key))
+        except FileNotFoundError:
+            pass
+
+    def _load_disk(self) -> None:
+        """Open the shared disk index, indexing files it doesn't know and dropping stale fills."""
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.disk_dir, INDEX_FILE), timeout=5.0,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                         "used_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS files_used_at ON files (used_at)")
+            files = []
+            stale_before = time.time() - STALE_FILL_SECONDS
+            for dir_entry in os.scandir(self.disk_dir):
+                if not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                if dir_entry.name.startswith(".fill-"):
+                    # Other workers may be filling right now; only old fills are abandoned
+                    if stat.st_mtime < stale_before:
+                        self._unlink(dir_entry.name)
+                elif not dir_entry.name.startswith("."):
+                    files.append((dir_entry.name, stat.st_size, stat.st_mtime))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Image cache directory {self.disk_dir} is not usable, caching in memory only: {e}")
+            return
+
+        self._disk_db = conn
+        with self._lock:
+            try:
+                self._disk_query("BEGIN IMMEDIATE")
+                self._disk_db.executemany("INSERT OR IGNORE INTO files (key, size, used_at) VALUES (?, ?, ?)",
+                                          files)
+                evicted = self._evict_disk()
+                self._disk_query("COMMIT")
+            except sqlite3.Error as e:
+                # Another worker is starting up too and will do the same
+                logger.warning(f"Image cache index not refreshed: {e}")
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                evicted = []
+        for key in evicted:
+            self._unlink(key)
+        if files:
+            logger.info(f"Image cache: {len(files) - len(evicted)} files in {self.disk_dir}")
+
+# Create a singleton instance
+image_cache = ImageCache()
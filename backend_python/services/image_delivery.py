@@ -0,0 +1,393 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, Mapping, NamedTuple, Optional, Tuple
+
+from fastapi.responses import Response, StreamingResponse
+
+from services.image_cache import BlobEntry, image_cache
+from services.image_store import CONTENT_PREFIX, LOCAL_IMAGE_DIR, image_store, valid_name
+from utils.azure_storage import azure_storage
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from a local file per chunk sent
+FILE_CHUNK_BYTES = 256 * 1024
+
+CONTENT_TYPES = {".png": "image/png", ".gif": "image/gif", ".webp": "image/webp", ".avif": "image/avif"}
+
+# Async iterator over bytes start..end (inclusive) of an image
+BodyFactory = Callable[[int, int], AsyncIterator[bytes]]
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class RangeNotSatisfiable(Exception):
+    """The Range header asks for bytes past the end of the image."""
+
+class ImageMeta(NamedTuple):
+    size: int
+    etag: str  # strong, quoted
+    last_modified: float  # Unix time
+    content_type: str
+
+def content_type_for(name: str) -> str:
+    return CONTENT_TYPES.get(os.path.splitext(name)[1].lower(), "image/jpeg")
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) of a single-range `bytes=` Range header.
+
+    Args:
+        header: Range header value, e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-512"
+        size: Size of the image in bytes
+
+    Returns:
+        The byte range, clamped to the image, or None when the header
+        should be ignored and the whole image sent (malformed, another
+        unit, or several ranges)
+
+    Raises:
+        RangeNotSatisfiable: The range starts past the end of the image
+    """
+    match = _RANGE.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, end
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag, as RFC 9110 specifies for it."""
+    if header.strip() == "*":
+        return True
+    return any(_opaque_tag(tag) == etag for tag in header.split(","))
+
+def _http_date_seconds(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class ImageDelivery:
+    """
+    Streams image content from Blob Storage or static/images with HTTP caching.
+
+    Names are looked up in the image_store index first, so uploads are
+    read from their content-addressed blob or file; names it doesn't know
+    are read from the blob or file of that name, as stored before it.
+    Blob properties and content come through the tiered image cache
+    (services.image_cache): a blob is only downloaded when neither memory
+    nor the disk cache holds its current version, and a full download is
+    written to the cache as it is streamed.
+
+    Responses carry a strong ETag (the sha256 the upload stored on the
+    blob, the blob's own ETag for other blobs, the indexed sha256 of a
+    local upload, or else a hash of the local file, kept in an LRU per
+    file version), Last-Modified and Cache-Control.
+    Conditional requests that still match get a 304 without a body,
+    single byte ranges a 206 with only those bytes. Content is sent in
+    chunks as it is read, so a response never holds a whole image;
+    blocking SDK and file reads run on a small thread pool. Local files
+    are read with pread rather than sent with sendfile: neither Starlette
+    0.27 (FileResponse reads chunks on a thread too) nor uvicorn has a
+    zero-copy path.
+    """
+
+    def __init__(self,
+                 storage=azure_storage,
+                 cache=image_cache,
+                 store=image_store,
+                 local_dir: str = LOCAL_IMAGE_DIR,
+                 max_age: int = None,
+                 max_workers: int = None,
+                 hash_cache_size: int = 10000):
+        self.storage = storage
+        self.cache = cache
+        self.store = store
+        self.local_dir = local_dir
+        self.max_age = max_age if max_age is not None else int(os.environ.get("IMAGE_CACHE_MAX_AGE", 86400))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.environ.get("IMAGE_DELIVERY_WORKERS", 8)),
+            thread_name_prefix="image-delivery"
+        )
+        # (path, inode, mtime_ns, size) -> sha256 of the local file; used from executor threads
+        self._hashes: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._hashes_lock = threading.Lock()
+        self.hash_cache_size = hash_cache_size
+        self.full = 0
+        self.partial = 0
+        self.not_modified = 0
+        self.not_satisfiable = 0
+        self.bytes_sent = 0
+
+    async def respond(self, name: str, headers: Mapping[str, str]) -> Optional[Response]:
+        """The response for image `name` given the request headers, or None if there is no such image."""
+        if not self._valid_name(name):
+            return None
+        source = await self._source(*self._locate(name))
+        if source is None:
+            return None
+        return self._response(*source, headers)
+
+    async def respond_stored(self,
+                             blob_name: Optional[str],
+                             local_path: str,
+                             headers: Mapping[str, str]) -> Optional[Response]:
+        """Like respond(), for content stored as `blob_name` (unless None) or, failing that, at `local_path`."""
+        source = await self._source(blob_name, local_path)
+        if source is None:
+            return None
+        return self._response(*source, headers)
+
+    async def meta(self, name: str) -> Optional[ImageMeta]:
+        """Size, strong ETag and type of image `name` without reading it, or None if there is no such image."""
+        if not self._valid_name(name):
+            return None
+        source = await self._source(*self._locate(name))
+        return source[0] if source else None
+
+    async def read(self, name: str) -> Optional[Tuple[ImageMeta, bytes]]:
+        """The whole content of image `name` with its meta, through the image cache, or None."""
+        if not self._valid_name(name):
+            return None
+        source = await self._source(*self._locate(name))
+        if source is None:
+            return None
+        meta, body = source
+        if meta.size == 0:
+            return meta, b""
+        return meta, b"".join([chunk async for chunk in body(0, meta.size - 1)])
+
+    async def blob_entry(self, name: str) -> Optional[BlobEntry]:
+        """The image's blob properties, from the cache index when fresh, or None if it isn't a blob."""
+        if not self.storage.initialized:
+            return None
+        entry = self.cache.fresh_entry(name)
+        if entry is None:
+            entry = await asyncio.get_running_loop().run_in_executor(self._executor, self.cache.lookup, name)
+        return entry
+
+    def _locate(self, name: str) -> Tuple[Optional[str], str, Optional[str]]:
+        """The blob name (None if it is only stored locally), local path and, if indexed, sha256 of image `name`."""
+        local_path = os.path.join(self.local_dir, name)
+        image = self.store.resolve(name)
+        if image is None:
+            return name, local_path, None
+        if image.storage == "azure":
+            return CONTENT_PREFIX + image.sha256, local_path, image.sha256
+        # static/images/<name> is a hard link to the content, so its hash is known
+        return None, local_path, image.sha256
+
+    async def _source(self,
+                      blob_name: Optional[str],
+                      local_path: str,
+                      sha256: Optional[str] = None) -> Optional[Tuple[ImageMeta, BodyFactory]]:
+        entry = await self.blob_entry(blob_name) if blob_name else None
+        if entry is not None:
+            meta = ImageMeta(
+                size=entry.size,
+                etag=self._blob_etag(entry),
+                last_modified=entry.last_modified,
+                content_type=entry.content_type or content_type_for(blob_name),
+            )
+            return meta, lambda start, end: self._blob_chunks(blob_name, entry, start, end)
+
+        loop = asyncio.get_running_loop()
+        meta = await loop.run_in_executor(
+            self._executor, self._local_meta, local_path, os.path.basename(local_path), sha256
+        )
+        if meta is None:
+            return None
+        return meta, lambda start, end: self._file_chunks(local_path, start, end)
+
+    @staticmethod
+    def _valid_name(name: str) -> bool:
+        return valid_name(name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "full": self.full,
+            "partial": self.partial,
+            "not_modified": self.not_modified,
+            "range_not_satisfiable": self.not_satisfiable,
+            "bytes_sent": self.bytes_sent,
+        }
+
+    def _response(self,
+                  meta: ImageMeta,
+                  body: BodyFactory,
+                  headers: Mapping[str, str]) -> Response:
+        response_headers = {
+            "ETag": meta.etag,
+            "Last-Modified": formatdate(meta.last_modified, usegmt=True),
+            "Cache-Control": f"public, max-age={self.max_age}",
+            "Accept-Ranges": "bytes",
+        }
+        if self._not_modified(meta, headers):
+            self.not_modified += 1
+            return Response(status_code=304, headers=response_headers)
+
+        status, start, end = 200, 0, meta.size - 1
+        if headers.get("range") and self._if_range_holds(meta, headers.get("if-range")):
+            try:
+                byte_range = parse_range(headers["range"], meta.size)
+            except RangeNotSatisfiable:
+                self.not_satisfiable += 1
+                return Response(status_code=416, headers={**response_headers, "Content-Range": f"bytes */{meta.size}"})
+            if byte_range is not None:
+                status, (start, end) = 206, byte_range
+                response_headers["Content-Range"] = f"bytes {start}-{end}/{meta.size}"
+
+        if status == 206:
+            self.partial += 1
+        else:
+            self.full += 1
+        length = end - start + 1
+        self.bytes_sent += length
+        response_headers["Content-Length"] = str(length)
+        if length == 0:
+            return Response(status_code=status, media_type=meta.content_type, headers=response_headers)
+        return StreamingResponse(body(start, end), status_code=status, media_type=meta.content_type,
+                                 headers=response_headers)
+
+    @staticmethod
+    def _not_modified(meta: ImageMeta, headers: Mapping[str, str]) -> bool:
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            # Takes precedence over If-Modified-Since
+            return etag_matches(if_none_match, meta.etag)
+        since = _http_date_seconds(headers.get("if-modified-since") or "")
+        return since is not None and int(meta.last_modified) <= since
+
+    @staticmethod
+    def _if_range_holds(meta: ImageMeta, if_range: Optional[str]) -> bool:
+        """True if the range can be served: no If-Range, or it still matches (strongly) the image."""
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            return if_range == meta.etag
+        return if_range == formatdate(meta.last_modified, usegmt=True)
+
+    @staticmethod
+    def _blob_etag(entry: BlobEntry) -> str:
+        if entry.sha256:
+            return f'"{entry.sha256}"'
+        etag = entry.etag or ""
+        return etag if etag.startswith('"') else f'"{etag}"'
+
+    def _local_meta(self, path: str, name: str, sha256: Optional[str] = None) -> Optional[ImageMeta]:
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not os.path.isfile(path):
+            return None
+        if sha256 is None:
+            sha256 = self._file_hash(path, stat)
+        return ImageMeta(stat.st_size, f'"{sha256}"', stat.st_mtime, content_type_for(name))
+
+    def _file_hash(self, path: str, stat: os.stat_result) -> str:
+        """sha256 of a local file the image store doesn't index, from the LRU while the file is unchanged."""
+        key = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._hashes_lock:
+            sha256 = self._hashes.get(key)
+            if sha256 is not None:
+                self._hashes.move_to_end(key)
+                return sha256
+        # Hashed without the lock; two threads may both hash a new file, and store the same result
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(FILE_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        with self._hashes_lock:
+            self._hashes[key] = sha256
+            self._hashes.move_to_end(key)
+            while len(self._hashes) > self.hash_cache_size:
+                self._hashes.popitem(last=False)
+        return sha256
+
+    async def _file_chunks(self, path: str, start: int, end: int) -> AsyncIterator[bytes]:
+        async for chunk in self._fd_chunks(os.open(path, os.O_RDONLY), start, end):
+            yield chunk
+
+    async def _fd_chunks(self, fd: int, start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes start..end of an open file; closes it."""
+        loop = asyncio.get_running_loop()
+        try:
+            offset = start
+            while offset <= end:
+                chunk = await loop.run_in_executor(
+                    self._executor, os.pread, fd, min(FILE_CHUNK_BYTES, end - offset + 1), offset
+                )
+                if not chunk:
+                    return
+                offset += len(chunk)
+                yield chunk
+        finally:
+            os.close(fd)
+
+    async def _blob_chunks(self, name: str, entry: BlobEntry, start: int, end: int) -> AsyncIterator[bytes]:
+        data = self.cache.memory_get(name, entry)
+        if data is not None:
+            yield data[start:end + 1]
+            return
+
+        loop = asyncio.get_running_loop()
+        fd = await loop.run_in_executor(self._executor, self.cache.open_disk, name, entry)
+        if fd is not None:
+            async for chunk in self._fd_chunks(fd, start, end):
+                yield chunk
+            return
+
+        # Only whole downloads are worth caching
+        fill = None
+        if start == 0 and end == entry.size - 1:
+            fill = await loop.run_in_executor(self._executor, self.cache.fill, name, entry)
+        done = False
+        try:
+            chunks = await loop.run_in_executor(
+                self._executor, self.storage.download_image_chunks, name, start, end - start + 1, entry.etag
+            )
+            while True:
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if fill is not None:
+                    await loop.run_in_executor(self._executor, fill.write, chunk)
+                yield chunk
+            if fill is not None:
+                await loop.run_in_executor(self._executor, fill.commit)
+            done = True
+        except Exception:
+            # Most likely the blob changed since its properties were cached
+            self.cache.invalidate(name)
+            raise
+        finally:
+            if fill is not None and not done:
+                fill.abort()
+
+# Create a singleton instance
+image_delivery = ImageDelivery()
@@ -0,0 +1,460 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import unquote, urlsplit
+
+from utils.azure_storage import azure_storage
+
+logger = logging.getLogger(__name__)
+
+LOCAL_IMAGE_DIR = "static/images"
+
+# Blob name prefix of image content in the images container
+CONTENT_PREFIX = "content/"
+# Blob name prefix uploads were once staged under before their hash was known; GC still clears it
+STAGING_PREFIX = "uploads/"
+# Blob name prefix of resized and transcoded variants, grouped by source content: variants/<sha256>/...
+VARIANT_PREFIX = "variants/"
+
+def valid_name(name: str) -> bool:
+    """Whether `name` can be an image name: a single path component, so it stays inside static/images."""
+    return os.path.basename(name) == name and name not in ("", ".", "..")
+
+def move_legacy_dir(legacy: str, path: str) -> None:
+    """Move a directory that used to be served under /static to `path`, once."""
+    if not os.path.isdir(legacy) or os.path.exists(path):
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.rename(legacy, path)
+        logger.info(f"Moved {legacy} to {path}, out of /static")
+    except OSError as e:
+        logger.warning(f"Failed to move {legacy} to {path}: {e}")
+
+class StoredImage(NamedTuple):
+    name: str
+    sha256: str
+    size: int
+    storage: str  # "azure" or "local"
+    content_type: Optional[str]
+
+class ImageStore:
+    """
+    Content-addressed image storage with an index of image names.
+
+    Image content is stored once per sha256: as the blob `content/<sha256>`,
+    or as data/content/<sha256> without Azure, where each name is a hard
+    link to it in static/images so /static/images/<name> keeps working.
+    The content directory itself isn't served.
+    A SQLite index maps names to content and counts the names that point
+    at each content. Storing a name whose content is already stored only
+    adds a reference.
+
+    Variants of an image (image_transform) are stored next to it, under
+    `variants/<sha256>/` or in `variant_dir`, and go with its content.
+
+    Content nobody references any more is deleted with its variants by
+    collect_garbage(), which start() runs every `gc_interval` seconds,
+    once it has been unreferenced for `gc_grace` seconds. The grace period covers uploads
+    that are still about to reference it. Objects under content/ that the
+    index doesn't know (e.g. left by a crash between storing and indexing)
+    and staged uploads under uploads/ are deleted after the same grace
+    period, as are variants stored before they were grouped by content.
+    """
+
+    def __init__(self,
+                 storage=azure_storage,
+                 path: str = None,
+                 local_dir: str = LOCAL_IMAGE_DIR,
+                 content_dir: str = None,
+                 variant_dir: str = None,
+                 gc_interval: float = None,
+                 gc_grace: float = None):
+        self.storage = storage
+        self.path = path or os.environ.get("IMAGE_INDEX_PATH", "image_index.sqlite3")
+        self.local_dir = local_dir
+        if content_dir is None and "IMAGE_CONTENT_DIR" not in os.environ:
+            move_legacy_dir("static/content", "data/content")
+        self.content_dir = content_dir or os.environ.get("IMAGE_CONTENT_DIR", "data/content")
+        if variant_dir is None and "IMAGE_VARIANT_DIR" not in os.environ:
+            move_legacy_dir("static/variants", "data/variants")
+        self.variant_dir = variant_dir or os.environ.get("IMAGE_VARIANT_DIR", "data/variants")
+        self.gc_interval = gc_interval if gc_interval is not None else float(os.environ.get("IMAGE_GC_INTERVAL", 3600))
+        self.gc_grace = gc_grace if gc_grace is not None else float(os.environ.get("IMAGE_GC_GRACE", 3600))
+        self._task: Optional[asyncio.Task] = None
+        # The connection is shared with the GC thread
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.bytes_deduplicated = 0
+        self.gc_runs = 0
+        self.gc_deleted = 0
+        self.orphans_deleted = 0
+        self.variants_deleted = 0
+        self.bytes_reclaimed = 0
+        try:
+            self._conn = self._connect(self.path)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to open image index at {self.path}, using memory only: {e}")
+            self._conn = self._connect(":memory:")
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        if path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS contents ("
+            "sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, storage TEXT NOT NULL, "
+            "refcount INTEGER NOT NULL, released_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS names ("
+            "name TEXT PRIMARY KEY, sha256 TEXT NOT NULL, content_type TEXT, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS contents_unreferenced ON contents (refcount, released_at)")
+        return conn
+
+    def resolve(self, name: str) -> Optional[StoredImage]:
+        """The stored image behind `name`, or None if the name isn't in the index."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT n.sha256, c.size, c.storage, n.content_type FROM names n JOIN contents c USING (sha256) "
+                "WHERE n.name = ?", (name,)
+            ).fetchone()
+        return StoredImage(name, *row) if row else None
+
+    def names(self, limit: int = 100) -> List[StoredImage]:
+        """The indexed images, by name."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT n.name, n.sha256, c.size, c.storage, n.content_type FROM names n JOIN contents c "
+                "USING (sha256) ORDER BY n.name LIMIT ?", (limit,)
+            ).fetchall()
+        return [StoredImage(*row) for row in rows]
+
+    def name_for_url(self, url: str) -> Optional[str]:
+        """
+        The image name behind a URL from url(), or a per-name blob or file URL from before the index.
+
+        A `content/<sha256>` URL is shared by every name with that content,
+        so it only gives a name if exactly one name points at it.
+        """
+        path = unquote(urlsplit(url).path)
+        local_prefix = f"/{LOCAL_IMAGE_DIR}/"
+        if path.startswith(local_prefix):
+            return path[len(local_prefix):] or None
+        if not self.storage.initialized:
+            return None
+        container_path = urlsplit(f"{self.storage.blob_service_client.url}{self.storage.container_name}/").path
+        if not path.startswith(container_path):
+            return None
+        blob_name = path[len(container_path):]
+        if not blob_name.startswith(CONTENT_PREFIX):
+            return blob_name or None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM names WHERE sha256 = ? LIMIT 2", (blob_name[len(CONTENT_PREFIX):],)
+            ).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+    def add_reference(self, name: str, sha256: str, content_type: Optional[str] = None) -> Optional[StoredImage]:
+        """
+        Point `name` at already stored content.
+
+        Returns:
+            The stored image, or None if no content with this hash is
+            stored, in which case nothing changed
+        """
+        image = self._bind(name, sha256, content_type)
+        if image is not None:
+            self.duplicates += 1
+            self.bytes_deduplicated += image.size
+        return image
+
+    def add_content(self, name: str, sha256: str, size: int, storage: str,
+                    content_type: Optional[str] = None) -> StoredImage:
+        """Index content just stored under its hash and point `name` at it."""
+        return self._bind(name, sha256, content_type, (size, storage))
+
+    def save_bytes(self, name: str, data: bytes, content_type: Optional[str] = None) -> StoredImage:
+        """
+        Store `data` as image `name`, for callers that already hold the content.
+
+        /images/upload streams instead, through ImageUploader.
+
+        Raises:
+            ValueError: `name` isn't a valid image name (see valid_name)
+        """
+        if not valid_name(name):
+            raise ValueError(f"Invalid image name: {name!r}")
+        sha256 = hashlib.sha256(data).hexdigest()
+        image = self.add_reference(name, sha256, content_type)
+        if image is not None:
+            return image
+        if self.storage.initialized and self.storage.upload_image(
+                data, CONTENT_PREFIX + sha256, content_type, {"sha256": sha256}):
+            return self.add_content(name, sha256, len(data), "azure", content_type)
+        os.makedirs(self.content_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.content_dir, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self.content_path(sha256))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return self.add_content(name, sha256, len(data), "local", content_type)
+
+    def release(self, name: str) -> bool:
+        """Remove `name` from the index; its content is deleted by GC once nothing references it."""
+        with self._transaction():
+            row = self._conn.execute("SELECT sha256 FROM names WHERE name = ?", (name,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM names WHERE name = ?", (name,))
+                self._unreference(row[0])
+        if row is None:
+            return False
+        self._unlink(os.path.join(self.local_dir, name))
+        return True
+
+    def content_path(self, sha256: str) -> str:
+        return os.path.join(self.content_dir, sha256)
+
+    def variant_path(self, key: str) -> str:
+        """Local path of the variant `key` (`<sha256>/<file>`); its blob is VARIANT_PREFIX + key."""
+        return os.path.join(self.variant_dir, key)
+
+    def url(self, image: StoredImage) -> str:
+        if image.storage == "azure":
+            return (f"{self.storage.blob_service_client.url}{self.storage.container_name}/"
+                    f"{CONTENT_PREFIX}{image.sha256}")
+        return f"/static/images/{image.name}"
+
+    def collect_garbage(self) -> Dict[str, int]:
+        """
+        Delete content unreferenced for longer than `gc_grace`, and unindexed content objects as old.
+
+        Returns:
+            Counts of deleted content and orphans, and the bytes reclaimed
+        """
+        cutoff = time.time() - self.gc_grace
+        with self._transaction():
+            rows = self._conn.execute(
+                "SELECT sha256, size, storage FROM contents WHERE refcount <= 0 AND released_at < ?", (cutoff,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM contents WHERE refcount <= 0 AND released_at < ?", (cutoff,))
+
+        deleted = reclaimed = 0
+        for sha256, size, storage in rows:
+            # Stored again after the index row went (a new upload of the same bytes)? Then it is newer than cutoff.
+            if self._delete_content(sha256, storage, cutoff):
+                deleted += 1
+                reclaimed += size
+        orphans, orphan_bytes = self._delete_orphans(cutoff)
+
+        self.gc_runs += 1
+        self.gc_deleted += deleted
+        self.orphans_deleted += orphans
+        self.bytes_reclaimed += reclaimed + orphan_bytes
+        if deleted or orphans:
+            logger.info(f"Image GC deleted {deleted} unreferenced and {orphans} orphaned contents, "
+                        f"{reclaimed + orphan_bytes} bytes")
+        return {"deleted": deleted, "orphans": orphans, "bytes_reclaimed": reclaimed + orphan_bytes}
+
+    def start(self) -> None:
+        """Run collect_garbage() every `gc_interval` seconds on the running event loop."""
+        if self.gc_interval <= 0:
+            logger.info("Image GC disabled (IMAGE_GC_INTERVAL=0)")
+            return
+        self._task = asyncio.create_task(self._gc_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            names, logical = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(c.size), 0) FROM names n JOIN contents c USING (sha256)"
+            ).fetchone()
+            contents, physical, unreferenced = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount <= 0), 0) FROM contents"
+            ).fetchone()
+        return {
+            "names": names,
+            "contents": contents,
+            "unreferenced_contents": unreferenced,
+            "logical_bytes": logical,
+            "stored_bytes": physical,
+            "dedup_ratio": round(logical / physical, 3) if physical else 1.0,
+            "duplicate_uploads": self.duplicates,
+            "bytes_deduplicated": self.bytes_deduplicated,
+            "gc_runs": self.gc_runs,
+            "gc_deleted": self.gc_deleted,
+            "orphans_deleted": self.orphans_deleted,
+            "variants_deleted": self.variants_deleted,
+            "bytes_reclaimed": self.bytes_reclaimed,
+        }
+
+    def _bind(self, name: str, sha256: str, content_type: Optional[str],
+              new_content: Optional[tuple] = None) -> Optional[StoredImage]:
+        if not valid_name(name):
+            raise ValueError(f"Invalid image name: {name!r}")
+        now = time.time()
+        with self._transaction():
+            row = self._conn.execute("SELECT size, storage FROM contents WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                if new_content is None:
+                    return None
+                row = new_content
+                self._conn.execute(
+                    "INSERT INTO contents (sha256, size, storage, refcount, released_at) VALUES (?, ?, ?, 0, ?)",
+                    (sha256, *row, now)
+                )
+            previous = self._conn.execute("SELECT sha256 FROM names WHERE name = ?", (name,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO names (name, sha256, content_type, created_at) VALUES (?, ?, ?, ?)",
+                (name, sha256, content_type, now)
+            )
+            if previous is None or previous[0] != sha256:
+                self._conn.execute("UPDATE contents SET refcount = refcount + 1 WHERE sha256 = ?", (sha256,))
+                if previous is not None:
+                    self._unreference(previous[0])
+            image = StoredImage(name, sha256, row[0], row[1], content_type)
+            # Before the commit: if the name can't be linked, the index doesn't reference it either
+            if image.storage == "local":
+                self._link(image)
+        return image
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _unreference(self, sha256: str) -> None:
+        self._conn.execute(
+            "UPDATE contents SET refcount = refcount - 1, released_at = ? WHERE sha256 = ?", (time.time(), sha256)
+        )
+
+    def _link(self, image: StoredImage) -> None:
+        """Make static/images/<name> a hard link to the content (a copy where links aren't supported)."""
+        os.makedirs(self.local_dir, exist_ok=True)
+        temp_path = os.path.join(self.local_dir, f".link-{os.getpid()}-{image.sha256[:16]}")
+        self._unlink(temp_path)
+        try:
+            try:
+                os.link(self.content_path(image.sha256), temp_path)
+            except OSError:
+                shutil.copyfile(self.content_path(image.sha256), temp_path)
+            os.replace(temp_path, os.path.join(self.local_dir, image.name))
+        except BaseException:
+            self._unlink(temp_path)
+            raise
+
+    def _delete_content(self, sha256: str, storage: str, cutoff: float) -> bool:
+        if storage == "azure":
+            deleted = self.storage.delete_image(
+                CONTENT_PREFIX + sha256, if_unmodified_since=datetime.fromtimestamp(cutoff, timezone.utc)
+            )
+        else:
+            path = self.content_path(sha256)
+            try:
+                deleted = os.stat(path).st_mtime < cutoff and self._unlink(path)
+            except FileNotFoundError:
+                deleted = False
+        if deleted:
+            self._delete_variants(sha256)
+        return deleted
+
+    def _delete_variants(self, sha256: str) -> None:
+        """Delete the variants of content `sha256`, wherever image_transform stored them."""
+        if self.storage.initialized:
+            for blob in self.storage.list_image_properties(f"{VARIANT_PREFIX}{sha256}/"):
+                if self.storage.delete_image(blob.name):
+                    self.variants_deleted += 1
+        local_dir = self.variant_path(sha256)
+        try:
+            self.variants_deleted += len(os.listdir(local_dir))
+        except FileNotFoundError:
+            return
+        shutil.rmtree(local_dir, ignore_errors=True)
+
+    def _delete_orphans(self, cutoff: float):
+        deleted = reclaimed = 0
+        candidates: List[tuple] = []
+        if self.storage.initialized:
+            for blob in self.storage.list_image_properties(CONTENT_PREFIX):
+                if blob.last_modified.timestamp() < cutoff:
+                    candidates.append((blob.name[len(CONTENT_PREFIX):], "azure", blob.size))
+        try:
+            for entry in os.scandir(self.content_dir):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    candidates.append((entry.name, "local", entry.stat().st_size))
+        except FileNotFoundError:
+            pass
+
+        for sha256, storage, size in candidates:
+            with self._lock:
+                known = self._conn.execute("SELECT 1 FROM contents WHERE sha256 = ?", (sha256,)).fetchone()
+            if known is None and self._delete_content(sha256, storage, cutoff):
+                deleted += 1
+                reclaimed += size
+
+        # uploads/ blobs staged by uploads before they were spooled locally, and
+        # variants from before they were grouped by content, which nothing can request any more
+        if self.storage.initialized:
+            for prefix in (STAGING_PREFIX, VARIANT_PREFIX):
+                for blob in self.storage.list_image_properties(prefix):
+                    if prefix == VARIANT_PREFIX and "/" in blob.name[len(prefix):]:
+                        continue
+                    if blob.last_modified.timestamp() < cutoff and self.storage.delete_image(
+                            blob.name, if_unmodified_since=datetime.fromtimestamp(cutoff, timezone.utc)):
+                        deleted += 1
+                        reclaimed += blob.size
+        try:
+            for entry in os.scandir(self.variant_dir):
+                if entry.is_file() and not entry.name.startswith(".") and entry.stat().st_mtime < cutoff:
+                    size = entry.stat().st_size
+                    if self._unlink(entry.path):
+                        deleted += 1
+                        reclaimed += size
+        except FileNotFoundError:
+            pass
+        return deleted, reclaimed
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def _gc_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            try:
+                await loop.run_in_executor(None, self.collect_garbage)
+            except Exception:
+                logger.exception("Image GC failed")
+
+# Create a singleton instance
+image_store = ImageStore()
@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from fastapi.responses import Response
+from PIL import Image, UnidentifiedImageError
+
+from services.image_delivery import image_delivery
+from services.image_store import VARIANT_PREFIX, image_store
+from services.single_flight import SingleFlight
+from utils.azure_storage import azure_storage
+from utils.image_transcode import FORMATS, available_formats, transcode
+
+logger = logging.getLogger(__name__)
+
+SHA256_ETAG = re.compile(r'^"([0-9a-f]{64})"$')
+
+class UnsupportedImage(Exception):
+    """The stored image can't be decoded, or is too large to."""
+
+def variant_key(source_etag: str, width: int, quality: int, fmt: str) -> str:
+    """
+    Name of a variant, `<source>/<parameters>`: the same source bytes and parameters give the same name.
+
+    Variants of content-addressed sources (uploads and local files, whose
+    strong ETag is their sha256) are grouped under that sha256, so
+    image_store deletes them with the content.
+    """
+    match = SHA256_ETAG.match(source_etag)
+    source = match.group(1) if match else "etag-" + hashlib.sha256(source_etag.encode()).hexdigest()
+    return f"{source}/{width}w-q{quality}.{FORMATS[fmt][2]}"
+
+class ImageTransformer:
+    """
+    Resized and transcoded variants of stored images, generated once.
+
+    A variant is named after the source image's strong ETag (its sha256
+    for uploads and local files) and the parameters, and stored like the
+    images themselves: as a `variants/<sha256>/` blob, or in image_store's
+    variant directory without Azure, where image_store deletes it once the
+    source content is garbage collected. Requests for an existing variant are answered by
+    image_delivery with the same caching headers, ranges and 304s; a
+    missing one is generated in a process pool, so encoding never blocks
+    the event loop, and concurrent requests for it share one encode.
+
+    Widths are rounded up to the next of `widths` and qualities to a
+    multiple of 5, so arbitrary parameters can't fill the store.
+    """
+
+    def __init__(self,
+                 delivery=image_delivery,
+                 storage=azure_storage,
+                 store=image_store,
+                 widths: Tuple[int, ...] = None,
+                 max_workers: int = None):
+        self.delivery = delivery
+        self.storage = storage
+        self.store = store
+        self.widths = tuple(sorted(widths or (
+            int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "160,320,480,640,800,1080,1440").split(",")
+        )))
+        self.max_workers = max_workers or int(os.environ.get("IMAGE_TRANSCODE_WORKERS", os.cpu_count() or 1))
+        self.formats = available_formats()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._flight = SingleFlight(wait_timeout=60.0)
+        self.hits = 0
+        self.generated = 0
+        self.failures = 0
+        self.source_bytes = 0
+        self.variant_bytes = 0
+        self.cpu_seconds = 0.0
+
+    def normalize(self, width: Optional[int], quality: int, fmt: str) -> Tuple[int, int, str]:
+        """
+        The stored variant parameters for a request's width, quality and format.
+
+        Raises:
+            ValueError: Unknown or unsupported format
+        """
+        fmt = fmt.lower()
+        if fmt == "jpg":
+            fmt = "jpeg"
+        if fmt not in self.formats:
+            raise ValueError(f"format must be one of {', '.join(self.formats)}")
+        index = bisect.bisect_left(self.widths, width) if width else len(self.widths) - 1
+        width = self.widths[min(index, len(self.widths) - 1)]
+        quality = min(max(5 * round(quality / 5), 30), 95)
+        return width, quality, fmt
+
+    async def respond(self,
+                      name: str,
+                      width: Optional[int],
+                      quality: int,
+                      fmt: str,
+                      headers: Mapping[str, str]) -> Optional[Response]:
+        """
+        The response with a variant of image `name`, generating it if needed; None if there is no such image.
+
+        Raises:
+            ValueError: Unknown or unsupported format
+            UnsupportedImage: The image can't be transcoded
+        """
+        width, quality, fmt = self.normalize(width, quality, fmt)
+        meta = await self.delivery.meta(name)
+        if meta is None:
+            return None
+        key = variant_key(meta.etag, width, quality, fmt)
+        response = await self._respond_variant(key, headers)
+        if response is not None:
+            self.hits += 1
+            return response
+
+        key = await self._flight.do(key, lambda: self._generate(name, width, quality, fmt))
+        if key is None:
+            return None
+        return await self._respond_variant(key, headers)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "generated": self.generated,
+            "failures": self.failures,
+            "source_bytes": self.source_bytes,
+            "variant_bytes": self.variant_bytes,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "formats": list(self.formats),
+            "coalescing": self._flight.stats(),
+        }
+
+    async def _respond_variant(self, key: str, headers: Mapping[str, str]) -> Optional[Response]:
+        return await self.delivery.respond_stored(VARIANT_PREFIX + key, self.store.variant_path(key), headers)
+
+    async def _generate(self, name: str, width: int, quality: int, fmt: str) -> Optional[str]:
+        source = await self.delivery.read(name)
+        if source is None:
+            return None
+        meta, data = source
+        # Named after the bytes actually read, in case the image changed since its ETag was looked up
+        key = variant_key(meta.etag, width, quality, fmt)
+
+        loop = asyncio.get_running_loop()
+        try:
+            variant, cpu_seconds = await loop.run_in_executor(self._process_pool(), transcode, data, width, quality, fmt)
+        except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+            self.failures += 1
+            raise UnsupportedImage(str(e))
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a new pool for the next request
+            self.failures += 1
+            self._pool = None
+            raise
+
+        await loop.run_in_executor(None, self._store, key, variant, FORMATS[fmt][1])
+        self.generated += 1
+        self.source_bytes += len(data)
+        self.variant_bytes += len(variant)
+        self.cpu_seconds += cpu_seconds
+        logger.info(f"Generated {fmt} variant of {name} at {width}px: {len(data)} -> {len(variant)} bytes")
+        return key
+
+    def _store(self, key: str, variant: bytes, content_type: str) -> None:
+        if self.storage.initialized and self.storage.upload_image(variant, VARIANT_PREFIX + key, content_type):
+            return
+        path = self.store.variant_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".variant-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(variant)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        # Created on first use, with spawned workers: forking a process that
+        # already runs threads (the executors above) isn't safe
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+# Create a singleton instance
+image_transformer = ImageTransformer()
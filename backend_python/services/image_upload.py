@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+from services.image_cache import image_cache
+from services.image_store import CONTENT_PREFIX, image_store
+from services.single_flight import SingleFlight
+from utils.azure_storage import azure_storage
+
+logger = logging.getLogger(__name__)
+
+class UploadTooLarge(Exception):
+    """The upload went past the size limit; nothing was stored."""
+
+class EmptyUpload(Exception):
+    """The upload had no content."""
+
+class UploadResult(NamedTuple):
+    url: str
+    name: str
+    storage: str  # "azure" or "local"
+    size: int
+    sha256: str
+
+class ReceivedImage:
+    """
+    An upload read in full but not stored yet, spooled to a temporary file.
+
+    Created by ImageUploader.receive() and finished by save() or discard().
+    """
+
+    def __init__(self, content_type: Optional[str]):
+        self.content_type = content_type
+        self.size = 0
+        self.sha256: Optional[str] = None
+        self.digest = hashlib.sha256()
+        self.temp_path: Optional[str] = None
+        self.temp_file = None
+
+class ImageUploader:
+    """
+    Streams uploaded images into the content-addressed image store.
+
+    receive() reads the upload once, as it arrives, in blocks of
+    `block_bytes`: each block is counted against `max_bytes`, then hashed
+    and written to a temporary file in the content directory by a single
+    executor call before the next is read, so an upload never holds more
+    than one block in memory and an oversized one stops being read at the
+    limit. Blocks are spooled locally rather than to Azure because the
+    content's hash, and so whether it is stored already, is only known at
+    the end; each spool is bounded by `max_bytes`.
+
+    save() then gives the upload its name in the image_store index. If the
+    content is already stored, that is all: the temporary file is deleted
+    and nothing is sent to Azure. New content is staged from the file in
+    blocks straight onto the blob `content/<sha256>` and committed, or the
+    file is renamed to its local content path. The blocking Azure SDK and
+    file calls run on a small thread pool, at most `max_workers` at a
+    time, so the event loop stays free. If Azure fails, the upload is
+    kept in the local content directory instead. Concurrent uploads of
+    the same new content store it once: the others wait for that commit.
+    """
+
+    def __init__(self,
+                 storage=azure_storage,
+                 store=image_store,
+                 cache=image_cache,
+                 max_bytes: int = None,
+                 block_bytes: int = None,
+                 max_workers: int = None):
+        self.storage = storage
+        self.store = store
+        self.cache = cache
+        self.max_bytes = max_bytes or int(os.environ.get("IMAGE_UPLOAD_MAX_BYTES", 20 * 2**20))
+        self.block_bytes = block_bytes or int(os.environ.get("IMAGE_UPLOAD_BLOCK_BYTES", 2**20))
+        max_workers = max_workers or int(os.environ.get("IMAGE_UPLOAD_WORKERS", 8))
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-upload")
+        self._slots = asyncio.Semaphore(max_workers)
+        self._commits = SingleFlight(wait_timeout=300.0)
+        self.azure_uploads = 0
+        self.local_uploads = 0
+        self.deduplicated = 0
+        self.azure_failures = 0
+        self.too_large = 0
+        self.bytes_uploaded = 0
+
+    async def receive(self, chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> ReceivedImage:
+        """
+        Read, hash and stage an upload; save() or discard() the result.
+
+        Raises:
+            UploadTooLarge: Past max_bytes
+            EmptyUpload: No content
+            The storage error if writing fails; nothing is left behind on any error
+        """
+        received = ReceivedImage(content_type)
+        try:
+            async for block in self._blocks(chunks, received):
+                async with self._slots:
+                    await self._run(self._spool, received, block)
+            if received.size == 0:
+                raise EmptyUpload("Empty file")
+            await self._run(received.temp_file.close)
+        except BaseException:
+            await self.discard(received)
+            raise
+        received.sha256 = received.digest.hexdigest()
+        return received
+
+    async def save(self, received: ReceivedImage, name: str) -> UploadResult:
+        """Store a received upload under `name` and return where it went."""
+        try:
+            image = self.store.add_reference(name, received.sha256, received.content_type)
+            if image is not None:
+                self.deduplicated += 1
+                await self.discard(received)
+            else:
+                storage = await self._commits.do(received.sha256, lambda: self._run(self._commit, received))
+                image = self.store.add_content(
+                    name, received.sha256, received.size, storage, received.content_type
+                )
+                # Left over when another upload of the same content stored it
+                await self.discard(received)
+        except BaseException:
+            await self.discard(received)
+            raise
+        # Whatever was cached under this name is out of date now
+        self.cache.invalidate(name)
+        return UploadResult(self.store.url(image), name, image.storage, received.size, received.sha256)
+
+    async def discard(self, received: ReceivedImage) -> None:
+        """Delete a received upload's temporary file; blocks staged by a failed commit expire on their own."""
+        if received.temp_file is not None:
+            await self._run(self._remove_temp, received)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "azure_uploads": self.azure_uploads,
+            "local_uploads": self.local_uploads,
+            "deduplicated": self.deduplicated,
+            "azure_failures": self.azure_failures,
+            "too_large": self.too_large,
+            "bytes_uploaded": self.bytes_uploaded,
+        }
+
+    async def _blocks(self, chunks: AsyncIterator[bytes], received: ReceivedImage) -> AsyncIterator[List[bytes]]:
+        """
+        Group the upload's chunks into blocks of about `block_bytes`, stopping at the size limit.
+
+        A block is a list of the chunks as received: joining or slicing them
+        would copy every byte once more on the event loop.
+        """
+        block: List[bytes] = []
+        block_size = 0
+        async for chunk in chunks:
+            received.size += len(chunk)
+            if received.size > self.max_bytes:
+                self.too_large += 1
+                raise UploadTooLarge(f"Image is larger than {self.max_bytes} bytes")
+            block.append(chunk)
+            block_size += len(chunk)
+            if block_size >= self.block_bytes:
+                yield block
+                block = []
+                block_size = 0
+        if block:
+            yield block
+
+    def _spool(self, received: ReceivedImage, block: List[bytes]) -> None:
+        """Hash and write one block, in one executor call; hashlib releases the GIL for large chunks."""
+        if received.temp_file is None:
+            os.makedirs(self.store.content_dir, exist_ok=True)
+            # Renamed to its content path once saved, so a failed upload never shows up
+            fd, received.temp_path = tempfile.mkstemp(dir=self.store.content_dir, prefix=".upload-")
+            received.temp_file = os.fdopen(fd, "wb")
+        for chunk in block:
+            received.digest.update(chunk)
+        received.temp_file.writelines(block)
+
+    def _commit(self, received: ReceivedImage) -> str:
+        """Store new content from the spooled file and return where it went: "azure" or "local"."""
+        if self.storage.initialized:
+            try:
+                self._stage_file(received)
+                self._remove_temp(received)
+                self.azure_uploads += 1
+                self.bytes_uploaded += received.size
+                return "azure"
+            except Exception as e:
+                logger.warning(f"Azure Storage upload failed, saving locally: {e}")
+                self.azure_failures += 1
+        os.replace(received.temp_path, self.store.content_path(received.sha256))
+        received.temp_file = None
+        self.local_uploads += 1
+        self.bytes_uploaded += received.size
+        return "local"
+
+    def _stage_file(self, received: ReceivedImage) -> None:
+        blob_name = CONTENT_PREFIX + received.sha256
+        block_ids = []
+        with open(received.temp_path, "rb") as f:
+            while True:
+                block = f.read(self.block_bytes)
+                if not block:
+                    break
+                # Block IDs must all have the same length before base64 encoding
+                block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+                self.storage.stage_block(blob_name, block_id, block)
+                block_ids.append(block_id)
+        self.storage.commit_blocks(blob_name, block_ids, received.content_type, {"sha256": received.sha256})
+
+    @staticmethod
+    def _remove_temp(received: ReceivedImage) -> None:
+        received.temp_file.close()
+        received.temp_file = None
+        try:
+            os.unlink(received.temp_path)
+        except FileNotFoundError:
+            pass
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+# Create a singleton instance
+image_uploader = ImageUploader()
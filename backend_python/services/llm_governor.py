@@ -0,0 +1,210 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from utils.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class LLMOverloaded(Exception):
+    """The LLM call was shed: its queue wait would exceed the caller's deadline."""
+
+def estimate_tokens(messages: List[Dict[str, Any]], max_tokens: int) -> int:
+    """
+    Tokens a call counts against the deployment's TPM quota.
+
+    Azure OpenAI charges prompt tokens plus max_tokens at admission, so
+    that is what we budget. Prompt tokens are approximated as one per four
+    characters plus a few per message for the chat framing.
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return prompt_chars // 4 + 4 * len(messages) + (max_tokens or 0)
+
+class _Ticket:
+    __slots__ = ("cost", "future", "enqueued_at")
+
+    def __init__(self, cost: int, future: asyncio.Future):
+        self.cost = cost
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class LLMGovernor:
+    """
+    Admission control for Azure OpenAI calls.
+
+    A call is dispatched once a concurrency slot is free and both the
+    tokens-per-minute and requests-per-minute buckets can cover it. Waiting
+    calls are served by priority, then earliest deadline. A call whose
+    predicted queue wait exceeds its deadline is rejected up front with
+    LLMOverloaded, as is one still queued when its deadline passes, so the
+    caller can answer from the cache or static data instead.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 8,
+                 tokens_per_minute: float = None,
+                 requests_per_minute: float = None,
+                 max_queue: int = None):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute or float(os.environ.get("LLM_TOKENS_PER_MINUTE", 30000))
+        # Azure OpenAI allows 6 requests per minute per 1000 TPM of quota
+        self.requests_per_minute = requests_per_minute or float(
+            os.environ.get("LLM_REQUESTS_PER_MINUTE", self.tokens_per_minute * 6 / 1000)
+        )
+        self.max_queue = max_queue or int(os.environ.get("LLM_QUEUE_MAX", 100))
+
+        # Both buckets start full and hold at most one minute of budget
+        self._tokens = self.tokens_per_minute
+        self._requests = self.requests_per_minute
+        self._refilled_at = time.monotonic()
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._call_seconds: Optional[float] = None
+        self.in_flight = 0
+
+        self.admitted = 0
+        self.shed_predicted = 0
+        self.shed_deadline = 0
+        self.shed_queue_full = 0
+        self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.queue_wait = Histogram()
+
+    @asynccontextmanager
+    async def slot(self, cost: int, priority: int = PRIORITY_INTERACTIVE, deadline: float = None):
+        """
+        Hold an admitted LLM call for the duration of the block.
+
+        Args:
+            cost: Estimated tokens, see estimate_tokens()
+            priority: PRIORITY_INTERACTIVE, PRIORITY_BATCH or PRIORITY_BACKGROUND
+            deadline: Seconds the caller can wait for admission; None waits indefinitely
+
+        Raises:
+            LLMOverloaded: If the call was shed instead of admitted
+        """
+        await self._acquire(cost, priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            # EWMA of call duration, for predicting waits on concurrency slots
+            self._call_seconds = elapsed if self._call_seconds is None else 0.8 * self._call_seconds + 0.2 * elapsed
+            self.in_flight -= 1
+            self._dispatch()
+
+    async def _acquire(self, cost: int, priority: int, deadline: Optional[float]) -> None:
+        # A call bigger than a minute of budget could never be admitted otherwise
+        cost = min(cost, self.tokens_per_minute)
+        depth = sum(1 for *_, ticket in self._queue if not ticket.future.done())
+        self.queue_depth.observe(depth)
+        if depth >= self.max_queue:
+            self.shed_queue_full += 1
+            raise LLMOverloaded(f"LLM queue full ({depth} waiting)")
+
+        predicted = self.predicted_wait(cost, priority)
+        if deadline is not None and predicted > deadline:
+            self.shed_predicted += 1
+            raise LLMOverloaded(f"Predicted LLM queue wait {predicted:.1f}s exceeds deadline {deadline:.1f}s")
+
+        loop = asyncio.get_running_loop()
+        ticket = _Ticket(cost, loop.create_future())
+        expires = loop.time() + deadline if deadline is not None else float("inf")
+        heapq.heappush(self._queue, (priority, expires, next(self._seq), ticket))
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(ticket.future, deadline)
+        except asyncio.TimeoutError:
+            self.shed_deadline += 1
+            raise LLMOverloaded(f"LLM call not admitted within {deadline:.1f}s")
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Admitted just as the caller went away: give the slot back
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+        self.queue_wait.observe(time.monotonic() - ticket.enqueued_at)
+
+    def predicted_wait(self, cost: int, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Seconds a new call would queue behind the waiting calls at its priority or better."""
+        self._refill()
+        ahead = [ticket for p, _, _, ticket in self._queue if p <= priority and not ticket.future.done()]
+        tokens_needed = sum(ticket.cost for ticket in ahead) + cost - self._tokens
+        requests_needed = len(ahead) + 1 - self._requests
+        wait = max(
+            tokens_needed * 60.0 / self.tokens_per_minute,
+            requests_needed * 60.0 / self.requests_per_minute,
+            0.0,
+        )
+        busy = self.in_flight + len(ahead) - self.max_concurrency
+        if busy >= 0 and self._call_seconds is not None:
+            wait = max(wait, (busy // self.max_concurrency + 1) * self._call_seconds)
+        return wait
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(1 for *_, ticket in self._queue if not ticket.future.done()),
+            "admitted": self.admitted,
+            "shed_predicted": self.shed_predicted,
+            "shed_deadline": self.shed_deadline,
+            "shed_queue_full": self.shed_queue_full,
+            "tokens_available": int(self._tokens),
+            "requests_available": int(self._requests),
+            "tokens_per_minute": self.tokens_per_minute,
+            "requests_per_minute": self.requests_per_minute,
+            "mean_call_seconds": self._call_seconds or 0.0,
+            "queue_depth": self.queue_depth.snapshot(),
+            "queue_wait_seconds": self.queue_wait.snapshot(),
+        }
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60.0)
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60.0)
+
+    def _dispatch(self) -> None:
+        """Admit queued calls in order while slots and budget allow."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._queue:
+            ticket = self._queue[0][3]
+            if ticket.future.done():
+                # Timed out or cancelled while waiting
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= self.max_concurrency:
+                return
+            if self._tokens < ticket.cost or self._requests < 1:
+                # Strict order: wait for the head's budget rather than skipping ahead
+                delay = max(
+                    (ticket.cost - self._tokens) * 60.0 / self.tokens_per_minute,
+                    (1 - self._requests) * 60.0 / self.requests_per_minute,
+                )
+                self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self._tokens -= ticket.cost
+            self._requests -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            ticket.future.set_result(None)
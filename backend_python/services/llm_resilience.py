@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from services.llm_governor import LLMOverloaded
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpen(LLMOverloaded):
+    """The circuit breaker is open: the LLM has been failing, so it is not called."""
+
+def is_throttled(error: BaseException) -> bool:
+    """Whether `error` is the provider's 429 (rate limit or quota), which the governor's budgets are for."""
+    return getattr(error, "status_code", None) == 429
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over the outcomes of recent LLM calls.
+
+    Opens when at least `failure_ratio` of the last `window` calls failed
+    (once `min_calls` have been seen). While open every call is refused for
+    `open_seconds`; then a single trial call is let through (half-open),
+    which closes the breaker on success or re-opens it on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self,
+                 failure_ratio: float = None,
+                 window: int = None,
+                 min_calls: int = None,
+                 open_seconds: float = None):
+        self.failure_ratio = failure_ratio or float(os.environ.get("LLM_BREAKER_FAILURE_RATIO", 0.5))
+        self.window = window or int(os.environ.get("LLM_BREAKER_WINDOW", 20))
+        self.min_calls = min_calls or int(os.environ.get("LLM_BREAKER_MIN_CALLS", 5))
+        self.open_seconds = open_seconds or float(os.environ.get("LLM_BREAKER_OPEN_SECONDS", 30))
+        self.state = self.CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=self.window)
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one trial call may."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                self.rejected += 1
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def record(self, success: bool) -> None:
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = False
+            if success:
+                logger.info("LLM circuit breaker closed")
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+
+        self._outcomes.append(success)
+        failures = self._outcomes.count(False)
+        if (self.state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                and failures >= self.failure_ratio * len(self._outcomes)):
+            self._open()
+
+    def release(self) -> None:
+        """Give back a half-open trial that ended without an outcome (e.g. it was shed or cancelled)."""
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "opens": self.opens,
+            "rejected": self.rejected,
+            "recent_failure_ratio": self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0,
+        }
+
+    def _open(self) -> None:
+        logger.warning(f"LLM circuit breaker opened for {self.open_seconds:.0f}s")
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opens += 1
+
+class ResilientCaller:
+    """
+    Per-attempt timeouts, hedging and a circuit breaker around LLM calls.
+
+    Each attempt gets `attempt_timeout` seconds, admission wait included.
+    If a hedge factory is given and the first attempt hasn't finished after
+    the p95 of recent successful attempts, a second attempt is started and
+    whichever succeeds first wins; the other is cancelled. Hedging only
+    starts once `min_samples` latencies are known. Timeouts and errors
+    count as breaker failures; shed calls (LLMOverloaded) and the
+    provider's 429s don't, since they say the budgets are exhausted rather
+    than that the LLM is down.
+    """
+
+    def __init__(self,
+                 breaker: CircuitBreaker = None,
+                 attempt_timeout: float = None,
+                 hedge_min_delay: float = None,
+                 min_samples: int = 20):
+        self.breaker = breaker or CircuitBreaker()
+        self.attempt_timeout = attempt_timeout or float(os.environ.get("LLM_ATTEMPT_TIMEOUT_SECONDS", 20))
+        self.hedge_min_delay = hedge_min_delay or float(os.environ.get("LLM_HEDGE_MIN_DELAY_SECONDS", 1))
+        self.hedging = os.environ.get("LLM_HEDGING", "1") != "0"
+        self.min_samples = min_samples
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self.calls = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.throttled = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging: the recent p95 latency, or None while too few are known."""
+        if not self.hedging or len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+        return min(max(p95, self.hedge_min_delay), self.attempt_timeout)
+
+    async def call(self,
+                   fn: Callable[[], Awaitable[Any]],
+                   hedge: Callable[[], Awaitable[Any]] = None) -> Any:
+        """
+        Run fn() with a timeout, hedged by hedge() when it is slow.
+
+        Raises:
+            CircuitOpen: If the breaker refused the call
+            LLMOverloaded: If the call was shed by the governor
+            asyncio.TimeoutError or the upstream error: If every attempt failed
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen("LLM circuit breaker is open")
+        self.calls += 1
+        delay = self.hedge_delay() if hedge is not None else None
+
+        primary = asyncio.ensure_future(self._attempt(fn))
+        attempts = {primary}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done:
+                self.hedges += 1
+                attempts.add(asyncio.ensure_future(self._attempt(hedge)))
+
+            error: Optional[BaseException] = None
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        self.breaker.record(True)
+                        return task.result()
+                    # A shed hedge says nothing about the primary; keep its error only as a last resort
+                    if error is None or not isinstance(task.exception(), LLMOverloaded):
+                        error = task.exception()
+        except asyncio.CancelledError:
+            # The caller went away; don't leave a half-open trial hanging
+            self.breaker.release()
+            raise
+        finally:
+            for task in attempts:
+                task.cancel()
+
+        if isinstance(error, LLMOverloaded):
+            self.breaker.release()
+        elif is_throttled(error):
+            self.throttled += 1
+            self.breaker.release()
+        else:
+            self.failures += 1
+            self.breaker.record(False)
+        raise error
+
+    async def _attempt(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(), self.attempt_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        self._latencies.append(time.monotonic() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breaker": self.breaker.stats(),
+            "calls": self.calls,
+            "failures": self.failures,
+            "throttled": self.throttled,
+            "attempt_timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_win_rate": self.hedge_wins / self.hedges if self.hedges else 0.0,
+            "hedge_delay_seconds": self.hedge_delay(),
+        }
@@ -1,7 +1,24 @@
 from models.schemas import Restaurant
+from services.llm_governor import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    LLMGovernor,
+    LLMOverloaded,
+    estimate_tokens,
+)
+from services.llm_resilience import CircuitOpen, ResilientCaller, is_throttled
+from services.prompt_builder import recommendation_messages, response_format_params, token_usage
+from services.recommendation_cache import preferences_key, recommendation_cache
+from services.restaurant_catalog import restaurant_catalog
+from services.single_flight import SingleFlight
+from utils.restaurant_parser import parse_restaurant_json, parse_restaurant_list_json
+import asyncio
+import json
 import logging
 import random
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -19,11 +36,17 @@ logger.info(f"API key available: {api_key is not None}")
 logger.info(f"Endpoint available: {endpoint is not None}")
 logger.info(f"Deployment name: {deployment_name}")
 
+# Maximum number of LLM calls in flight per worker
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+# "async" uses AsyncAzureOpenAI, "sync" offloads the blocking client to a thread pool
+LLM_CLIENT_MODE = os.environ.get("AZURE_OPENAI_CLIENT_MODE", "async").lower()
+
 # Initialize OpenAI client - compatible with multiple openai package versions
 client = None
+async_client = None
 try:
     # Try to import AzureOpenAI from newer package version (1.0.0+)
-    from openai import AzureOpenAI
+    from openai import AzureOpenAI, AsyncAzureOpenAI
     logger.info("Using newer OpenAI package with AzureOpenAI client")
     try:
         client = AzureOpenAI(
@@ -32,6 +55,13 @@ try:
             azure_endpoint=endpoint
         )
         logger.info("AzureOpenAI client initialized successfully")
+        if LLM_CLIENT_MODE == "async":
+            async_client = AsyncAzureOpenAI(
+                api_key=api_key,
+                api_version="2024-02-15-preview",
+                azure_endpoint=endpoint
+            )
+            logger.info("AsyncAzureOpenAI client initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing AzureOpenAI client: {str(e)}")
 except ImportError:
@@ -48,100 +78,356 @@ except ImportError:
     except Exception as e:
         logger.error(f"Error configuring fallback OpenAI: {str(e)}")
 
+# Admits LLM calls within the concurrency, TPM and RPM budgets; the executor
+# only runs sync-client calls off the event loop
+llm_governor = LLMGovernor(max_concurrency=LLM_MAX_CONCURRENCY)
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+# Seconds an interactive request may wait for the LLM before it is answered from fallbacks
+LLM_QUEUE_DEADLINE = float(os.environ.get("LLM_QUEUE_DEADLINE_SECONDS", 10))
+logger.info(f"LLM client mode: {'async' if async_client is not None else 'executor'}, max concurrency: {LLM_MAX_CONCURRENCY}")
+
+# Timeouts, p95 hedging and the circuit breaker for recommendation calls
+llm_resilience = ResilientCaller()
+
+# Restaurants requested per LLM call on an /advise cache miss; extras fill the cache
+RECOMMENDATION_BATCH_SIZE = int(os.environ.get("RECOMMENDATION_BATCH_SIZE", 1))
+
+# Identical in-flight recommendation requests share one LLM call
+recommendation_flight = SingleFlight(
+    max_waiters=int(os.environ.get("LLM_COALESCE_MAX_WAITERS", 100)),
+    wait_timeout=float(os.environ.get("LLM_COALESCE_WAIT_TIMEOUT", 30))
+)
+
 # Get model deployment name from environment or default to "gpt-4"
 MODEL_DEPLOYMENT_NAME = deployment_name
 
+def llm_available() -> bool:
+    """True when Azure OpenAI is configured and a client could be created."""
+    return bool(api_key and endpoint and client is not None)
+
+def llm_calls_in_flight() -> int:
+    return llm_governor.in_flight
+
+def _create_chat_completion_sync(messages: list, params: dict) -> str:
+    """Blocking completion call; only ever run on the LLM executor."""
+    if hasattr(client, 'chat') and hasattr(client.chat, 'completions'):
+        # New OpenAI package
+        response = client.chat.completions.create(
+            model=MODEL_DEPLOYMENT_NAME,
+            messages=messages,
+            **params
+        )
+    else:
+        # Old OpenAI package
+        response = client.ChatCompletion.create(
+            engine=MODEL_DEPLOYMENT_NAME,
+            messages=messages,
+            **params
+        )
+    token_usage.record(getattr(response, "usage", None))
+    return response.choices[0].message.content
+
+async def create_chat_completion(messages: list,
+                                 priority: int = PRIORITY_INTERACTIVE,
+                                 deadline: Optional[float] = None,
+                                 **params) -> str:
+    """
+    Run a chat completion without blocking the event loop.
+
+    Uses the AsyncAzureOpenAI client when available, otherwise offloads the
+    sync client to a bounded thread pool. The call first waits for admission
+    by llm_governor, which raises LLMOverloaded if that would take longer
+    than `deadline` seconds. Reported token usage goes to token_usage.
+    """
+    cost = estimate_tokens(messages, params.get("max_tokens", 0))
+    async with llm_governor.slot(cost, priority, deadline):
+        if async_client is not None:
+            response = await async_client.chat.completions.create(
+                model=MODEL_DEPLOYMENT_NAME,
+                messages=messages,
+                **params
+            )
+            token_usage.record(response.usage)
+            return response.choices[0].message.content
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _llm_executor, _create_chat_completion_sync, messages, params
+        )
+
+async def stream_chat_completion(messages: list,
+                                 priority: int = PRIORITY_INTERACTIVE,
+                                 deadline: Optional[float] = None,
+                                 **params) -> AsyncIterator[str]:
+    """
+    Yield completion text deltas as they arrive.
+
+    The sync client cannot stream without blocking, so in executor mode the
+    whole completion is yielded as one chunk. Admission works as in
+    create_chat_completion().
+    """
+    cost = estimate_tokens(messages, params.get("max_tokens", 0))
+    async with llm_governor.slot(cost, priority, deadline):
+        if async_client is not None:
+            stream = await async_client.chat.completions.create(
+                model=MODEL_DEPLOYMENT_NAME,
+                messages=messages,
+                stream=True,
+                **params
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            token_usage.record(None)
+            return
+
+        loop = asyncio.get_running_loop()
+        yield await loop.run_in_executor(
+            _llm_executor, _create_chat_completion_sync, messages, params
+        )
+
 async def generate_azure_openai_recommendation(preferences: dict) -> list:
     """
     Generate restaurant recommendations using Azure OpenAI.
+
+    Requests with the same canonical preferences are answered from the
+    recommendation cache, and concurrent misses for the same preferences
+    share a single LLM call. With RECOMMENDATION_BATCH_SIZE > 1 a miss asks
+    for that many candidates at once and caches them all as variants. Only
+    real LLM results are cached, never samples.
+
+    When the LLM is overloaded the call is shed: any cached variant is
+    served even if its serve budget is used up, otherwise an empty list
+    tells the caller to use the static RESTAURANT_DATA. A call that fails,
+    or an LLM that isn't configured, falls back the same way, and to a
+    sample only if the catalog is empty.
     """
+    cache_key = preferences_key(preferences)
+    if not llm_available():
+        return _fallback(preferences, cache_key, "LLM not configured")
+
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving recommendation from cache")
+        return [dict(cached)]
+
     try:
-        # Return sample data if no API access
-        if not api_key or not endpoint or client is None:
-            logger.warning("Missing API key, endpoint, or client - returning sample data")
-            return get_sample_restaurant(preferences)
-            
-        # Get cuisine safely
-        cuisines = preferences.get('cuisines', [])
-        cuisine_str = cuisines[0] if cuisines and len(cuisines) > 0 else "italian"
-            
-        # Construct the prompt based on user preferences
-        prompt = f"""
-        Based on the following preferences, recommend a restaurant:
-        - Cuisine: {cuisine_str}
-        - Vibe: {preferences.get('vibe', 'romantic')}
-        - Location: {preferences.get('location', 'NYC')}
-        - Budget: {preferences.get('budget', '$$')}
-
-        Return the recommendation in this JSON format:
-        {{
-            "name": "Restaurant Name",
-            "cuisine": "Cuisine Type",
-            "priceRange": "Price Range",
-            "location": "Location",
-            "rating": 4.5,
-            "description": "Detailed description",
-            "fullAddress": "Full address",
-            "phone": "Phone number",
-            "website": "Website URL",
-            "imageUrl": "Image URL",
-            "openingHours": ["Opening hours for each day"],
-            "highlights": ["Highlight 1", "Highlight 2", "Highlight 3"],
-            "menuItems": [
-                {{
-                    "name": "Dish Name",
-                    "description": "Dish description",
-                    "price": "Price",
-                    "category": "Category"
-                }}
-            ]
-        }}
-        """
+        return await _generate_and_cache(preferences, cache_key, RECOMMENDATION_BATCH_SIZE)
+    except LLMOverloaded as e:
+        return _shed(cache_key, e)
+
+async def generate_azure_openai_recommendations(preferences: dict, count: int) -> list:
+    """
+    Generate up to `count` ranked restaurant recommendations in one LLM call.
 
+    Served from the cache when it already holds enough variants for these
+    preferences; otherwise the new candidates are added to the cache so
+    later /advise calls reuse them. Shed, or falls back when the LLM
+    isn't configured, like generate_azure_openai_recommendation().
+    """
+    cache_key = preferences_key(preferences)
+    if not llm_available():
+        return _fallback(preferences, cache_key, "LLM not configured")
+
+    cached = recommendation_cache.get_variants(cache_key)
+    if len(cached) >= count:
+        logger.info(f"Serving {count} recommendations from cache")
+        return [dict(restaurant) for restaurant in cached[:count]]
+
+    try:
+        return await _generate_and_cache(preferences, cache_key, count, PRIORITY_BATCH)
+    except LLMOverloaded as e:
+        return [dict(restaurant) for restaurant in cached] or _shed(cache_key, e)
+
+async def generate_refined_recommendations(preferences: dict, count: int) -> list:
+    """
+    One uncached LLM call for refine feedback the local engine couldn't satisfy.
+
+    `preferences` carries the feedback message. Returns [] when the LLM
+    isn't configured, fails, or is overloaded, so the caller keeps its
+    local best effort.
+    """
+    if not llm_available():
+        return []
+    try:
+        return await request_recommendations(preferences, count, PRIORITY_INTERACTIVE, LLM_QUEUE_DEADLINE) or []
+    except LLMOverloaded as e:
+        logger.warning(f"LLM overloaded, refining locally: {e}")
+        return []
+
+def _shed(cache_key: str, reason: Exception) -> list:
+    """Fallback for a shed LLM call: a cached variant, or [] for the static data."""
+    cached = recommendation_cache.peek(cache_key)
+    logger.warning(f"LLM overloaded, serving {'cached' if cached is not None else 'static'} recommendation: {reason}")
+    return [dict(cached)] if cached is not None else []
+
+async def _generate_and_cache(preferences: dict,
+                              cache_key: str,
+                              count: int,
+                              priority: int = PRIORITY_INTERACTIVE) -> list:
+    async def generate():
+        restaurants = await request_recommendations(preferences, count, priority, LLM_QUEUE_DEADLINE)
+        # Best-ranked candidate last so the cache serves it first
+        for restaurant in reversed(restaurants or []):
+            recommendation_cache.put(cache_key, restaurant)
+        return restaurants
+
+    restaurants = await recommendation_flight.do(f"{cache_key}:{count}", generate)
+    if not restaurants:
+        return _fallback(preferences, cache_key, "LLM call failed")
+    return [dict(restaurant) for restaurant in restaurants]
+
+def _fallback(preferences: dict, cache_key: str, reason: str) -> list:
+    """Fallback without an LLM result: a cached variant, [] for the catalog, or a sample if it is empty."""
+    cached = recommendation_cache.peek(cache_key)
+    if cached is not None:
+        logger.warning(f"{reason}, serving cached recommendation")
+        return [dict(cached)]
+    if restaurant_catalog.query({}, limit=1):
+        logger.warning(f"{reason}, serving catalog recommendation")
+        return []
+    logger.warning(f"{reason}, serving sample recommendation")
+    return get_sample_restaurant(preferences)
+
+async def request_recommendations(preferences: dict,
+                                  count: int = 1,
+                                  priority: int = PRIORITY_INTERACTIVE,
+                                  deadline: Optional[float] = None) -> Optional[list]:
+    """
+    Ask Azure OpenAI for `count` fresh recommendations, bypassing the cache.
+
+    Returns None when the call or response parsing fails. Raises
+    LLMOverloaded when the call is not admitted within `deadline` seconds,
+    or CircuitOpen (a subclass) while the circuit breaker is open.
+    Interactive calls that run past the recent p95 latency are hedged with
+    a second call, if the governor can admit it straight away.
+    """
+    messages = recommendation_messages(preferences, count)
+
+    def attempt(attempt_deadline: Optional[float]):
+        return create_chat_completion(
+            messages,
+            priority=priority,
+            deadline=attempt_deadline,
+            temperature=0.7,
+            max_tokens=1000 * count,
+            **response_format_params()
+        )
+
+    try:
         # Call Azure OpenAI
         try:
-            logger.info(f"Calling Azure OpenAI with model {MODEL_DEPLOYMENT_NAME}")
-            if hasattr(client, 'chat') and hasattr(client.chat, 'completions'):
-                # New OpenAI package
-                response = client.chat.completions.create(
-                    model=MODEL_DEPLOYMENT_NAME,
-                    messages=[
-                        {"role": "system", "content": "You are a restaurant recommendation assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                recommendation = response.choices[0].message.content
-            else:
-                # Old OpenAI package
-                response = client.ChatCompletion.create(
-                    engine=MODEL_DEPLOYMENT_NAME,
-                    messages=[
-                        {"role": "system", "content": "You are a restaurant recommendation assistant."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                recommendation = response.choices[0].message.content
+            logger.info(f"Calling Azure OpenAI with model {MODEL_DEPLOYMENT_NAME} for {count} restaurant(s)")
+            recommendation = await llm_resilience.call(
+                lambda: attempt(deadline),
+                hedge=(lambda: attempt(0.0)) if priority == PRIORITY_INTERACTIVE else None
+            )
                 
             logger.info(f"Received response from Azure OpenAI")
-            try:
-                import json
-                restaurant_data = json.loads(recommendation)
-                return [restaurant_data]
-            except json.JSONDecodeError:
+            if count == 1:
+                restaurant_data = parse_restaurant_json(recommendation or "")
+                restaurants = [restaurant_data] if restaurant_data else None
+            else:
+                restaurants = parse_restaurant_list_json(recommendation or "")
+            if not restaurants:
                 logger.error("Failed to parse OpenAI response as JSON")
-                return get_sample_restaurant(preferences)
+                return None
+            return restaurants[:count]
                 
+        except LLMOverloaded:
+            raise
         except Exception as api_error:
-            logger.error(f"API error: {str(api_error)}")
-            return get_sample_restaurant(preferences)
+            logger.error(f"API error: {api_error!r}")
+            return None
 
+    except LLMOverloaded:
+        raise
     except Exception as e:
         logger.error(f"Error generating recommendation: {str(e)}", exc_info=True)
-        return get_sample_restaurant(preferences)
+        return None
+
+async def stream_azure_openai_recommendation(preferences: dict) -> AsyncIterator[str]:
+    """
+    Stream the raw JSON text of a recommendation as it is generated.
+
+    A cached recommendation is yielded as a single chunk, as is a cached
+    fallback when the call is shed, fails before producing output, or the
+    circuit breaker is open. Otherwise yields
+    nothing when the LLM is not configured or the call fails before
+    producing output, so callers should fall back to the catalog (a
+    sample only if it is empty), as /advise does.
+    Streams are not hedged, but their outcomes feed the circuit breaker,
+    and waiting for admission or for any chunk times out after the
+    attempt timeout.
+    """
+    if not llm_available():
+        logger.warning("LLM not configured - nothing to stream")
+        return
+
+    cache_key = preferences_key(preferences)
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Serving streamed recommendation from cache")
+        yield json.dumps(cached)
+        return
+
+    breaker = llm_resilience.breaker
+    if not breaker.allow():
+        shed = _shed(cache_key, CircuitOpen("LLM circuit breaker is open"))
+        if shed:
+            yield json.dumps(shed[0])
+        return
+
+    chunks = []
+    stream = stream_chat_completion(
+        recommendation_messages(preferences),
+        deadline=LLM_QUEUE_DEADLINE,
+        temperature=0.7,
+        max_tokens=1000,
+        **response_format_params()
+    )
+    try:
+        logger.info(f"Streaming from Azure OpenAI with model {MODEL_DEPLOYMENT_NAME}")
+        while True:
+            # Admission and each chunk get the attempt timeout, so a hung stream
+            # can't hold the connection and the breaker's trial forever
+            try:
+                delta = await asyncio.wait_for(stream.__anext__(), llm_resilience.attempt_timeout)
+            except StopAsyncIteration:
+                break
+            chunks.append(delta)
+            yield delta
+    except LLMOverloaded as e:
+        breaker.release()
+        shed = _shed(cache_key, e)
+        if shed:
+            yield json.dumps(shed[0])
+        return
+    except Exception as api_error:
+        if isinstance(api_error, asyncio.TimeoutError):
+            llm_resilience.timeouts += 1
+        if is_throttled(api_error):
+            llm_resilience.throttled += 1
+            breaker.release()
+        else:
+            breaker.record(False)
+        logger.error(f"API error while streaming: {api_error!r}")
+        cached = recommendation_cache.peek(cache_key)
+        if not chunks and cached is not None:
+            yield json.dumps(cached)
+        return
+    except BaseException:
+        # Client disconnected mid-stream: no verdict on the upstream
+        breaker.release()
+        raise
+    finally:
+        await stream.aclose()
+
+    breaker.record(True)
+
+    restaurant_data = parse_restaurant_json("".join(chunks))
+    if restaurant_data is not None:
+        recommendation_cache.put(cache_key, restaurant_data)
 
 def get_sample_restaurant(preferences):
     """Return a sample restaurant for fallback"""
@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List
+
+from utils.histogram import Histogram
+
+logger = logging.getLogger(__name__)
+
+# Keys in the order the stream parser relies on: core fields before the detail lists
+RESTAURANT_SCHEMA = {
+    "name": "",
+    "cuisine": "",
+    "priceRange": "$-$$$$",
+    "location": "",
+    "rating": 4.5,
+    "description": "detailed",
+    "fullAddress": "",
+    "phone": "",
+    "website": "",
+    "imageUrl": "",
+    "openingHours": ["each day"],
+    "highlights": ["3 items"],
+    "menuItems": [{"name": "", "description": "", "price": "", "category": ""}],
+}
+
+# The fixed part of every recommendation prompt, built once and sent first,
+# byte for byte the same on every call; everything that varies goes in the
+# user message after it. At about 110 tokens it is well under the 1024-token
+# minimum for Azure OpenAI prompt caching, so it is not served from the
+# provider's cache and `cached_prompt_tokens` stays 0: the saving is in
+# sending fewer tokens per call, not in cache hits. Padding it past the
+# threshold would cost more than the cache discount gives back; keeping it
+# stable means a prompt that grows past 1024 tokens (e.g. with examples)
+# starts getting cached prefixes without further changes.
+SYSTEM_PROMPT = (
+    "You are a restaurant recommendation assistant. Respect dietary restrictions and things to avoid. "
+    "Reply with JSON: one restaurant as this object, several as {\"restaurants\":[...]} best first.\n"
+    + json.dumps(RESTAURANT_SCHEMA, separators=(",", ":"))
+)
+
+# Ask for a JSON object via response_format; 0 for deployments that reject it
+LLM_JSON_MODE = os.environ.get("LLM_JSON_MODE", "1") == "1"
+
+TOKEN_BUCKETS = (100, 200, 300, 400, 600, 800, 1200, 1600, 2400, 3200, 4800)
+
+def recommendation_messages(preferences: Dict[str, Any], count: int = 1) -> List[Dict[str, str]]:
+    """Chat messages asking for one restaurant, or a ranked list of `count`."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": preferences_text(preferences, count)},
+    ]
+
+def preferences_text(preferences: Dict[str, Any], count: int = 1) -> str:
+    """The variable part of the prompt: one line per preference that is set."""
+    cuisines = preferences.get("cuisines") or []
+    lines = [
+        f"Recommend {count} restaurant{'s' if count > 1 else ''}.",
+        f"Cuisine: {cuisines[0] if cuisines else 'italian'}",
+        f"Vibe: {preferences.get('vibe') or 'romantic'}",
+    ]
+    if preferences.get("ambience"):
+        lines.append(f"Ambience: {preferences['ambience']}")
+    lines.append(f"Location: {preferences.get('location') or 'NYC'}")
+    lines.append(f"Budget: {preferences.get('budget') or '$$'}")
+    if preferences.get("partySize"):
+        lines.append(f"Party size: {preferences['partySize']}")
+    if preferences.get("dietaryRestrictions"):
+        lines.append(f"Dietary restrictions: {', '.join(preferences['dietaryRestrictions'])}")
+    if preferences.get("absoluteNogos"):
+        lines.append(f"Avoid: {', '.join(preferences['absoluteNogos'])}")
+    # Refine requests carry the user's feedback
+    if preferences.get("feedback"):
+        lines.append(f"Feedback on earlier suggestions: {preferences['feedback']}")
+    return "\n".join(lines)
+
+def response_format_params() -> Dict[str, Any]:
+    """Completion parameters that make the model answer with a JSON object."""
+    return {"response_format": {"type": "json_object"}} if LLM_JSON_MODE else {}
+
+class TokenUsage:
+    """
+    Prompt and completion tokens reported by the LLM, per call and in total.
+
+    `cached_prompt_tokens` counts prompt tokens the provider served from its
+    prefix cache, when it reports them; that is 0 while prompts stay under
+    the provider's 1024-token caching minimum (see SYSTEM_PROMPT). Streamed completions don't report
+    usage on this API version and are only counted as `unreported`.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.unreported = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.prompt = Histogram(TOKEN_BUCKETS)
+        self.completion = Histogram(TOKEN_BUCKETS)
+
+    def record(self, usage: Any) -> None:
+        """Add the `usage` of a completion response (object or dict); None counts as unreported."""
+        if usage is None:
+            self.unreported += 1
+            return
+        prompt = _field(usage, "prompt_tokens") or 0
+        completion = _field(usage, "completion_tokens") or 0
+        cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.cached_prompt_tokens += cached
+        self.prompt.observe(prompt)
+        self.completion.observe(completion)
+        logger.info(f"LLM usage: {prompt} prompt tokens ({cached} cached), {completion} completion tokens")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "unreported": self.unreported,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "prompt_tokens_per_call": self.prompt.snapshot(),
+            "completion_tokens_per_call": self.completion.snapshot(),
+        }
+
+def _field(value: Any, name: str) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+# Create a singleton instance
+token_usage = TokenUsage()
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def canonical_preferences(preferences: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalize AdviseRequest-style preferences so equivalent requests compare equal.
+
+    Strings are trimmed and lowercased, and dietary restrictions / no-gos are
+    de-duplicated and sorted. Only the first cuisine is kept because it is the
+    only one the recommendation prompt uses.
+    """
+    def clean(value, default=""):
+        return str(value if value is not None else default).strip().lower()
+
+    def clean_list(values):
+        return sorted({clean(v) for v in (values or []) if clean(v)})
+
+    cuisines = [c for c in (preferences.get("cuisines") or []) if c]
+    return {
+        "vibe": clean(preferences.get("vibe"), "romantic"),
+        "ambience": clean(preferences.get("ambience")),
+        "cuisine": clean(cuisines[0]) if cuisines else "italian",
+        "location": clean(preferences.get("location"), "NYC"),
+        "budget": clean(preferences.get("budget"), "$$"),
+        "partySize": clean(preferences.get("partySize"), "2"),
+        "dietaryRestrictions": clean_list(preferences.get("dietaryRestrictions")),
+        "absoluteNogos": clean_list(preferences.get("absoluteNogos")),
+    }
+
+def preferences_key(preferences: Dict[str, Any]) -> str:
+    """Stable cache key for a preferences dict (or AdviseRequest.dict())."""
+    canonical = json.dumps(canonical_preferences(preferences), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+class SQLiteCacheBackend:
+    """
+    Shared cache backend stored in a SQLite file.
+
+    Every gunicorn worker on the host opens the same file, so a recommendation
+    generated by one worker is a hit for all of them. The connection is
+    shared with the cache purge thread, hence the lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recommendation_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM recommendation_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def add_variant(self, key: str, value: Any, max_variants: int, ttl: float) -> List[Any]:
+        """
+        Add a variant to the key's shared variants, keeping the newest `max_variants`.
+
+        Other workers may have added variants since this one last read the
+        key, so they are merged in rather than overwritten.
+
+        Returns:
+            The key's variants after the merge, oldest first
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM recommendation_cache WHERE key = ?", (key,)
+                ).fetchone()
+                variants = json.loads(row[0]) if row is not None and row[1] >= now else []
+                if value in variants:
+                    variants.remove(value)
+                variants.append(value)
+                del variants[:-max_variants]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO recommendation_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(variants), max(now + ttl, row[1] if row is not None else 0)),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return variants
+
+    def delete_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM recommendation_cache WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+class _Entry:
+    __slots__ = ("variants", "expires_at", "served")
+
+    def __init__(self, variants: List[Any], expires_at: float):
+        self.variants = variants
+        self.expires_at = expires_at
+        self.served = 0
+
+class RecommendationCache:
+    """
+    Bounded in-process LRU with TTL for generated recommendations.
+
+    Each key holds up to `max_variants` different recommendations. A key is
+    served from cache `serves_per_refresh` times, rotating through its
+    variants, and then reports a miss so the caller generates a fresh variant
+    and users keep seeing variety. An optional shared backend (see
+    SQLiteCacheBackend) is consulted on local misses.
+    """
+
+    def __init__(self,
+                 max_entries: int = None,
+                 ttl: float = None,
+                 max_variants: int = None,
+                 serves_per_refresh: int = None,
+                 backend: Optional[SQLiteCacheBackend] = None):
+        self.max_entries = max_entries or int(os.environ.get("RECOMMENDATION_CACHE_MAX_ENTRIES", 5000))
+        self.ttl = ttl or float(os.environ.get("RECOMMENDATION_CACHE_TTL", 3600))
+        self.max_variants = max_variants or int(os.environ.get("RECOMMENDATION_CACHE_VARIANTS", 3))
+        self.serves_per_refresh = serves_per_refresh or int(os.environ.get("RECOMMENDATION_CACHE_SERVES_PER_REFRESH", 5))
+        self.backend = backend
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a cached recommendation for key, or None if the caller should generate one."""
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry.served >= self.serves_per_refresh:
+            # Serve budget used up: let the caller add a fresh variant
+            self.refreshes += 1
+            self.misses += 1
+            return None
+
+        # Newest variant first, then rotate through the older ones
+        value = entry.variants[-1 - entry.served % len(entry.variants)]
+        entry.served += 1
+        self.hits += 1
+        return value
+
+    def peek(self, key: str) -> Optional[Any]:
+        """Return any live variant for key without touching counters or the serve budget."""
+        entry = self._lookup(key)
+        return entry.variants[-1] if entry else None
+
+    def get_variants(self, key: str) -> List[Any]:
+        """Return all live variants for key, newest first; counts as a hit when any exist."""
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return []
+        self.hits += 1
+        return entry.variants[::-1]
+
+    def put(self, key: str, value: Any) -> None:
+        """Add a freshly generated variant for key and reset its serve budget."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= now:
+            entry = _Entry([], now + self.ttl)
+            self._entries[key] = entry
+        entry.variants.append(value)
+        del entry.variants[:-self.max_variants]
+        entry.served = 0
+        self._entries.move_to_end(key)
+        self._evict()
+
+        if self.backend is not None:
+            try:
+                # Picks up the variants other workers added to the shared row meanwhile
+                entry.variants = self.backend.add_variant(
+                    key, value, self.max_variants, max(entry.expires_at - now, 1)
+                )
+            except Exception as e:
+                logger.warning(f"Shared recommendation cache write failed: {e}")
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the shared backend and return how many; a no-op without one."""
+        if self.backend is None:
+            return 0
+        return self.backend.delete_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "evictions": self.evictions,
+            "shared_hits": self.shared_hits,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "shared_backend": self.backend is not None,
+        }
+
+    def _lookup(self, key: str) -> Optional[_Entry]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= now:
+            del self._entries[key]
+            self.evictions += 1
+            entry = None
+
+        if entry is None and self.backend is not None:
+            try:
+                variants = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Shared recommendation cache read failed: {e}")
+                variants = None
+            if variants:
+                entry = _Entry(variants, now + self.ttl)
+                self._entries[key] = entry
+                self.shared_hits += 1
+                self._evict()
+
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+def _create_backend() -> Optional[SQLiteCacheBackend]:
+    path = os.environ.get("RECOMMENDATION_CACHE_SHARED_PATH")
+    if not path:
+        return None
+    try:
+        backend = SQLiteCacheBackend(path)
+        logger.info(f"Shared recommendation cache enabled at {path}")
+        return backend
+    except Exception as e:
+        logger.error(f"Failed to open shared recommendation cache at {path}: {e}")
+        return None
+
+# Create a singleton instance
+recommendation_cache = RecommendationCache(backend=_create_backend())
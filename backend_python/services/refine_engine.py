@@ -0,0 +1,330 @@
+import logging
+import re
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from services.restaurant_catalog import VIBE_KEYWORDS, price_level, restaurant_catalog, tokens
+from services.vector_index import top_k
+from utils.histogram import LATENCY_BUCKETS, Histogram
+
+logger = logging.getLogger(__name__)
+
+CHEAPER_WORDS = ("cheaper", "cheap", "cheapest", "less expensive", "affordable", "inexpensive",
+                 "budget", "lower price", "not so expensive", "too expensive", "too pricey")
+PRICIER_WORDS = ("fancier", "fancy", "pricier", "more expensive", "upscale", "splurge", "high-end",
+                 "fine dining", "classier", "special occasion")
+BETTER_RATED_WORDS = ("better rated", "higher rated", "best rated", "top rated", "better reviews", "highly rated")
+# Recognised as asking for a cuisine even when neither the catalog nor the previous picks have it
+CUISINES = {
+    "italian", "japanese", "french", "mexican", "thai", "indian", "chinese", "korean", "american",
+    "mediterranean", "spanish", "greek", "vietnamese", "seafood", "vegan", "vegetarian", "ethiopian",
+    "lebanese", "turkish", "peruvian", "brazilian", "caribbean", "german", "middle eastern",
+}
+# Text similarity below this is noise, not a match for the message
+MIN_SIMILARITY = 0.2
+
+# Comparatives and synonyms people use in feedback, on top of the catalog's vibe keywords
+_VIBE_WORDS = {word: vibe for vibe, words in VIBE_KEYWORDS.items() for word in words}
+_VIBE_WORDS.update({
+    "quieter": "quiet", "calmer": "quiet", "livelier": "lively", "louder": "lively",
+    "cozier": "cozy", "cosier": "cozy", "fancier": "upscale", "classier": "upscale",
+    "trendier": "trendy", "hipper": "trendy", "chill": "casual", "chiller": "casual",
+})
+# Dishes that stand for a kind of restaurant when excluded ("no sushi")
+DISH_ALIASES = {
+    "sushi": ("sushi", "omakase", "sashimi", "nigiri"),
+    "taco": ("taco", "tacos", "taqueria"),
+    "pizza": ("pizza", "pizzeria"),
+    "burger": ("burger", "burgers"),
+    "steak": ("steak", "steakhouse"),
+}
+
+_NEGATED = re.compile(
+    r"\b(?:no more|no|not|without|skip|avoid|except|anything but|tired of|sick of|not in the mood for)\s+"
+    r"((?:(?!and\b|or\b|but\b|please\b|instead\b|anymore\b|again\b)[a-z][a-z'-]*\s*){1,3})"
+)
+_NEAR = re.compile(
+    r"\b(?:closer to|close to|nearer to|near|around|by|walking distance (?:of|from|to)|in the area of)\s+"
+    r"(?:the\s+)?((?:(?!and\b|or\b|but\b|please\b|instead\b|with\b)[a-z][a-z'-]*\s*){1,3})"
+)
+_PRICE_SIGNS = re.compile(r"(?<!\$)(\${1,4})(?!\$)")
+_FILLER = {"more", "any", "the", "a", "an", "so", "too", "very", "really", "place", "places", "food", "spot", "spots"}
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+def _phrase(text: str) -> str:
+    return " ".join(_stem(word) for word in tokens(text) if word not in _FILLER)
+
+class FeedbackConstraints(NamedTuple):
+    """What a refine message asks for."""
+    price_direction: int  # -1 cheaper, +1 pricier, 0 unchanged
+    price_target: int  # explicit "$$" level, 0 if none
+    excluded: List[str]  # stemmed phrases to avoid ("sushi", "dim sum")
+    location: str  # stemmed phrase to be near ("downtown")
+    vibes: List[str]  # catalog vibe names ("romantic")
+    cuisines: List[str]  # cuisines asked for
+    better_rated: bool
+
+    def understood(self) -> bool:
+        return bool(self.price_direction or self.price_target or self.excluded or self.location
+                    or self.vibes or self.cuisines or self.better_rated)
+
+def without_negations(message: str) -> str:
+    """The message with its "no X" / "not X" phrases removed, for similarity scoring."""
+    return _NEGATED.sub(" ", (message or "").lower())
+
+def parse_feedback(message: str, known_cuisines: Set[str] = frozenset()) -> FeedbackConstraints:
+    """
+    Parse a refine message into constraints.
+
+    Args:
+        message: The user's feedback, e.g. "cheaper, no sushi, closer to downtown"
+        known_cuisines: Lower-case cuisine names that count as asking for a cuisine
+
+    Returns:
+        FeedbackConstraints: Everything recognised; unrecognised words are left to text similarity
+    """
+    text = (message or "").lower()
+    excluded = []
+    for match in _NEGATED.finditer(text):
+        phrase = _phrase(match.group(1))
+        if phrase and phrase not in excluded:
+            excluded.append(phrase)
+    negated_words = {word for phrase in excluded for word in phrase.split()}
+
+    near = _NEAR.search(text)
+    direction = 0
+    if any(word in text for word in CHEAPER_WORDS):
+        direction = -1
+    elif any(word in text for word in PRICIER_WORDS):
+        direction = 1
+    signs = _PRICE_SIGNS.search(message or "")
+
+    words = tokens(text)
+    vibes = []
+    for word in words:
+        vibe = _VIBE_WORDS.get(word)
+        if vibe and vibe not in vibes and _stem(word) not in negated_words:
+            vibes.append(vibe)
+    known_cuisines = CUISINES | set(known_cuisines)
+    cuisines = [word for word in dict.fromkeys(words) if word in known_cuisines and _stem(word) not in negated_words]
+
+    return FeedbackConstraints(
+        price_direction=direction,
+        price_target=len(signs.group(1)) if signs else 0,
+        excluded=excluded,
+        location=_phrase(near.group(1)) if near else "",
+        vibes=vibes,
+        cuisines=cuisines,
+        better_rated=any(word in text for word in BETTER_RATED_WORDS),
+    )
+
+class RefineResult(NamedTuple):
+    ranked: List[Tuple[Dict[str, Any], str]]  # (restaurant, reason), best first
+    constraints: FeedbackConstraints
+    satisfied: bool  # False: nothing meets the hard constraints, the ranking is best effort
+
+class RefineEngine:
+    """
+    Local refinement of recommendations from a feedback message, without the LLM.
+
+    Candidates are the previous recommendations, restaurants shown earlier
+    in the conversation, and catalog matches for the parsed constraints. Exclusions, a price direction (relative to the
+    median previous price) and asked-for cuisines are hard filters;
+    location, vibe, rating and text similarity to the message are
+    scorers, with a small bonus for keeping previous picks that still
+    fit. Both are computed as arrays over all candidates at once. A result
+    is unsatisfied when no candidate passes the filters, or when nothing
+    in the message was understood; the caller can then spend one LLM call
+    on it.
+    """
+
+    def __init__(self, catalog=restaurant_catalog, catalog_candidates: int = 20):
+        self.catalog = catalog
+        self.catalog_candidates = catalog_candidates
+        self.refines = 0
+        self.unsatisfied = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+
+    def refine(self,
+               previous: List[Dict[str, Any]],
+               message: str,
+               limit: int = None,
+               history: List[Dict[str, Any]] = None) -> RefineResult:
+        """
+        Rank previous recommendations (dicts in the Restaurant shape) and catalog matches against the message.
+
+        Catalog candidates are catalog records marked with source="catalog";
+        previous ones are marked source="previous", and `history`
+        (restaurants shown earlier in the session, also in the Restaurant
+        shape) source="history".
+        """
+        started = time.perf_counter()
+        limit = limit or max(len(previous), 3)
+        known_cuisines = {c for c in self.catalog.cuisines if c} | {
+            (r.get("cuisineType") or "").lower() for r in previous if r.get("cuisineType")
+        }
+        constraints = parse_feedback(message, known_cuisines)
+
+        prices = sorted(p for p in (price_level(r.get("priceRange")) for r in previous) if p) or [2]
+        reference_price = prices[len(prices) // 2]
+        target_price = constraints.price_target or (
+            min(max(reference_price + constraints.price_direction, 1), 4) if constraints.price_direction else 0
+        )
+        wanted_text = without_negations(message)
+        candidates = self._candidates(previous, history or [], wanted_text, constraints, target_price)
+
+        # Per-candidate features, then every filter and scorer as one array operation
+        texts = [self._text(c) for c in candidates]
+        phrases = [f" {_phrase(text)} " for text in texts]
+        price = np.array([price_level(c.get("priceRange")) for c in candidates])
+        rating = np.array([float(c.get("rating") or 0) for c in candidates])
+        cuisine = [(c.get("cuisineType") or c.get("cuisine") or "").lower() for c in candidates]
+        excluded = np.array([
+            any(self._mentions(phrase, cuisine[i], term) for term in constraints.excluded)
+            for i, phrase in enumerate(phrases)
+        ], dtype=bool)
+        location_hit = np.array([
+            bool(constraints.location) and f" {constraints.location} " in f" {_phrase(self._place(c))} "
+            for c in candidates
+        ], dtype=float)
+        vibe_hit = np.array([
+            sum(self._has_vibe(phrase, vibe) for vibe in constraints.vibes) / len(constraints.vibes)
+            if constraints.vibes else 0.0
+            for phrase in phrases
+        ])
+        cuisine_hit = np.array([c in constraints.cuisines for c in cuisine], dtype=bool)
+        similarity = self._similarity(wanted_text, texts)
+        is_previous = np.array([c["source"] == "previous" for c in candidates], dtype=float)
+
+        hard = ~excluded
+        if target_price:
+            hard &= (price > 0) & ((price <= target_price) if constraints.price_direction <= 0 else (price >= target_price))
+        if constraints.cuisines:
+            hard &= cuisine_hit
+        satisfied = bool(hard.any()) and (constraints.understood() or bool((similarity >= MIN_SIMILARITY).any()))
+        eligible = hard if hard.any() else ~excluded
+        if not eligible.any():
+            eligible = np.ones(len(candidates), dtype=bool)
+
+        score = (2.0 * location_hit + 1.5 * vibe_hit + similarity + 0.5 * cuisine_hit + 0.3 * is_previous
+                 + (1.0 if constraints.better_rated else 0.2) * (rating - 4.0))
+        if constraints.price_target:
+            score -= 0.25 * np.abs(np.where(price > 0, price, reference_price) - target_price)
+        score[~eligible] = -np.inf
+
+        order = np.argsort(-score, kind="stable")[:min(limit, int(eligible.sum()))]
+        ranked = [
+            (candidates[i], self._reason(candidates[i], constraints, bool(hard[i]), location_hit[i], vibe_hit[i],
+                                         similarity[i], reference_price))
+            for i in order
+        ]
+
+        self.refines += 1
+        if not satisfied:
+            self.unsatisfied += 1
+        self.latency.observe(time.perf_counter() - started)
+        return RefineResult(ranked, constraints, satisfied)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "refines": self.refines,
+            "unsatisfied": self.unsatisfied,
+            "latency_seconds": self.latency.snapshot(),
+        }
+
+    def _candidates(self,
+                    previous: List[Dict[str, Any]],
+                    history: List[Dict[str, Any]],
+                    message: str,
+                    constraints: FeedbackConstraints,
+                    target_price: int) -> List[Dict[str, Any]]:
+        candidates = [{**r, "source": "previous"} for r in previous]
+        seen = {(r.get("name") or "").lower() for r in previous}
+        for restaurant in history:
+            if (restaurant.get("name") or "").lower() not in seen:
+                seen.add((restaurant.get("name") or "").lower())
+                candidates.append({**restaurant, "source": "history"})
+        location = constraints.location or next((r.get("location") for r in previous if r.get("location")), "")
+        query = {
+            "cuisines": constraints.cuisines,
+            "location": location,
+            "budget": "$" * target_price,
+            "vibe": " ".join(constraints.vibes),
+            "absoluteNogos": constraints.excluded,
+        }
+        for record in self.catalog.query(query, limit=self.catalog_candidates, text=message):
+            if record["name"].lower() not in seen:
+                seen.add(record["name"].lower())
+                candidates.append({**record, "source": "catalog"})
+        return candidates
+
+    def _similarity(self, message: str, texts: List[str]) -> np.ndarray:
+        embedder = self.catalog.embedder
+        indices, scores = top_k(embedder.embed(texts), embedder.embed([message]), len(texts))
+        similarity = np.zeros(len(texts))
+        similarity[indices[0]] = scores[0]
+        return similarity
+
+    @staticmethod
+    def _text(candidate: Dict[str, Any]) -> str:
+        return " ".join([
+            candidate.get("cuisineType") or candidate.get("cuisine") or "",
+            candidate.get("name") or "",
+            candidate.get("description") or "",
+            candidate.get("location") or "",
+            *(candidate.get("highlights") or []),
+            *(candidate.get("vibes") or []),
+        ])
+
+    @staticmethod
+    def _place(candidate: Dict[str, Any]) -> str:
+        return " ".join([candidate.get("location") or "", candidate.get("address") or candidate.get("fullAddress") or ""])
+
+    @staticmethod
+    def _mentions(phrase: str, cuisine: str, excluded: str) -> bool:
+        if excluded == _phrase(cuisine):
+            return True
+        return any(f" {_stem(alias)} " in phrase for alias in DISH_ALIASES.get(excluded, (excluded,)))
+
+    @staticmethod
+    def _has_vibe(phrase: str, vibe: str) -> bool:
+        return any(f" {_stem(word)} " in phrase for word in (vibe, *VIBE_KEYWORDS.get(vibe, ())))
+
+    @staticmethod
+    def _reason(candidate: Dict[str, Any],
+                constraints: FeedbackConstraints,
+                meets: bool,
+                location_hit: float,
+                vibe_hit: float,
+                similarity: float,
+                reference_price: int) -> str:
+        parts = []
+        price = candidate.get("priceRange") or ""
+        if constraints.price_direction < 0 and price and price_level(price) < reference_price:
+            parts.append(f"Cheaper at {price}")
+        elif constraints.price_direction > 0 and price and price_level(price) > reference_price:
+            parts.append(f"A step up at {price}")
+        elif constraints.price_target and price:
+            parts.append(f"Fits {'$' * constraints.price_target} at {price}")
+        if constraints.cuisines and meets:
+            parts.append(f"{(candidate.get('cuisineType') or candidate.get('cuisine') or '').title()} as you asked")
+        if location_hit:
+            parts.append(f"Near {constraints.location.title()}")
+        if vibe_hit:
+            parts.append(f"{' and '.join(constraints.vibes).capitalize()} vibe")
+        if constraints.excluded and meets:
+            parts.append(f"No {', '.join(constraints.excluded)}")
+        if constraints.better_rated:
+            parts.append(f"Rated {float(candidate.get('rating') or 0):.1f}")
+        if not meets:
+            return "; ".join(["Closest we have", *parts])
+        if not parts and similarity >= MIN_SIMILARITY:
+            parts.append("Closest match to your feedback")
+        return "; ".join(parts) or "Kept from your previous picks"
+
+# Create a singleton instance
+refine_engine = RefineEngine()
@@ -0,0 +1,371 @@
+import csv
+import json
+import logging
+import os
+import re
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from services import catalog_snapshot
+from services.restaurant_data import RESTAURANT_DATA
+from services.vector_index import HashedTfidf, SparseVectors, top_k
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'-]*")
+
+# Vibe keywords recognised in descriptions when a record has no explicit vibes
+VIBE_KEYWORDS = {
+    "romantic": ("romantic", "candlelit", "intimate", "date"),
+    "cozy": ("cozy", "cosy", "snug", "warm"),
+    "casual": ("casual", "laid-back", "relaxed", "neighborhood"),
+    "trendy": ("trendy", "hip", "stylish", "modern"),
+    "upscale": ("upscale", "elegant", "fine", "luxurious", "refined"),
+    "lively": ("lively", "vibrant", "bustling", "buzzing", "fun"),
+    "quiet": ("quiet", "calm", "peaceful", "minimalist"),
+    "outdoor": ("outdoor", "patio", "rooftop", "terrace", "garden", "waterfront"),
+}
+_VIBE_BY_WORD = {word: vibe for vibe, words in VIBE_KEYWORDS.items() for word in words}
+
+def tokens(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").lower())
+
+def price_level(price_range: str) -> int:
+    """"$$" -> 2; anything without dollar signs -> 0 (unknown)."""
+    return min((price_range or "").count("$"), 4)
+
+def _tag(value: str) -> str:
+    return (value or "").strip().lower().replace("_", "-").replace(" ", "-")
+
+def _as_list(value: Any) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(";") if part.strip()]
+    return [str(part) for part in value]
+
+def bitmap_mask(bitmap: int, size: int) -> np.ndarray:
+    """Boolean array with True at the set bits of a row bitmap."""
+    packed = np.frombuffer(bitmap.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(packed, bitorder="little")[:size].astype(bool)
+
+def _lowest_bits(bitmap: int, limit: int) -> List[int]:
+    """Positions of the `limit` lowest set bits, lowest first."""
+    rows = []
+    while bitmap and len(rows) < limit:
+        low = bitmap & -bitmap
+        rows.append(low.bit_length() - 1)
+        bitmap ^= low
+    return rows
+
+class CatalogData:
+    """
+    One immutable version of the catalog: column-wise rows, posting-list bitmaps and text vectors.
+
+    Rows are ordered by rating, best first. Columns are lists and arrays
+    when built in process, or views into a mapped snapshot file (see
+    services/catalog_snapshot.py); both index the same way. `vectors`
+    holds the hashed TF-IDF embedding of each row's cuisine, description
+    and highlights as sparse (bucket, weight) pairs, and `embedder` the idf
+    weights queries are embedded with.
+    """
+
+    STRING_COLUMNS = ("names", "descriptions", "locations", "image_urls", "websites", "addresses")
+    ARRAY_COLUMNS = {"cuisine_codes": "H", "prices": "B", "ratings": "f"}
+    FIELDS = ("cuisine", "price", "location", "dietary", "vibe")
+
+    def __init__(self):
+        self.size = 0
+        for name in self.STRING_COLUMNS:
+            setattr(self, name, [])
+        for name, typecode in self.ARRAY_COLUMNS.items():
+            setattr(self, name, array(typecode))
+        self.cuisines: List[str] = []
+        self.index: Dict[str, Dict[str, int]] = {field: {} for field in self.FIELDS}
+        self.all = 0
+        self.embedder = HashedTfidf()
+        self.vectors = SparseVectors.empty(self.embedder.dim)
+
+    def any(self, field: str, terms: List[str]) -> Optional[int]:
+        """OR of the terms' posting lists, or None if none of the terms is indexed."""
+        index = self.index[field]
+        bitmaps = [index[term] for term in terms if term in index]
+        if not bitmaps:
+            return None
+        result = 0
+        for bitmap in bitmaps:
+            result |= bitmap
+        return result
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """Materialize one row as a RESTAURANT_DATA-style dict."""
+        bit = 1 << row
+        return {
+            "name": self.names[row],
+            "description": self.descriptions[row],
+            "cuisine": self.cuisines[self.cuisine_codes[row]].title(),
+            "priceRange": "$" * self.prices[row],
+            "location": self.locations[row],
+            "rating": round(self.ratings[row], 1),
+            "imageUrl": self.image_urls[row],
+            "website": self.websites[row],
+            "fullAddress": self.addresses[row],
+            "dietaryTags": [tag for tag, bitmap in self.index["dietary"].items() if bitmap & bit],
+            "vibes": [vibe for vibe, bitmap in self.index["vibe"].items() if bitmap & bit],
+        }
+
+def build_catalog(records: Iterable[Dict[str, Any]]) -> CatalogData:
+    """Index records (dicts in the RESTAURANT_DATA shape, optionally with city, dietaryTags and vibes)."""
+    data = CatalogData()
+    ordered = sorted(records, key=lambda record: -float(record.get("rating") or 0))
+    interned: Dict[str, str] = {}
+    cuisine_codes: Dict[str, int] = {}
+    postings: Dict[str, Dict[str, List[int]]] = {field: {} for field in data.FIELDS}
+    texts: List[str] = []
+
+    def intern(value: Optional[str]) -> str:
+        value = value or ""
+        return interned.setdefault(value, value)
+
+    def post(field: str, term: str, row: int) -> None:
+        if term:
+            postings[field].setdefault(term, []).append(row)
+
+    for row, record in enumerate(ordered):
+        cuisine = (record.get("cuisine") or "").strip().lower()
+        if cuisine not in cuisine_codes:
+            cuisine_codes[cuisine] = len(data.cuisines)
+            data.cuisines.append(cuisine)
+        data.cuisine_codes.append(cuisine_codes[cuisine])
+        price = price_level(record.get("priceRange"))
+        data.prices.append(price)
+        data.ratings.append(float(record.get("rating") or 0))
+        data.names.append(record.get("name") or "")
+        data.descriptions.append(record.get("description") or "")
+        location = record.get("location") or record.get("neighborhood") or ""
+        data.locations.append(intern(location))
+        data.image_urls.append(intern(record.get("imageUrl")))
+        data.websites.append(intern(record.get("website")))
+        data.addresses.append(intern(record.get("fullAddress") or record.get("address")))
+
+        post("cuisine", cuisine, row)
+        if price:
+            post("price", str(price), row)
+        for word in set(tokens(location) + tokens(record.get("city"))):
+            post("location", word, row)
+        for tag in _as_list(record.get("dietaryTags")):
+            post("dietary", _tag(tag), row)
+        vibes = {vibe.lower() for vibe in _as_list(record.get("vibes"))}
+        if not vibes:
+            text = f"{record.get('description', '')} {' '.join(_as_list(record.get('highlights')))}"
+            vibes = {_VIBE_BY_WORD[word] for word in tokens(text) if word in _VIBE_BY_WORD}
+        for vibe in vibes:
+            post("vibe", vibe, row)
+        texts.append(f"{cuisine} {record.get('description') or ''} {' '.join(_as_list(record.get('highlights')))}")
+
+    # Posting lists become bitmaps: set bits straight from a byte buffer
+    for field, terms in postings.items():
+        for term, rows in terms.items():
+            bits = bytearray((len(ordered) + 7) // 8)
+            for row in rows:
+                bits[row >> 3] |= 1 << (row & 7)
+            data.index[field][term] = int.from_bytes(bits, "little")
+    data.size = len(ordered)
+    data.all = (1 << data.size) - 1
+    data.vectors = data.embedder.fit(texts)
+    return data
+
+def read_records(path: str) -> Iterable[Dict[str, Any]]:
+    """Records from a .json list, .jsonl or .csv (";"-separated list columns) file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        elif path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+class RestaurantCatalog:
+    """
+    In-memory restaurant catalog with inverted indexes for fallback recommendations.
+
+    Each indexed term (cuisine, price level, city/neighborhood word,
+    dietary tag, vibe) maps to a posting list held as a Python int bitmap,
+    bit i standing for row i, so a query is a few big-int ANDs and its
+    best-rated matches are the lowest set bits.
+
+    Loaded from RESTAURANT_CATALOG_PATH or, by default, from
+    RESTAURANT_DATA. The path may be a .json list, .jsonl or .csv, parsed
+    and indexed by every worker, or a snapshot built offline by
+    services/catalog_snapshot.py, which workers mmap and share. A snapshot
+    is checked for changes every RESTAURANT_CATALOG_RELOAD_SECONDS and
+    swapped in whole when it is replaced; queries already running finish
+    on the version they started with.
+    """
+
+    def __init__(self, reload_interval: float = None, text_candidates: int = None):
+        self.reload_interval = (reload_interval if reload_interval is not None
+                                else float(os.environ.get("RESTAURANT_CATALOG_RELOAD_SECONDS", 5)))
+        self.text_candidates = text_candidates or int(os.environ.get("RESTAURANT_CATALOG_TEXT_CANDIDATES", 2000))
+        self.source = None
+        self.snapshot = False
+        self.loaded = False
+        self.loaded_at = 0.0
+        self.reloads = 0
+        self.reload_failures = 0
+        self._data = CatalogData()
+        self._version = None
+        self._checked_at = 0.0
+
+    @property
+    def size(self) -> int:
+        return self._data.size
+
+    def load(self, path: str = None) -> "RestaurantCatalog":
+        """Load and index the catalog file (or RESTAURANT_DATA), replacing the current contents."""
+        path = path if path is not None else os.environ.get("RESTAURANT_CATALOG_PATH")
+        started = time.perf_counter()
+        if path:
+            version = self._file_version(path)
+            snapshot = catalog_snapshot.is_snapshot(path)
+            data = catalog_snapshot.read_snapshot(path, CatalogData()) if snapshot else build_catalog(read_records(path))
+        else:
+            version, snapshot = None, False
+            data = build_catalog(record for entries in RESTAURANT_DATA.values() for record in entries)
+        # One reference swap: a query holds whichever version it read first
+        self._data = data
+        self._version = version
+        self.snapshot = snapshot
+        self.source = path or "RESTAURANT_DATA"
+        self.loaded = True
+        self.loaded_at = time.time()
+        self._checked_at = time.monotonic()
+        logger.info(f"Restaurant catalog: {data.size} restaurants from {self.source} "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self
+
+    def maybe_reload(self) -> bool:
+        """Swap in the snapshot file if it was replaced since it was loaded; at most once per interval."""
+        if not self.snapshot or self.reload_interval <= 0:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return False
+        self._checked_at = now
+        version = self._file_version(self.source)
+        if version is None or version == self._version:
+            return False
+        try:
+            self.load(self.source)
+        except Exception as e:
+            # Keep serving the current version; the next check retries
+            self.reload_failures += 1
+            logger.error(f"Restaurant catalog reload from {self.source} failed: {e}")
+            return False
+        self.reloads += 1
+        return True
+
+    @property
+    def cuisines(self) -> List[str]:
+        """Lower-case cuisine names in the current catalog."""
+        return list(self._current().cuisines)
+
+    @property
+    def embedder(self) -> HashedTfidf:
+        """Embedder with the current catalog's idf weights, for scoring texts outside the catalog."""
+        return self._data.embedder
+
+    def query(self, preferences: Dict[str, Any], limit: int = 10, text: str = None) -> List[Dict[str, Any]]:
+        """
+        Best-rated restaurants matching the preferences, relaxing soft constraints if none match.
+
+        Cuisine, dietary restrictions and absolute no-gos are hard
+        constraints; returns [] if nothing satisfies them. Vibe, then
+        price, then location are dropped in that order until something
+        matches. Terms the catalog doesn't index don't constrain. With
+        `text` (e.g. a free-text vibe), the best-rated `text_candidates`
+        matches are ranked by similarity to it instead of by rating.
+        """
+        data = self._current()
+        bitmap = self._match(data, preferences)
+        if not bitmap:
+            return []
+        if text:
+            # Bounded cost on any catalog size: only the best-rated matches' vectors are read
+            rows = np.flatnonzero(bitmap_mask(bitmap, data.size))[:self.text_candidates]
+            indices, scores = top_k(data.vectors[rows], data.embedder.embed([text]), limit)
+            if scores.size and scores[0, 0] > 0:
+                return [data.record(int(row)) for row in rows[indices[0]]]
+        return [data.record(row) for row in _lowest_bits(bitmap, limit)]
+
+    def search(self, texts: List[str], limit: int = 10) -> List[List[Dict[str, Any]]]:
+        """Restaurants most similar to each text, scored as one batch; each record carries its similarity."""
+        data = self._current()
+        indices, scores = top_k(data.vectors, data.embedder.embed(texts), limit)
+        return [
+            [{**data.record(int(row)), "similarity": float(score)} for row, score in zip(rows, row_scores)]
+            for rows, row_scores in zip(indices, scores)
+        ]
+
+    def _current(self) -> CatalogData:
+        # Loaded on first use; an empty catalog file counts as loaded
+        if not self.loaded:
+            self.load()
+        self.maybe_reload()
+        return self._data
+
+    @staticmethod
+    def _match(data: CatalogData, preferences: Dict[str, Any]) -> int:
+        """Bitmap of rows meeting the hard constraints and as many soft ones as possible."""
+        hard = data.all
+        cuisine = data.any("cuisine", [c.lower() for c in preferences.get("cuisines") or [] if c])
+        if cuisine is not None:
+            hard &= cuisine
+        for restriction in preferences.get("dietaryRestrictions") or []:
+            hard &= data.index["dietary"].get(_tag(restriction), data.all)
+        for nogo in preferences.get("absoluteNogos") or []:
+            excluded = data.any("cuisine", [nogo.lower()] + tokens(nogo))
+            if excluded is not None:
+                hard &= ~excluded
+
+        soft = [
+            data.any("location", tokens(preferences.get("location"))),
+            data.any("price", [str(price_level(preferences.get("budget") or ""))]),
+            data.any("vibe", tokens(f"{preferences.get('vibe') or ''} {preferences.get('ambience') or ''}")),
+        ]
+        for kept in range(len(soft), -1, -1):
+            bitmap = hard
+            for constraint in soft[:kept]:
+                if constraint is not None:
+                    bitmap &= constraint
+            if bitmap:
+                return bitmap
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "restaurants": self._data.size,
+            "source": self.source,
+            "snapshot": self.snapshot,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "reload_failures": self.reload_failures,
+            "indexed_terms": {field: len(terms) for field, terms in self._data.index.items()},
+        }
+
+    @staticmethod
+    def _file_version(path: str) -> Optional[tuple]:
+        """Identity of the file currently at path; os.replace gives a new inode."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+# Create a singleton instance
+restaurant_catalog = RestaurantCatalog()
@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class Session:
+    """
+    Recommendation conversation state kept under a session id.
+
+    `recommendations` are the restaurants currently shown (Restaurant
+    dicts), `candidates` the ones shown earlier in the conversation, most
+    recent first, and `messages` the refine exchanges as chat messages.
+    """
+
+    __slots__ = ("id", "preferences", "recommendations", "candidates", "messages", "expires_at")
+
+    def __init__(self,
+                 session_id: str,
+                 preferences: Dict[str, Any],
+                 recommendations: List[Dict[str, Any]],
+                 candidates: List[Dict[str, Any]] = None,
+                 messages: List[Dict[str, str]] = None,
+                 expires_at: float = 0.0):
+        self.id = session_id
+        self.preferences = preferences
+        self.recommendations = recommendations
+        self.candidates = candidates or []
+        self.messages = messages or []
+        self.expires_at = expires_at
+
+    def user_messages(self) -> List[str]:
+        return [m["content"] for m in self.messages if m["role"] == "user"]
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "preferences": self.preferences,
+            "recommendations": self.recommendations,
+            "candidates": self.candidates,
+            "messages": self.messages,
+        })
+
+    @classmethod
+    def from_json(cls, session_id: str, value: str, expires_at: float) -> "Session":
+        data = json.loads(value)
+        return cls(session_id, data["preferences"], data["recommendations"],
+                   data["candidates"], data["messages"], expires_at)
+
+class SQLiteSessionBackend:
+    """
+    Shared session backend stored in a SQLite file.
+
+    Every gunicorn worker on the host opens the same file, so a session
+    created by one worker can be refined on any of them. The connection
+    is shared with the cache purge thread, hence the lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return Session.from_json(session_id, row[0], row[1])
+
+    def set(self, session: Session) -> None:
+        value = session.to_json()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, value, expires_at) VALUES (?, ?, ?)",
+                (session.id, value, session.expires_at),
+            )
+
+    def delete_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+class SessionStore:
+    """
+    Bounded in-process LRU of recommendation sessions with a sliding TTL.
+
+    /advise responses open a session; /restaurant/refine then only needs
+    the session id and the message instead of the full previous
+    recommendations, and can reuse restaurants shown earlier in the
+    conversation. With a shared backend (see SQLiteSessionBackend) every
+    change is written through and reads go to the backend first, since
+    another worker may have refined the session since; the local copy is
+    only used if the backend fails.
+    """
+
+    def __init__(self,
+                 max_sessions: int = None,
+                 ttl: float = None,
+                 max_candidates: int = None,
+                 max_messages: int = None,
+                 backend: Optional[SQLiteSessionBackend] = None):
+        self.max_sessions = max_sessions or int(os.environ.get("SESSION_MAX_ENTRIES", 10000))
+        self.ttl = ttl or float(os.environ.get("SESSION_TTL", 3600))
+        self.max_candidates = max_candidates or int(os.environ.get("SESSION_MAX_CANDIDATES", 30))
+        self.max_messages = max_messages or int(os.environ.get("SESSION_MAX_MESSAGES", 20))
+        self.backend = backend
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.backend_errors = 0
+        self.evictions = 0
+
+    def create(self, preferences: Dict[str, Any], recommendations: List[Dict[str, Any]]) -> Session:
+        session = Session(secrets.token_urlsafe(16), preferences, recommendations)
+        self.created += 1
+        self._save(session)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Return the live session, extending its TTL, or None if it is unknown or expired."""
+        now = time.time()
+        session = None
+        use_local = self.backend is None
+        if self.backend is not None:
+            try:
+                session = self.backend.get(session_id)
+            except Exception as e:
+                logger.warning(f"Shared session store read failed: {e}")
+                self.backend_errors += 1
+                use_local = True
+
+        if use_local:
+            session = self._sessions.get(session_id)
+            if session is not None and session.expires_at <= now:
+                del self._sessions[session_id]
+                self.evictions += 1
+                session = None
+
+        if session is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        session.expires_at = now + self.ttl
+        self._evict()
+        return session
+
+    def update(self,
+               session: Session,
+               recommendations: List[Dict[str, Any]],
+               message: str,
+               reply: str) -> None:
+        """Record a refine exchange: the new recommendations replace the shown ones, which become candidates."""
+        # Most recent first, one entry per restaurant, none that are being shown again
+        seen = {r.get("name") for r in recommendations}
+        candidates = []
+        for restaurant in session.recommendations + session.candidates:
+            if restaurant.get("name") not in seen:
+                seen.add(restaurant.get("name"))
+                candidates.append(restaurant)
+        session.candidates = candidates[:self.max_candidates]
+        session.recommendations = recommendations
+        session.messages = (session.messages + [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": reply},
+        ])[-self.max_messages:]
+        self._save(session)
+
+    def purge_expired(self) -> int:
+        """Delete expired sessions from the shared backend and return how many; a no-op without one."""
+        if self.backend is None:
+            return 0
+        return self.backend.delete_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "created": self.created,
+            "hits": self.hits,
+            "misses": self.misses,
+            "backend_errors": self.backend_errors,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "shared_backend": self.backend is not None,
+        }
+
+    def _save(self, session: Session) -> None:
+        session.expires_at = time.time() + self.ttl
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        self._evict()
+        if self.backend is not None:
+            try:
+                self.backend.set(session)
+            except Exception as e:
+                logger.warning(f"Shared session store write failed: {e}")
+                self.backend_errors += 1
+
+    def _evict(self) -> None:
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+def _create_backend() -> Optional[SQLiteSessionBackend]:
+    path = os.environ.get("SESSION_SHARED_PATH")
+    if not path:
+        return None
+    try:
+        backend = SQLiteSessionBackend(path)
+        logger.info(f"Shared session store enabled at {path}")
+        return backend
+    except Exception as e:
+        logger.error(f"Failed to open shared session store at {path}: {e}")
+        return None
+
+# Create a singleton instance
+session_store = SessionStore(backend=_create_backend())
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one upstream call.
+
+    The first caller for a key starts the call; later callers with the same
+    key await its result instead of starting their own. At most `max_waiters`
+    callers attach to one flight, and a waiter that has waited `wait_timeout`
+    seconds gives up and makes its own call.
+    """
+
+    def __init__(self, max_waiters: int = 100, wait_timeout: float = 30.0):
+        self.max_waiters = max_waiters
+        self.wait_timeout = wait_timeout
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.waiter_timeouts = 0
+        self.waiter_overflows = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn() once per key among concurrent callers and share its result.
+
+        Args:
+            key: Canonical key identifying equivalent calls
+            fn: Zero-argument coroutine factory making the upstream call
+
+        Returns:
+            The result of fn(), possibly produced for another caller
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            return await self._lead(key, fn)
+
+        if flight.waiters >= self.max_waiters:
+            self.waiter_overflows += 1
+            return await fn()
+
+        flight.waiters += 1
+        self.coalesced += 1
+        try:
+            # shield: a waiter timing out or disconnecting must not cancel the shared call
+            return await asyncio.wait_for(asyncio.shield(flight.task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self.waiter_timeouts += 1
+            logger.warning(f"Coalesced call waited over {self.wait_timeout}s, calling upstream directly")
+            return await fn()
+
+    async def _lead(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.leaders += 1
+        # Run as a task so the call survives if the leading request goes away
+        task = asyncio.ensure_future(fn())
+        self._flights[key] = _Flight(task)
+        task.add_done_callback(lambda _: self._flights.pop(key, None))
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "waiter_timeouts": self.waiter_timeouts,
+            "waiter_overflows": self.waiter_overflows,
+        }
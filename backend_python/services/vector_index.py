@@ -0,0 +1,179 @@
+import math
+import os
+import re
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9'-]*")
+# Rows densified at a time when scoring a batch of queries against sparse vectors
+_SCORE_CHUNK_ROWS = 8192
+
+class SparseVectors:
+    """
+    Row vectors stored as (bucket, weight) pairs, CSR style: row i's pairs
+    are indices[indptr[i]:indptr[i + 1]] and values[...].
+
+    A restaurant's text touches a few dozen of the `dim` buckets, so this
+    takes a small fraction of a dense float32 matrix. Scoring gathers the
+    query weights of each pair for a single query, and densifies a chunk
+    of rows at a time into one matrix product for a batch. The arrays may
+    be views into a mapped snapshot.
+    """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, values: np.ndarray, dim: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.dim = dim
+
+    @classmethod
+    def empty(cls, dim: int) -> "SparseVectors":
+        return cls(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.float32), dim)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __getitem__(self, rows: np.ndarray) -> "SparseVectors":
+        """The given rows, in that order, as new SparseVectors."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows].astype(np.int64)
+        lengths = self.indptr[rows + 1].astype(np.int64) - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseVectors(indptr, self.indices[positions], self.values[positions], self.dim)
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Dot products of each query with each row, shape (queries, rows)."""
+        rows = len(self)
+        if len(queries) == 1:
+            products = queries[0, self.indices] * self.values
+            lengths = np.diff(self.indptr)
+            scores = np.zeros(rows, dtype=np.float32)
+            present = lengths > 0
+            if products.size:
+                # reduceat sums each non-empty row's pairs; empty rows stay 0
+                scores[present] = np.add.reduceat(products, self.indptr[:-1][present])
+            return scores[np.newaxis, :]
+
+        scores = np.empty((len(queries), rows), dtype=np.float32)
+        dense = np.zeros((min(rows, _SCORE_CHUNK_ROWS), self.dim), dtype=np.float32)
+        for start in range(0, rows, _SCORE_CHUNK_ROWS):
+            end = min(start + _SCORE_CHUNK_ROWS, rows)
+            chunk = dense[:end - start]
+            chunk.fill(0)
+            low, high = self.indptr[start], self.indptr[end]
+            chunk_rows = np.repeat(np.arange(end - start), np.diff(self.indptr[start:end + 1]))
+            chunk[chunk_rows, self.indices[low:high]] = self.values[low:high]
+            np.matmul(queries, chunk.T, out=scores[:, start:end])
+        return scores
+
+class HashedTfidf:
+    """
+    Deterministic local text embedding: hashed words weighted by TF-IDF.
+
+    Words are hashed with crc32 (identical in every process, unlike
+    hash()) into `dim` buckets. Buckets are unsigned: with texts this short
+    a signed hash too often cancels the one word a query shares with a
+    restaurant. Term frequency is sublinear, document frequency is counted
+    per bucket over the fitted corpus, and vectors are L2-normalized, so a
+    dot product is a cosine similarity. Needs no vocabulary file and no
+    network. Buckets are hashed on every call rather than cached per word,
+    since query texts (e.g. refine feedback) bring an unbounded vocabulary.
+    """
+
+    def __init__(self, dim: int = None, idf: np.ndarray = None):
+        self.dim = dim or int(os.environ.get("VECTOR_INDEX_DIM", 256))
+        self.idf = idf if idf is not None else np.ones(self.dim, dtype=np.float32)
+
+    def fit(self, texts: Sequence[str]) -> SparseVectors:
+        """Learn the idf weights from texts and return their embeddings, one sparse row per text."""
+        indptr = np.zeros(len(texts) + 1, dtype=np.int64)
+        cols, values = array("H" if self.dim <= 2**16 else "I"), array("f")
+        for row, text in enumerate(texts):
+            weights = self._weights(text)
+            cols.extend(weights.keys())
+            values.extend(weights.values())
+            indptr[row + 1] = len(cols)
+        cols = np.frombuffer(cols, dtype=np.dtype(cols.typecode)) if cols else np.zeros(0, dtype=np.uint16)
+        values = np.frombuffer(values, dtype=np.float32).copy() if values else np.zeros(0, dtype=np.float32)
+        document_frequency = np.bincount(cols, minlength=self.dim)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        values *= self.idf[cols]
+        rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(texts))).astype(np.float32)
+        values /= norms[rows]
+        return SparseVectors(indptr, cols, values, self.dim)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """Embeddings of texts with the fitted idf, shape (len(texts), dim)."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            weights = self._weights(text)
+            matrix[row, list(weights.keys())] = list(weights.values())
+        return self._normalize(matrix * self.idf)
+
+    def _weights(self, text: str) -> Dict[int, float]:
+        weights: Dict[int, float] = {}
+        for word, count in Counter(_WORD.findall((text or "").lower())).items():
+            bucket = zlib.crc32(word.encode("utf-8")) % self.dim
+            weights[bucket] = weights.get(bucket, 0.0) + 1 + math.log(count)
+        return weights
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+def top_k(matrix: Union[np.ndarray, SparseVectors],
+          queries: np.ndarray,
+          k: int,
+          mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rows of `matrix` most similar to each query, in one matrix product.
+
+    Args:
+        matrix: Row embeddings, shape (rows, dim), dense or SparseVectors
+        queries: Query embeddings, shape (queries, dim)
+        k: Results per query
+        mask: Optional boolean array over rows; only rows where it is True are scored
+
+    Returns:
+        Tuple of (row indices, scores), each of shape (queries, min(k, eligible rows)),
+        best first
+    """
+    if mask is not None:
+        # Score just the eligible rows: a selective mask saves most of the product
+        rows = np.flatnonzero(mask)
+        indices, scores = top_k(matrix[rows], queries, k)
+        return rows[indices], scores
+    scores = matrix.scores(queries) if isinstance(matrix, SparseVectors) else queries @ matrix.T
+    k = min(k, scores.shape[1])
+    if k == 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.int64), empty
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), (len(queries), k))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    # Best score first; equal scores keep row order (rows are sorted best-rated first)
+    order = np.lexsort((candidates, -candidate_scores))
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(candidate_scores, order, axis=1)
+
+def rank(query: str, texts: List[str], embedder: HashedTfidf = None) -> List[Tuple[int, float]]:
+    """(position, similarity) of every text, most similar to query first."""
+    if not texts:
+        return []
+    embedder = embedder or HashedTfidf()
+    indices, scores = top_k(embedder.embed(texts), embedder.embed([query]), len(texts))
+    return [(int(i), float(s)) for i, s in zip(indices[0], scores[0])]
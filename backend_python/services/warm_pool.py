@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services.llm_governor import PRIORITY_BACKGROUND
+from services.openai_service import llm_available, llm_calls_in_flight, request_recommendations
+from services.recommendation_cache import preferences_key
+
+logger = logging.getLogger(__name__)
+
+class _PoolEntry:
+    __slots__ = ("restaurants", "generated_at")
+
+    def __init__(self):
+        self.restaurants: Deque[Dict[str, Any]] = deque()
+        self.generated_at = 0.0
+
+class WarmPool:
+    """
+    Pre-generated recommendations for the most requested preference combinations.
+
+    /advise reports every request through record(). A background task ranks
+    combinations by an exponentially decayed request count and, while the
+    LLM is otherwise idle, pre-generates recommendations for the hottest
+    ones through a queue limited to `llm_calls_per_minute`. get() is a dict
+    lookup, so a pooled combination never waits on the LLM.
+    """
+
+    def __init__(self,
+                 size: int = None,
+                 variants: int = None,
+                 refresh_seconds: float = None,
+                 llm_calls_per_minute: float = None,
+                 min_score: float = None):
+        self.size = size if size is not None else int(os.environ.get("WARM_POOL_SIZE", 200))
+        self.variants = variants or int(os.environ.get("WARM_POOL_VARIANTS", 3))
+        self.refresh_seconds = refresh_seconds or float(os.environ.get("WARM_POOL_REFRESH_SECONDS", 1800))
+        self.llm_calls_per_minute = llm_calls_per_minute or float(os.environ.get("WARM_POOL_LLM_CALLS_PER_MINUTE", 6))
+        self.min_score = min_score or float(os.environ.get("WARM_POOL_MIN_SCORE", 3))
+        self.half_life = float(os.environ.get("WARM_POOL_HALF_LIFE_SECONDS", 3600))
+        self.tick_seconds = float(os.environ.get("WARM_POOL_TICK_SECONDS", 5))
+        # Only generate when no more than this many user LLM calls are running
+        self.idle_max_in_flight = int(os.environ.get("WARM_POOL_IDLE_MAX_IN_FLIGHT", 0))
+
+        # key -> (decayed score, last update time, preferences)
+        self._frequencies: Dict[str, Tuple[float, float, Dict[str, Any]]] = {}
+        self._max_tracked = max(self.size * 20, 1000)
+        self._pool: Dict[str, _PoolEntry] = {}
+        self._queue: "asyncio.Queue[str]" = None
+        self._queued = set()
+        self._tasks: List[asyncio.Task] = []
+        self._budget = 1.0
+        self._budget_updated = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failed = 0
+
+    def record(self, preferences: Dict[str, Any]) -> None:
+        """Count one request for these preferences."""
+        if self.size <= 0:
+            return
+        key = preferences_key(preferences)
+        now = time.time()
+        score, updated, _ = self._frequencies.get(key, (0.0, now, None))
+        self._frequencies[key] = (self._decay(score, now - updated) + 1.0, now, dict(preferences))
+
+        if len(self._frequencies) > self._max_tracked:
+            self._prune(now)
+
+    def get(self, preferences: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return a pooled recommendation for these preferences, rotating through its variants."""
+        entry = self._pool.get(preferences_key(preferences))
+        if entry is None or not entry.restaurants:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry.restaurants.rotate(-1)
+        return dict(entry.restaurants[-1])
+
+    def start(self) -> None:
+        """Start the scheduler and generation worker on the running event loop."""
+        if self.size <= 0 or not llm_available():
+            logger.info("Warm pool disabled (WARM_POOL_SIZE=0 or Azure OpenAI not configured)")
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._schedule_loop()),
+            asyncio.create_task(self._generate_loop()),
+        ]
+        logger.info(f"Warm pool started: size={self.size}, {self.llm_calls_per_minute} LLM calls/min")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        ages = [now - entry.generated_at for entry in self._pool.values() if entry.restaurants]
+        lookups = self.hits + self.misses
+        return {
+            "enabled": bool(self._tasks),
+            "pooled_combinations": len(ages),
+            "tracked_combinations": len(self._frequencies),
+            "queued": len(self._queued),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "generated": self.generated,
+            "failed": self.failed,
+            "mean_age_seconds": sum(ages) / len(ages) if ages else 0.0,
+            "max_age_seconds": max(ages) if ages else 0.0,
+            "stale_combinations": sum(1 for age in ages if age > self.refresh_seconds),
+        }
+
+    def hot_keys(self) -> List[str]:
+        """Keys of the `size` most requested combinations above the minimum score."""
+        now = time.time()
+        scored = [
+            (self._decay(score, now - updated), key)
+            for key, (score, updated, _) in self._frequencies.items()
+        ]
+        scored = [item for item in scored if item[0] >= self.min_score]
+        scored.sort(reverse=True)
+        return [key for _, key in scored[:self.size]]
+
+    async def _schedule_loop(self) -> None:
+        while True:
+            try:
+                self._schedule()
+            except Exception:
+                logger.exception("Warm pool scheduling failed")
+            await asyncio.sleep(self.tick_seconds)
+
+    def _schedule(self) -> None:
+        hot = self.hot_keys()
+        hot_set = set(hot)
+        # Combinations that cooled down leave the pool
+        for key in [key for key in self._pool if key not in hot_set]:
+            del self._pool[key]
+
+        now = time.time()
+        for key in hot:
+            entry = self._pool.get(key)
+            needs_refresh = entry is None or now - entry.generated_at > self.refresh_seconds
+            if needs_refresh and key not in self._queued:
+                self._queued.add(key)
+                self._queue.put_nowait(key)
+
+    async def _generate_loop(self) -> None:
+        while True:
+            key = await self._queue.get()
+            try:
+                await self._wait_for_budget()
+                while llm_calls_in_flight() > self.idle_max_in_flight:
+                    await asyncio.sleep(self.tick_seconds / 5)
+
+                frequency = self._frequencies.get(key)
+                if frequency is None:
+                    continue
+                restaurants = await request_recommendations(frequency[2], self.variants, PRIORITY_BACKGROUND)
+                if not restaurants:
+                    self.failed += 1
+                    continue
+
+                entry = self._pool.setdefault(key, _PoolEntry())
+                entry.restaurants = deque(restaurants[:self.variants])
+                entry.generated_at = time.time()
+                self.generated += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception("Warm pool generation failed")
+            finally:
+                self._queued.discard(key)
+
+    async def _wait_for_budget(self) -> None:
+        """Token bucket allowing llm_calls_per_minute, with a burst of one call."""
+        rate = self.llm_calls_per_minute / 60.0
+        while True:
+            now = time.monotonic()
+            self._budget = min(1.0, self._budget + (now - self._budget_updated) * rate)
+            self._budget_updated = now
+            if self._budget >= 1.0:
+                self._budget -= 1.0
+                return
+            await asyncio.sleep((1.0 - self._budget) / rate)
+
+    def _decay(self, score: float, elapsed: float) -> float:
+        return score * 0.5 ** (elapsed / self.half_life)
+
+    def _prune(self, now: float) -> None:
+        # Drop the coldest half of the tracked combinations
+        ranked = sorted(
+            self._frequencies.items(),
+            key=lambda item: self._decay(item[1][0], now - item[1][1]),
+        )
+        for key, _ in ranked[:len(ranked) // 2]:
+            if key not in self._pool:
+                del self._frequencies[key]
+
+# Create a singleton instance
+warm_pool = WarmPool()
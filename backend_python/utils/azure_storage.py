@@ -1,8 +1,10 @@
 import os
 import logging
-from typing import Optional
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
-from azure.core.exceptions import ResourceExistsError
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from azure.storage.blob import BlobBlock, BlobProperties, BlobServiceClient, BlobClient, ContainerClient, ContentSettings
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +18,12 @@ class AzureStorageUtils:
         
         if self.connection_string:
             try:
-                self.blob_service_client = BlobServiceClient.from_connection_string(self.connection_string)
+                # Downloads are fetched in 4 MB pieces, so a streamed response never holds a whole large blob
+                self.blob_service_client = BlobServiceClient.from_connection_string(
+                    self.connection_string,
+                    max_single_get_size=4 * 1024 * 1024,
+                    max_chunk_get_size=4 * 1024 * 1024
+                )
                 self.initialized = True
                 # Ensure container exists
                 self._ensure_container()
@@ -41,13 +48,19 @@ class AzureStorageUtils:
         except Exception as e:
             logger.error(f"Error creating container: {e}")
     
-    def upload_image(self, image_data: bytes, blob_name: str) -> Optional[str]:
+    def upload_image(self,
+                     image_data: bytes,
+                     blob_name: str,
+                     content_type: Optional[str] = None,
+                     metadata: Optional[Dict[str, str]] = None) -> Optional[str]:
         """
         Upload an image to Azure Blob Storage
         
         Args:
             image_data: Image content as bytes
             blob_name: Name for the blob (filename)
+            content_type: Optional Content-Type to serve the blob with
+            metadata: Optional blob metadata
             
         Returns:
             URL to the uploaded blob or None if upload fails
@@ -64,7 +77,12 @@ class AzureStorageUtils:
             )
             
             # Upload the image
-            blob_client.upload_blob(image_data, overwrite=True)
+            blob_client.upload_blob(
+                image_data,
+                overwrite=True,
+                content_settings=ContentSettings(content_type=content_type) if content_type else None,
+                metadata=metadata
+            )
             
             # Return the URL to the blob
             return blob_client.url
@@ -72,6 +90,58 @@ class AzureStorageUtils:
             logger.error(f"Error uploading image to Azure Blob Storage: {e}")
             return None
     
+    def stage_block(self, blob_name: str, block_id: str, data: bytes) -> None:
+        """
+        Upload one block of a blob without committing it
+
+        Blocks become the blob's content once commit_blocks() lists them;
+        uncommitted blocks are discarded by the service after a week.
+
+        Args:
+            blob_name: Name for the blob (filename)
+            block_id: Base64 block ID, the same length for every block of the blob
+            data: Block content
+
+        Raises:
+            Exception from the Azure SDK if the upload fails
+        """
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=blob_name
+        )
+        blob_client.stage_block(block_id, data)
+
+    def commit_blocks(self,
+                      blob_name: str,
+                      block_ids: List[str],
+                      content_type: Optional[str] = None,
+                      metadata: Optional[Dict[str, str]] = None) -> str:
+        """
+        Commit staged blocks, in order, as the content of a blob
+
+        Args:
+            blob_name: Name of the blob the blocks were staged for
+            block_ids: IDs of the staged blocks in content order
+            content_type: Content-Type to serve the blob with
+            metadata: Optional blob metadata
+
+        Returns:
+            URL to the committed blob
+
+        Raises:
+            Exception from the Azure SDK if the commit fails
+        """
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=blob_name
+        )
+        blob_client.commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids],
+            content_settings=ContentSettings(content_type=content_type),
+            metadata=metadata
+        )
+        return blob_client.url
+
     def download_image(self, blob_name: str) -> Optional[bytes]:
         """
         Download an image from Azure Blob Storage
@@ -100,12 +170,93 @@ class AzureStorageUtils:
             logger.error(f"Error downloading image from Azure Blob Storage: {e}")
             return None
     
-    def delete_image(self, blob_name: str) -> bool:
+    def get_image_properties(self, blob_name: str) -> Optional[BlobProperties]:
+        """
+        Get the properties of an image blob without downloading it
+
+        Args:
+            blob_name: Name of the blob
+
+        Returns:
+            Blob properties (size, etag, last_modified, content_settings,
+            metadata) or None if the blob doesn't exist or the request fails
+        """
+        if not self.initialized:
+            return None
+
+        try:
+            blob_client = self.blob_service_client.get_blob_client(
+                container=self.container_name,
+                blob=blob_name
+            )
+            return blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error getting image properties from Azure Blob Storage: {e}")
+            return None
+
+    def download_image_chunks(self,
+                              blob_name: str,
+                              offset: int,
+                              length: int,
+                              etag: Optional[str] = None) -> Iterator[bytes]:
+        """
+        Download a byte range of an image blob as an iterator of chunks
+
+        Each chunk is fetched from the service as the iterator advances.
+
+        Args:
+            blob_name: Name of the blob
+            offset: First byte to download
+            length: Number of bytes to download
+            etag: If given, fail instead of returning content of a blob that changed since
+
+        Returns:
+            Iterator over the content, at most 4 MB per chunk
+
+        Raises:
+            Exception from the Azure SDK if the download fails
+        """
+        blob_client = self.blob_service_client.get_blob_client(
+            container=self.container_name,
+            blob=blob_name
+        )
+        downloader = blob_client.download_blob(
+            offset=offset,
+            length=length,
+            etag=etag,
+            match_condition=MatchConditions.IfNotModified if etag else None
+        )
+        return downloader.chunks()
+
+    def list_image_properties(self, prefix: str = None) -> Iterator[BlobProperties]:
+        """
+        List the blobs in the container without downloading them
+
+        Args:
+            prefix: Only list blobs whose name starts with it
+
+        Returns:
+            Iterator over blob properties (name, size, last_modified, ...),
+            fetched page by page; empty if the listing fails
+        """
+        if not self.initialized:
+            return
+
+        try:
+            container_client = self.blob_service_client.get_container_client(self.container_name)
+            yield from container_client.list_blobs(name_starts_with=prefix)
+        except Exception as e:
+            logger.error(f"Error listing images in Azure Blob Storage: {e}")
+
+    def delete_image(self, blob_name: str, if_unmodified_since: Optional[datetime] = None) -> bool:
         """
         Delete an image from Azure Blob Storage
         
         Args:
             blob_name: Name of the blob to delete
+            if_unmodified_since: If given, keep the blob if it was written after this time
             
         Returns:
             True if successful, False otherwise
@@ -122,7 +273,7 @@ class AzureStorageUtils:
             )
             
             # Delete the blob
-            blob_client.delete_blob()
+            blob_client.delete_blob(if_unmodified_since=if_unmodified_since)
             return True
         except Exception as e:
             logger.error(f"Error deleting image from Azure Blob Storage: {e}")
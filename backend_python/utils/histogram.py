@@ -0,0 +1,45 @@
+from bisect import bisect_left
+from typing import Any, Dict, Sequence
+
+# Seconds; suits queue waits and upstream call latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """
+    Fixed-bucket histogram for /metrics, in the Prometheus layout.
+
+    observe() is a bisect and an increment, so it is cheap enough for every
+    request. snapshot() returns cumulative counts per upper bound.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the largest bound if it overflows)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self._counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative = {}
+        seen = 0
+        for bound, count in zip(self.buckets, self._counts):
+            seen += count
+            cumulative[f"{bound:g}"] = seen
+        cumulative["+Inf"] = self.count
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401 - only needed to enable HTTP/2 in httpx
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Per-upstream defaults; override with HTTP_TIMEOUT_<NAME> / HTTP_RETRIES_<NAME>
+UPSTREAM_DEFAULTS = {
+    "default": {"timeout": 10.0, "retries": 1},
+    "bing": {"timeout": 5.0, "retries": 2},
+    "image_probe": {"timeout": 2.0, "retries": 0},
+}
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+class _UpstreamStats:
+    __slots__ = ("requests", "retries", "errors", "new_connections", "in_flight", "peak_in_flight")
+
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+class OutboundHttp:
+    """
+    Application-scoped pooled HTTP clients for calls to upstream services.
+
+    Each upstream (Bing, image probing, ...) gets its own httpx.AsyncClient,
+    so its keep-alive pools and limits are isolated from the others, and
+    connections are reused across requests instead of being set up per call.
+    HTTP/2 is used when the h2 package is installed. Clients are created in
+    the FastAPI lifespan via start() and closed by close().
+    """
+
+    def __init__(self):
+        self.max_connections = int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", 100))
+        self.max_keepalive = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", 20))
+        self.keepalive_expiry = float(os.environ.get("HTTP_POOL_KEEPALIVE_EXPIRY", 30))
+        self.http2 = HTTP2_AVAILABLE and os.environ.get("HTTP_ENABLE_HTTP2", "1") != "0"
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, _UpstreamStats] = {}
+
+    def upstream_config(self, upstream: str) -> Dict[str, Any]:
+        defaults = UPSTREAM_DEFAULTS.get(upstream, UPSTREAM_DEFAULTS["default"])
+        suffix = upstream.upper()
+        return {
+            "timeout": float(os.environ.get(f"HTTP_TIMEOUT_{suffix}", defaults["timeout"])),
+            "retries": int(os.environ.get(f"HTTP_RETRIES_{suffix}", defaults["retries"])),
+        }
+
+    async def start(self) -> None:
+        for upstream in UPSTREAM_DEFAULTS:
+            self._client(upstream)
+        logger.info(f"Outbound HTTP pools ready (max {self.max_connections} connections per upstream, http2={self.http2})")
+
+    async def close(self) -> None:
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
+
+    async def request(self, upstream: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request through the upstream's pooled client.
+
+        Transport errors and 502/503/504 responses are retried with a short
+        exponential backoff, up to the upstream's retry count. Other responses
+        are returned as-is; the last transport error is raised.
+        """
+        config = self.upstream_config(upstream)
+        client = self._client(upstream)
+        stats = self._stats[upstream]
+        kwargs.setdefault("timeout", config["timeout"])
+        extensions = dict(kwargs.pop("extensions", None) or {})
+        extensions["trace"] = self._tracer(stats)
+
+        attempt = 0
+        while True:
+            stats.requests += 1
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+            try:
+                response = await client.request(method, url, extensions=extensions, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= config["retries"]:
+                    return response
+            except httpx.TransportError:
+                stats.errors += 1
+                if attempt >= config["retries"]:
+                    raise
+            finally:
+                stats.in_flight -= 1
+
+            attempt += 1
+            stats.retries += 1
+            await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+
+    def stats(self) -> Dict[str, Any]:
+        result = {}
+        for upstream, stats in self._stats.items():
+            result[upstream] = {
+                "requests": stats.requests,
+                "retries": stats.retries,
+                "errors": stats.errors,
+                "new_connections": stats.new_connections,
+                "connection_reuse_rate": 1 - stats.new_connections / stats.requests if stats.requests else 0.0,
+                "in_flight": stats.in_flight,
+                "peak_in_flight": stats.peak_in_flight,
+                "pool_saturation": stats.in_flight / self.max_connections,
+                "peak_pool_saturation": stats.peak_in_flight / self.max_connections,
+            }
+        return result
+
+    def _client(self, upstream: str) -> httpx.AsyncClient:
+        client = self._clients.get(upstream)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=self.upstream_config(upstream)["timeout"],
+            )
+            self._clients[upstream] = client
+            self._stats.setdefault(upstream, _UpstreamStats())
+        return client
+
+    @staticmethod
+    def _tracer(stats: _UpstreamStats):
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            # httpcore only opens a TCP connection when none in the pool can be reused
+            if event_name == "connection.connect_tcp.complete":
+                stats.new_connections += 1
+        return trace
+
+# Create a singleton instance
+outbound_http = OutboundHttp()
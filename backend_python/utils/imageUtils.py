@@ -4,8 +4,11 @@ import time
 import logging
 import uuid
 from typing import List, Optional
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceExistsError
+from services.image_cache import image_cache
+from services.image_store import image_store
+from utils.azure_storage import azure_storage
 
 logger = logging.getLogger(__name__)
 
@@ -73,32 +76,10 @@ def save_base64_image(base64_string: str, filename_prefix: str = "image") -> Opt
         unique_id = str(uuid.uuid4()).replace("-", "")[:8]
         filename = f"{filename_prefix}_{timestamp}_{unique_id}.jpg"
         
-        # Try to save to Azure Blob Storage
-        blob_service_client = get_blob_service_client()
-        if blob_service_client and ensure_container_exists(blob_service_client):
-            # Save to Azure Blob Storage
-            blob_client = blob_service_client.get_blob_client(
-                container=CONTAINER_NAME, 
-                blob=filename
-            )
-            
-            # Upload with content settings for MIME type
-            blob_client.upload_blob(
-                image_data,
-                content_settings=ContentSettings(content_type="image/jpeg")
-            )
-            
-            # Return the blob URL
-            return blob_client.url
-        
-        # Fallback to local storage
-        logger.info(f"Using local storage for image {filename}")
-        local_path = os.path.join(LOCAL_IMAGE_DIR, filename)
-        with open(local_path, "wb") as f:
-            f.write(image_data)
-        
-        # Return local path that can be accessed via static file serving
-        return f"/static/images/{filename}"
+        # Stored once per content (Azure Blob Storage, or data/content locally);
+        # the same photo saved again only adds the new name
+        image = image_store.save_bytes(filename, image_data, "image/jpeg")
+        return image_store.url(image)
         
     except Exception as e:
         logger.error(f"Error saving image: {str(e)}")
@@ -108,46 +89,36 @@ def delete_image(image_url: str) -> bool:
     """
     Delete an image from Azure Blob Storage or local filesystem
     
+    Only the image's name is removed from the image store; its content is
+    deleted by the image GC once no other name refers to it.
+    
     Args:
-        image_url: URL of the image to delete
+        image_url: URL of the image to delete, as returned by save_base64_image
         
     Returns:
         True if deletion was successful, False otherwise
     """
     try:
-        # Check if this is an Azure Blob Storage URL
-        if AZURE_STORAGE_CONNECTION_STRING and "blob.core.windows.net" in image_url:
-            # Extract the blob name from the URL
-            blob_name = image_url.split(f"{CONTAINER_NAME}/")[-1]
-            if "?" in blob_name:  # Handle SAS token
-                blob_name = blob_name.split("?")[0]
-                
-            # Delete from Azure Blob Storage
-            blob_service_client = get_blob_service_client()
-            if blob_service_client:
-                blob_client = blob_service_client.get_blob_client(
-                    container=CONTAINER_NAME, 
-                    blob=blob_name
-                )
-                blob_client.delete_blob()
-                logger.info(f"Deleted blob: {blob_name}")
-                return True
-                
-        # Handle local file
-        elif image_url.startswith("/static/images/"):
-            filename = image_url.split("/")[-1]
-            local_path = os.path.join(LOCAL_IMAGE_DIR, filename)
-            if os.path.exists(local_path):
-                os.remove(local_path)
-                logger.info(f"Deleted local file: {local_path}")
-                return True
-                
-        logger.warning(f"Could not determine how to delete image: {image_url}")
-        return False
+        name = image_store.name_for_url(image_url)
+        if name is None:
+            logger.warning(f"Could not determine how to delete image: {image_url}")
+            return False
+        
+        if image_store.release(name):
+            logger.info(f"Deleted image: {name}")
+        # Stored per name before the image store: not shared, so deleted directly
+        elif os.path.exists(os.path.join(LOCAL_IMAGE_DIR, name)):
+            local_path = os.path.join(LOCAL_IMAGE_DIR, name)
+            os.remove(local_path)
+            logger.info(f"Deleted local file: {local_path}")
+        elif azure_storage.initialized and azure_storage.delete_image(name):
+            logger.info(f"Deleted blob: {name}")
+        else:
+            logger.warning(f"Image not found: {image_url}")
+            return False
+        image_cache.invalidate(name)
+        return True
         
-    except ResourceNotFoundError:
-        logger.warning(f"Image not found: {image_url}")
-        return False
     except Exception as e:
         logger.error(f"Error deleting image: {str(e)}")
         return False
@@ -156,6 +127,9 @@ def list_images(max_results: int = 100) -> List[str]:
     """
     List images in Azure Blob Storage or local filesystem
     
+    Images in the image store come first, then images stored per name
+    before it.
+    
     Args:
         max_results: Maximum number of results to return
         
@@ -165,26 +139,26 @@ def list_images(max_results: int = 100) -> List[str]:
     result = []
     
     try:
-        # Try Azure Blob Storage
-        blob_service_client = get_blob_service_client()
-        if blob_service_client and ensure_container_exists(blob_service_client):
-            container_client = blob_service_client.get_container_client(CONTAINER_NAME)
-            blobs = container_client.list_blobs(max_results=max_results)
-            
-            for blob in blobs:
-                blob_client = blob_service_client.get_blob_client(
-                    container=CONTAINER_NAME, 
-                    blob=blob.name
-                )
-                result.append(blob_client.url)
+        images = image_store.names(max_results)
+        result = [image_store.url(image) for image in images]
+        indexed = {image.name for image in images}
+        
+        # Blobs at the top level of the container; content/, variants/ and uploads/ aren't images by name
+        if len(result) < max_results and azure_storage.initialized:
+            container_url = f"{azure_storage.blob_service_client.url}{azure_storage.container_name}/"
+            for blob in azure_storage.list_image_properties():
+                if len(result) >= max_results:
+                    break
+                if "/" not in blob.name and blob.name not in indexed:
+                    result.append(container_url + blob.name)
         
-        # Add local files if needed or if Azure failed
-        if not result or not blob_service_client:
-            if os.path.exists(LOCAL_IMAGE_DIR):
-                local_files = os.listdir(LOCAL_IMAGE_DIR)
-                for file in local_files[:max_results]:
-                    if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
-                        result.append(f"/static/images/{file}")
+        # Local names of indexed images are links to their content, so only the others are added
+        if len(result) < max_results and os.path.exists(LOCAL_IMAGE_DIR):
+            for file in sorted(os.listdir(LOCAL_IMAGE_DIR)):
+                if len(result) >= max_results:
+                    break
+                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')) and file not in indexed:
+                    result.append(f"/static/images/{file}")
         
         return result
         
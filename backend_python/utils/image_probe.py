@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from utils.http_client import outbound_http
+
+logger = logging.getLogger(__name__)
+
+class ImageUrlProber:
+    """
+    Checks whether image URLs are reachable, with a bounded TTL cache of verdicts.
+
+    A probe is a HEAD request through the shared "image_probe" HTTP pool,
+    falling back to a one-byte ranged GET for hosts that reject HEAD. A URL
+    is good if it answers 2xx with an image (or unspecified) content type.
+    Bad verdicts are cached too, for a shorter time. Concurrent probes of the
+    same URL share one request.
+    """
+
+    def __init__(self,
+                 ttl: float = None,
+                 negative_ttl: float = None,
+                 max_entries: int = None):
+        self.ttl = ttl or float(os.environ.get("IMAGE_PROBE_TTL", 3600))
+        self.negative_ttl = negative_ttl or float(os.environ.get("IMAGE_PROBE_NEGATIVE_TTL", 600))
+        self.max_entries = max_entries or int(os.environ.get("IMAGE_PROBE_CACHE_SIZE", 10000))
+        self._verdicts: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.probes = 0
+        self.cache_hits = 0
+
+    def cached_verdict(self, url: str) -> Optional[bool]:
+        """Return the cached verdict for url, or None if it is unknown or expired."""
+        cached = self._verdicts.get(url)
+        if cached is None:
+            return None
+        verdict, expires_at = cached
+        if expires_at <= time.time():
+            del self._verdicts[url]
+            return None
+        self._verdicts.move_to_end(url)
+        self.cache_hits += 1
+        return verdict
+
+    async def probe(self, url: str) -> bool:
+        """Return whether url serves an image, probing it unless a verdict is cached."""
+        verdict = self.cached_verdict(url)
+        if verdict is not None:
+            return verdict
+        task = self._in_flight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._probe(url))
+            self._in_flight[url] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(url, None))
+        return await asyncio.shield(task)
+
+    def probe_in_background(self, url: str) -> None:
+        """Start probing url without waiting, so a later cached_verdict() can answer."""
+        if not url or url in self._in_flight or self.cached_verdict(url) is not None:
+            return
+        task = asyncio.ensure_future(self._probe(url))
+        self._in_flight[url] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(url, None))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cached_verdicts": len(self._verdicts),
+            "probes": self.probes,
+            "cache_hits": self.cache_hits,
+            "in_flight": len(self._in_flight),
+        }
+
+    async def _probe(self, url: str) -> bool:
+        self.probes += 1
+        try:
+            response = await outbound_http.request("image_probe", "HEAD", url, follow_redirects=True)
+            if response.status_code in (403, 405, 501):
+                response = await outbound_http.request(
+                    "image_probe", "GET", url, headers={"Range": "bytes=0-0"}, follow_redirects=True
+                )
+            content_type = response.headers.get("content-type", "image/")
+            verdict = response.is_success and content_type.startswith("image/")
+        except (httpx.HTTPError, ValueError) as e:
+            logger.info(f"Image URL {url} failed probe: {e}")
+            verdict = False
+
+        if not verdict:
+            logger.warning(f"Image URL {url} is not accessible")
+        self._store(url, verdict)
+        return verdict
+
+    def _store(self, url: str, verdict: bool) -> None:
+        ttl = self.ttl if verdict else self.negative_ttl
+        self._verdicts[url] = (verdict, time.time() + ttl)
+        self._verdicts.move_to_end(url)
+        while len(self._verdicts) > self.max_entries:
+            self._verdicts.popitem(last=False)
+
+# Create a singleton instance
+image_prober = ImageUrlProber()
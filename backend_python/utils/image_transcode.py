@@ -0,0 +1,66 @@
+import io
+import time
+from typing import Tuple
+
+from PIL import Image, ImageOps, features
+
+# Refuse to decode anything larger (decompression bombs); a 50 MP photo is far past any upload
+Image.MAX_IMAGE_PIXELS = 50_000_000
+
+# format name -> (Pillow format, Content-Type, file extension)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", "webp"),
+    "avif": ("AVIF", "image/avif", "avif"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+def available_formats() -> Tuple[str, ...]:
+    """Output formats this Pillow build can encode."""
+    return tuple(name for name in FORMATS if name == "jpeg" or features.check(name))
+
+def transcode(data: bytes, width: int, quality: int, fmt: str) -> Tuple[bytes, float]:
+    """
+    Resize an image to at most `width` pixels wide and encode it as `fmt`
+
+    Runs in a worker process: it is CPU-bound and holds the GIL. Images
+    are never upscaled, EXIF orientation is applied, and JPEG sources are
+    decoded at a reduced scale when the target is much smaller.
+
+    Args:
+        data: Source image content in any format Pillow reads
+        width: Largest width of the result in pixels
+        quality: Encoder quality, 1-100
+        fmt: One of FORMATS
+
+    Returns:
+        The encoded image and the CPU seconds spent on it
+
+    Raises:
+        PIL.UnidentifiedImageError: data is not an image
+        PIL.Image.DecompressionBombError: the image has too many pixels
+    """
+    started = time.process_time()
+    pillow_format = FORMATS[fmt][0]
+    with Image.open(io.BytesIO(data)) as source:
+        # Only JPEG decoders support this; others ignore it. Both sides stay
+        # at least `width`, so it holds whatever the EXIF orientation.
+        source.draft("RGB", (width, width))
+        image = ImageOps.exif_transpose(source)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+        if pillow_format == "JPEG" or not has_alpha:
+            image = image.convert("RGB") if image.mode != "RGB" else image
+        elif image.mode != "RGBA":
+            image = image.convert("RGBA")
+
+        out = io.BytesIO()
+        if pillow_format == "JPEG":
+            image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        elif pillow_format == "WEBP":
+            image.save(out, "WEBP", quality=quality, method=4)
+        else:
+            image.save(out, pillow_format, quality=quality)
+    return out.getvalue(), time.process_time() - started
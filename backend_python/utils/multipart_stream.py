@@ -0,0 +1,193 @@
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from multipart.multipart import parse_options_header
+from starlette.requests import Request
+
+# Most bytes of headers a part may have
+MAX_HEADER_BYTES = 16 * 1024
+
+class MultipartError(ValueError):
+    """The request body isn't valid multipart/form-data."""
+
+class BodyTooLarge(MultipartError):
+    """The request body is, or announces it is, larger than allowed."""
+
+class FormPart:
+    """One part of a multipart body; its content is read with chunks() or text()."""
+
+    def __init__(self, reader: "MultipartReader", headers: Dict[bytes, bytes]):
+        self._reader = reader
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        self.name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        self.filename = filename.decode("utf-8", "replace") if filename is not None else None
+        content_type = headers.get(b"content-type")
+        self.content_type = content_type.decode("latin-1") if content_type else None
+        self.done = False
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """The part's content as it arrives, in the pieces the client sent it in."""
+        while not self.done:
+            event, data = await self._reader._next_event()
+            if event == "data":
+                yield data
+            elif event == "end":
+                self.done = True
+            else:
+                raise MultipartError("Multipart body ended inside a part")
+
+    async def text(self, max_bytes: int = 65536) -> str:
+        """The whole content of a form field, decoded as UTF-8."""
+        value = bytearray()
+        async for chunk in self.chunks():
+            value += chunk
+            if len(value) > max_bytes:
+                raise BodyTooLarge(f"Form field {self.name!r} is larger than {max_bytes} bytes")
+        return value.decode("utf-8", "replace")
+
+class MultipartReader:
+    """
+    Parses a multipart/form-data request body as it arrives, part by part.
+
+    Unlike Starlette's form parsing, nothing is buffered or spooled to a
+    temporary file: a part's content is handed out chunk by chunk as it
+    is read from the connection, so a handler can stream a file upload
+    and stop reading as soon as it goes wrong. The body is limited to
+    `max_bytes`; a larger Content-Length is refused before anything is
+    read, and a body that grows past it (e.g. chunked) stops being read.
+
+    Part content is split on the boundary with bytes.find, so scanning a
+    file costs a memchr-speed search per received chunk on the event
+    loop rather than python-multipart's per-byte state machine, which
+    steps through every CR in binary data in Python.
+
+    Usage:
+        reader = MultipartReader(request, max_bytes)
+        async for part in reader.parts():
+            if part.filename is not None:
+                async for chunk in part.chunks():
+                    ...
+            else:
+                value = await part.text()
+
+    Parts are read in order; whatever a handler leaves of a part is
+    skipped when it asks for the next one.
+
+    Raises:
+        BodyTooLarge: Past `max_bytes`
+        MultipartError: Not multipart/form-data, or a malformed body
+    """
+
+    def __init__(self, request: Request, max_bytes: int):
+        content_type, options = parse_options_header(request.headers.get("content-type", ""))
+        boundary = options.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise MultipartError("Expected a multipart/form-data body")
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            raise BodyTooLarge(f"Request body is larger than {max_bytes} bytes")
+
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self._stream = request.stream()
+        self._events: Deque[Tuple[str, Optional[object]]] = deque()
+        self._finished = False
+        self._part: Optional[FormPart] = None
+        # Every delimiter, the first one included once the body is prefixed with CRLF
+        self._delimiter = b"\r\n--" + boundary
+        self._buffer = b"\r\n"
+        self._state = "preamble"  # then "delimiter", "headers", "data", ... and finally "epilogue"
+
+    async def parts(self) -> AsyncIterator[FormPart]:
+        while True:
+            if self._part is not None and not self._part.done:
+                async for _ in self._part.chunks():
+                    pass
+            event, data = await self._next_event()
+            while event not in ("headers", "eof"):
+                event, data = await self._next_event()
+            if event == "eof":
+                return
+            self._part = FormPart(self, data)
+            yield self._part
+
+    async def _next_event(self) -> Tuple[str, Optional[object]]:
+        while not self._events:
+            if self._finished:
+                return "eof", None
+            try:
+                chunk = await self._stream.__anext__()
+            except StopAsyncIteration:
+                self._finished = True
+                continue
+            self.bytes_read += len(chunk)
+            if self.bytes_read > self.max_bytes:
+                raise BodyTooLarge(f"Request body is larger than {self.max_bytes} bytes")
+            self._feed(chunk)
+        return self._events.popleft()
+
+    def _feed(self, chunk: bytes) -> None:
+        """Parse what can be parsed of the body so far into events; keep the rest for the next chunk."""
+        if self._state == "epilogue":
+            return
+        buffer = self._buffer + chunk if self._buffer else chunk
+        position = 0
+        while True:
+            if self._state in ("preamble", "data"):
+                end = buffer.find(self._delimiter, position)
+                if end < 0:
+                    # All but what could be the start of a delimiter split across chunks
+                    keep = max(position, len(buffer) - len(self._delimiter) + 1)
+                    if self._state == "data" and keep > position:
+                        self._events.append(("data", buffer[position:keep]))
+                    position = keep
+                    break
+                if self._state == "data":
+                    if end > position:
+                        self._events.append(("data", buffer[position:end]))
+                    self._events.append(("end", None))
+                position = end + len(self._delimiter)
+                self._state = "delimiter"
+            elif self._state == "delimiter":
+                if buffer.startswith(b"--", position):
+                    self._state = "epilogue"
+                    position = len(buffer)
+                    break
+                line_end = buffer.find(b"\r\n", position)
+                if line_end < 0:
+                    if len(buffer) - position > 1024:
+                        raise MultipartError("Malformed multipart body: no line break after the boundary")
+                    break
+                if buffer[position:line_end].strip(b" \t"):
+                    raise MultipartError("Malformed multipart body: unexpected data after the boundary")
+                position = line_end + 2
+                self._state = "headers"
+            elif self._state == "headers":
+                if buffer.startswith(b"\r\n", position):
+                    headers_end = position
+                else:
+                    headers_end = buffer.find(b"\r\n\r\n", position)
+                    if headers_end < 0:
+                        if len(buffer) - position > MAX_HEADER_BYTES:
+                            raise MultipartError("Malformed multipart body: part headers too large")
+                        break
+                    headers_end += 2
+                self._events.append(("headers", self._parse_headers(buffer[position:headers_end])))
+                position = headers_end + 2
+                self._state = "data"
+            else:
+                break
+        self._buffer = buffer[position:]
+
+    @staticmethod
+    def _parse_headers(block: bytes) -> Dict[bytes, bytes]:
+        headers = {}
+        for line in block.split(b"\r\n"):
+            if not line:
+                continue
+            field, colon, value = line.partition(b":")
+            if not colon:
+                raise MultipartError(f"Malformed multipart body: bad part header {line[:100]!r}")
+            headers[field.strip().lower()] = value.strip()
+        return headers
@@ -0,0 +1,209 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Characters that change parser state outside / inside a JSON string
+_STRUCTURAL = re.compile(r'[{}\[\]",]')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+_CLOSERS = {"{": "}", "[": "]"}
+_LIST_FIELDS = ("openingHours", "highlights", "menuItems")
+
+def _loads_lenient(text: str) -> Any:
+    """json.loads that also accepts trailing commas, which LLMs like to emit."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text))
+
+class RestaurantStreamParser:
+    """
+    Incremental, tolerant parser for the restaurant JSON object in an LLM completion.
+
+    Feed completion text as it arrives; each call to feed() returns the
+    top-level fields that finished in that chunk as (key, value) pairs.
+    Anything before the first "{" (markdown fences, prose) and after the
+    closing "}" is ignored. finish() returns the whole object, recovering a
+    completion cut off by max_tokens by dropping the unfinished tail and
+    closing any open arrays and objects.
+
+    Usage:
+        parser = RestaurantStreamParser()
+        for chunk in chunks:
+            for key, value in parser.feed(chunk):
+                ...
+        restaurant = parser.finish()
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self.recovered = False
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._field_start = 0
+        # Last offset where the text can be cut and closed into valid JSON
+        self._safe_cut = 0
+        self._safe_stack: Tuple[str, ...] = ()
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk of completion text and return newly finished top-level fields."""
+        if self.complete or not chunk:
+            return []
+
+        if not self._started:
+            start = chunk.find("{")
+            if start < 0:
+                return []
+            chunk = chunk[start:]
+            self._started = True
+
+        self._buf += chunk
+        return self._scan()
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """
+        Return the parsed restaurant dict, or None if nothing usable was found.
+
+        Sets `recovered` when the object had to be repaired because the
+        completion was truncated or a field was malformed.
+        """
+        if not self._started:
+            return None
+
+        if not self.complete:
+            self.recovered = True
+            closers = "".join(_CLOSERS[c] for c in reversed(self._safe_stack))
+            text = _TRAILING_COMMA.sub(r"\1", self._buf[:self._safe_cut].rstrip().rstrip(",") + closers)
+            try:
+                repaired = _loads_lenient(text)
+            except json.JSONDecodeError:
+                repaired = None
+            if isinstance(repaired, dict):
+                for key, value in repaired.items():
+                    self.fields.setdefault(key, value)
+
+        return _normalize(self.fields) if self.fields else None
+
+    def _scan(self) -> List[Tuple[str, Any]]:
+        emitted = []
+        buf = self._buf
+        pos = self._pos
+
+        while True:
+            if self._in_string:
+                match = _STRING_SPECIAL.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buf):
+                        # Escape split across chunks: rescan it next time
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                continue
+
+            match = _STRUCTURAL.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char = match.group()
+            pos = match.end()
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._stack.append(char)
+                if len(self._stack) == 1:
+                    self._field_start = pos
+                self._mark_safe(pos)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self._emit_field(buf[self._field_start:pos - 1], emitted)
+                    self.complete = True
+                    break
+                self._mark_safe(pos)
+            elif char == ",":
+                if len(self._stack) == 1:
+                    self._emit_field(buf[self._field_start:pos - 1], emitted)
+                    self._field_start = pos
+                self._mark_safe(pos - 1)
+
+        self._pos = pos
+        return emitted
+
+    def _mark_safe(self, cut: int) -> None:
+        self._safe_cut = cut
+        self._safe_stack = tuple(self._stack)
+
+    def _emit_field(self, text: str, emitted: List[Tuple[str, Any]]) -> None:
+        if not text.strip():
+            return
+        try:
+            parsed = _loads_lenient("{" + text + "}")
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed field in LLM output: {text[:80]!r}")
+            self.recovered = True
+            return
+        for key, value in parsed.items():
+            self.fields[key] = value
+            emitted.append((key, value))
+
+def _normalize(restaurant: Dict[str, Any]) -> Dict[str, Any]:
+    """Coerce the shapes the Restaurant schema needs and drop partial menu entries."""
+    for key in _LIST_FIELDS:
+        if key in restaurant and not isinstance(restaurant[key], list):
+            restaurant[key] = [restaurant[key]] if restaurant[key] else []
+    if "menuItems" in restaurant:
+        restaurant["menuItems"] = [
+            item for item in restaurant["menuItems"]
+            if isinstance(item, dict) and item.get("name")
+        ]
+    if "rating" in restaurant:
+        try:
+            restaurant["rating"] = min(max(float(restaurant["rating"]), 0.0), 5.0)
+        except (TypeError, ValueError):
+            del restaurant["rating"]
+    return restaurant
+
+def parse_restaurant_json(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a complete LLM completion into a restaurant dict, tolerating fences and truncation.
+
+    Returns None if the text contains no usable JSON object.
+    """
+    parser = RestaurantStreamParser()
+    parser.feed(text)
+    restaurant = parser.finish()
+    if parser.recovered:
+        logger.warning("Recovered restaurant JSON from malformed or truncated LLM output")
+    return restaurant
+
+def parse_restaurant_list_json(text: str, key: str = "restaurants") -> List[Dict[str, Any]]:
+    """
+    Parse a batched completion of the form {"restaurants": [...]} into restaurant dicts.
+
+    Entries cut off by truncation are kept only if they already have a name.
+    """
+    parser = RestaurantStreamParser()
+    parser.feed(text)
+    payload = parser.finish() or {}
+    if parser.recovered:
+        logger.warning("Recovered restaurant list JSON from malformed or truncated LLM output")
+    return [
+        _normalize(restaurant) for restaurant in payload.get(key) or []
+        if isinstance(restaurant, dict) and restaurant.get("name")
+    ]